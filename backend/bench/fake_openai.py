@@ -0,0 +1,206 @@
+"""Local stand-in for the OpenAI endpoints used by services.openai_service.
+
+Run it with ``uvicorn bench.fake_openai:app --port 8765`` and point the API
+at it with ``OPENAI_BASE_URL=http://127.0.0.1:8765/v1``. Latency, streaming
+pace and error injection are read from ``FAKE_OPENAI_*`` variables at
+startup and can be changed while running with ``POST /_control``::
+
+    curl -X POST localhost:8765/_control -d '{"chat_latency": 2.0, "error_rate": 0.05}'
+
+Responses are deterministic apart from the injected jitter and errors, so
+benchmark runs are comparable with each other.
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import base64
+import json
+import os
+import random
+import struct
+import time
+import zlib
+
+
+def _env(name: str, default: str) -> float:
+    return float(os.getenv(f"FAKE_OPENAI_{name.upper()}", default))
+
+
+config = {
+    # seconds before the response (or first stream chunk) is sent
+    "chat_latency": _env("chat_latency", "0.8"),
+    "image_latency": _env("image_latency", "4.0"),
+    "tts_latency": _env("tts_latency", "0.5"),
+    # +/- fraction applied to every latency
+    "jitter": _env("jitter", "0.2"),
+    # streamed chat: number of delta chunks and the pause between them
+    "stream_chunks": _env("stream_chunks", "60"),
+    "chunk_interval": _env("chunk_interval", "0.02"),
+    # TTS body size and pace
+    "tts_bytes": _env("tts_bytes", "240000"),
+    "tts_chunk_interval": _env("tts_chunk_interval", "0.01"),
+    # probability of a 500, a 429 (with Retry-After) or a hang past the client timeout
+    "error_rate": _env("error_rate", "0"),
+    "rate_limit_rate": _env("rate_limit_rate", "0"),
+    "timeout_rate": _env("timeout_rate", "0"),
+}
+counters = {"chat": 0, "image": 0, "tts": 0, "errors": 0}
+
+app = FastAPI()
+
+_STORY = (
+    "Det var en gång en liten räv som hette Ruffe. Han bodde i en stor skog full av höga granar. "
+    "En morgon hittade han en glittrande sten vid bäcken och bestämde sig för att ta reda på var den kom ifrån. "
+    "På vägen träffade han en klok uggla, en blyg igelkott och en pratglad ekorre som alla ville hjälpa till. "
+    "Tillsammans klättrade de upp på berget där solen gick upp, och där fann de stenens hem: en grotta full av ljus. "
+    "Ruffe lämnade tillbaka stenen och gick hem, glad över sina nya vänner."
+)
+_IMAGE_PROMPTS = [
+    "En liten röd räv hittar en glittrande sten vid en bäck",
+    "Räven, ugglan, igelkotten och ekorren vandrar genom skogen",
+    "Vännerna står vid en ljus grotta på toppen av berget",
+    "Räven går hem i solnedgången",
+    "Ugglan sitter på en gren och ler",
+    "Ekorren hoppar mellan granarna",
+]
+_pngs: dict = {}
+
+
+def _png(width: int, height: int) -> bytes:
+    """Solid-colour PNG of the requested size, so decoders downstream do real work."""
+    key = (width, height)
+    if key not in _pngs:
+        row = b"\x00" + bytes((255, 200, 120)) * width
+        raw = zlib.compress(row * height, 6)
+
+        def chunk(tag: bytes, data: bytes) -> bytes:
+            return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+        _pngs[key] = (
+            b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", raw)
+            + chunk(b"IEND", b"")
+        )
+    return _pngs[key]
+
+
+def _latency(name: str) -> float:
+    base = config[f"{name}_latency"]
+    return max(0.0, base * random.uniform(1 - config["jitter"], 1 + config["jitter"]))
+
+
+async def _injected_failure():
+    roll = random.random()
+    if roll < config["error_rate"]:
+        counters["errors"] += 1
+        return JSONResponse({"error": {"message": "injected failure", "type": "server_error"}}, status_code=500)
+    roll -= config["error_rate"]
+    if roll < config["rate_limit_rate"]:
+        counters["errors"] += 1
+        return JSONResponse(
+            {"error": {"message": "injected rate limit", "type": "rate_limit_error"}},
+            status_code=429,
+            headers={"Retry-After": "1"},
+        )
+    roll -= config["rate_limit_rate"]
+    if roll < config["timeout_rate"]:
+        counters["errors"] += 1
+        await asyncio.sleep(3600)
+    return None
+
+
+def _usage(messages: list, completion: str) -> dict:
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+    completion_tokens = len(completion) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _completion_text(messages: list) -> str:
+    system = (messages[0].get("content") or "") if messages else ""
+    if "bildprompt" in system:
+        user = messages[-1].get("content") or ""
+        count = next((int(w) for w in user.split() if w.isdigit()), 3)
+        return "\n".join(_IMAGE_PROMPTS[: max(1, min(count, len(_IMAGE_PROMPTS)))])
+    return _STORY
+
+
+@app.post("/_control")
+async def control(request: Request):
+    config.update({k: float(v) for k, v in (await request.json()).items() if k in config})
+    return {"config": config, "counters": counters}
+
+
+@app.get("/_control")
+async def control_state():
+    return {"config": config, "counters": counters}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    counters["chat"] += 1
+    failure = await _injected_failure()
+    if failure is not None:
+        return failure
+    messages = body.get("messages", [])
+    text = _completion_text(messages)
+    await asyncio.sleep(_latency("chat"))
+    base = {"id": f"chatcmpl-{counters['chat']}", "created": int(time.time()), "model": body.get("model", "fake")}
+    if not body.get("stream"):
+        return {
+            **base,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+            "usage": _usage(messages, text),
+        }
+
+    async def events():
+        n = max(1, int(config["stream_chunks"]))
+        step = -(-len(text) // n)
+        for i in range(0, len(text), step):
+            chunk = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": text[i : i + step]}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(config["chunk_interval"])
+        done = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(done)}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': _usage(messages, text)})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/v1/images/generations")
+async def images_generations(request: Request):
+    body = await request.json()
+    counters["image"] += 1
+    failure = await _injected_failure()
+    if failure is not None:
+        return failure
+    width, _, height = (body.get("size") or "1024x1024").partition("x")
+    png = _png(int(width or 1024), int(height or width or 1024))
+    await asyncio.sleep(_latency("image"))
+    return {"created": int(time.time()), "data": [{"b64_json": base64.b64encode(png).decode()}]}
+
+
+@app.post("/v1/audio/speech")
+async def audio_speech(request: Request):
+    await request.json()
+    counters["tts"] += 1
+    failure = await _injected_failure()
+    if failure is not None:
+        return failure
+    await asyncio.sleep(_latency("tts"))
+
+    async def body():
+        remaining = int(config["tts_bytes"])
+        # ID3 header so the payload at least looks like an MP3 to sniffers
+        yield b"ID3\x04\x00\x00\x00\x00\x00\x00"
+        while remaining > 0:
+            size = min(16384, remaining)
+            yield b"\xff\xfb\x90\x00" + b"\x00" * (size - 4)
+            remaining -= size
+            await asyncio.sleep(config["tts_chunk_interval"])
+
+    return StreamingResponse(body(), media_type="audio/mpeg")
@@ -0,0 +1,254 @@
+"""Open-loop HTTP load generator.
+
+Requests are started on a fixed schedule (``rps``) regardless of how fast
+earlier ones complete, and latency is measured from the scheduled start, so
+a stalled server shows up as queueing delay instead of silently lowering the
+offered load (coordinated omission).
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import itertools
+import math
+import random
+import time
+
+import httpx
+
+
+@dataclass
+class Sample:
+    operation: str
+    status: int
+    latency: float
+    first_byte: float
+
+
+@dataclass
+class Session:
+    """Users and stories created during setup and shared by the operations."""
+
+    users: List[dict] = field(default_factory=list)
+    story_ids: List[int] = field(default_factory=list)
+    universal_ids: List[str] = field(default_factory=list)
+
+    def user(self) -> dict:
+        return random.choice(self.users)
+
+    def owned_story(self) -> tuple[dict, Optional[int]]:
+        """A user together with one of their own stories (reads are owner-only)."""
+        owners = [u for u in self.users if u["stories"]]
+        if not owners:
+            return self.user(), None
+        user = random.choice(owners)
+        return user, random.choice(user["stories"])
+
+
+BATCH_SIZE = 10
+_PROMPTS = ["en drake som är rädd för mörkret", "en katt som vill bli astronaut", "en robot som lär sig baka", "en liten båt på stora havet"]
+
+
+def _auth(user: dict) -> dict:
+    return {"Authorization": f"Bearer {user['token']}"}
+
+
+async def _send(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> tuple[int, float]:
+    """Send a request and read the whole body; returns the status and time to headers."""
+    start = time.perf_counter()
+    async with client.stream(method, url, **kwargs) as response:
+        first_byte = time.perf_counter() - start
+        async for _ in response.aiter_raw():
+            pass
+    return response.status_code, first_byte
+
+
+async def op_login(client: httpx.AsyncClient, session: Session):
+    user = session.user()
+    return await _send(client, "POST", "/login", json={"username": user["username"], "password": user["password"]})
+
+
+async def op_create_story(client: httpx.AsyncClient, session: Session, user: Optional[dict] = None):
+    user = user or session.user()
+    response = await client.post("/stories", json={"prompt": random.choice(_PROMPTS), "storyType": "custom"}, headers=_auth(user))
+    if response.status_code == 200:
+        story_id = response.json()["id"]
+        user["stories"].append(story_id)
+        session.story_ids.append(story_id)
+    return response.status_code, response.elapsed.total_seconds()
+
+
+async def op_batch_stories(client: httpx.AsyncClient, session: Session):
+    stories = [{"prompt": random.choice(_PROMPTS), "storyType": "custom"} for _ in range(BATCH_SIZE)]
+    return await _send(client, "POST", "/stories/batch", json={"stories": stories}, headers=_auth(session.user()))
+
+
+async def op_stream_story(client: httpx.AsyncClient, session: Session):
+    return await _send(client, "POST", "/stories/stream", json={"prompt": random.choice(_PROMPTS)}, headers=_auth(session.user()))
+
+
+async def op_list_stories(client: httpx.AsyncClient, session: Session):
+    return await _send(client, "GET", "/stories", params={"limit": 20}, headers=_auth(session.user()))
+
+
+async def op_get_story(client: httpx.AsyncClient, session: Session):
+    user, story_id = session.owned_story()
+    return await _send(client, "GET", f"/stories/{story_id}", headers=_auth(user))
+
+
+async def op_universal_list(client: httpx.AsyncClient, session: Session):
+    return await _send(client, "GET", "/universal-stories", headers={"Accept-Encoding": "gzip"})
+
+
+async def op_story_images(client: httpx.AsyncClient, session: Session):
+    user, story_id = session.owned_story()
+    return await _send(client, "POST", f"/stories/{story_id}/images", params={"num_images": 2}, headers=_auth(user))
+
+
+async def op_story_tts(client: httpx.AsyncClient, session: Session):
+    voice = random.choice(["alloy", "nova"])
+    user, story_id = session.owned_story()
+    return await _send(client, "GET", f"/stories/{story_id}/tts", params={"voice": voice}, headers=_auth(user))
+
+
+async def op_universal_tts(client: httpx.AsyncClient, session: Session):
+    if not session.universal_ids:
+        return await op_universal_list(client, session)
+    return await _send(client, "GET", f"/universal-stories/{random.choice(session.universal_ids)}/tts")
+
+
+Operation = Callable[[httpx.AsyncClient, Session], Awaitable[tuple]]
+
+OPERATIONS: Dict[str, Operation] = {
+    "login": op_login,
+    "create_story": op_create_story,
+    "batch_stories": op_batch_stories,
+    "stream_story": op_stream_story,
+    "list_stories": op_list_stories,
+    "get_story": op_get_story,
+    "universal_list": op_universal_list,
+    "story_images": op_story_images,
+    "story_tts": op_story_tts,
+    "universal_tts": op_universal_tts,
+}
+
+# Relative weights per operation
+MIXES: Dict[str, Dict[str, int]] = {
+    # roughly what the frontend does: browsing dominates, generation is the expensive tail
+    "default": {
+        "login": 5, "create_story": 10, "stream_story": 5, "list_stories": 30, "get_story": 10,
+        "universal_list": 20, "story_images": 5, "story_tts": 10, "universal_tts": 5,
+    },
+    "read": {"login": 5, "list_stories": 45, "get_story": 20, "universal_list": 30},
+    "generate": {"create_story": 30, "stream_story": 20, "story_images": 25, "story_tts": 25},
+    "auth": {"login": 100},
+    # a class creating stories together: one batch request vs. the same stories one by one
+    "batch": {"batch_stories": 100},
+    "single": {"create_story": 100},
+}
+
+
+async def setup_session(client: httpx.AsyncClient, users: int, stories_per_user: int, concurrency: int = 16) -> Session:
+    session = Session()
+    run_id = f"{int(time.time())}{random.randint(0, 999):03d}"
+    gate = asyncio.Semaphore(concurrency)
+
+    async def make_user(i: int) -> None:
+        username, password = f"bench{run_id}_{i}", "bench-password"
+        async with gate:
+            response = await client.post("/register", json={"username": username, "password": password})
+            response.raise_for_status()
+            response = await client.post("/login", json={"username": username, "password": password})
+            response.raise_for_status()
+            user = {**response.json(), "username": username, "password": password, "stories": []}
+            session.users.append(user)
+            for _ in range(stories_per_user):
+                await op_create_story(client, session, user)
+
+    await asyncio.gather(*(make_user(i) for i in range(users)))
+    response = await client.get("/universal-stories")
+    if response.status_code == 200:
+        session.universal_ids = [s["id"] for s in response.json()["stories"]]
+    return session
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    session: Session,
+    mix: Dict[str, int],
+    rps: float,
+    duration: float,
+    max_in_flight: int = 1000,
+) -> tuple[List[Sample], int]:
+    """Offer ``rps`` requests per second for ``duration`` seconds.
+
+    Returns the samples and how many requests were dropped because
+    ``max_in_flight`` were already outstanding.
+    """
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    samples: List[Sample] = []
+    in_flight: set = set()
+    dropped = 0
+
+    async def one(name: str, scheduled: float) -> None:
+        try:
+            status, first_byte = await OPERATIONS[name](client, session)
+        except httpx.HTTPError:
+            status, first_byte = 0, math.nan
+        samples.append(Sample(name, status, time.perf_counter() - scheduled, first_byte))
+
+    start = time.perf_counter()
+    for i in itertools.count():
+        scheduled = start + i / rps
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= max_in_flight:
+            dropped += 1
+            continue
+        task = asyncio.ensure_future(one(random.choices(names, weights)[0], scheduled))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.wait(in_flight)
+    return samples, dropped
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def summarize(samples: List[Sample], elapsed: float) -> dict:
+    by_operation: Dict[str, List[Sample]] = {}
+    for s in samples:
+        by_operation.setdefault(s.operation, []).append(s)
+    operations = {}
+    for name, group in sorted(by_operation.items()):
+        ok = [s.latency for s in group if 200 <= s.status < 400]
+        operations[name] = {
+            "count": len(group),
+            "errors": len(group) - len(ok),
+            "statuses": {str(k): v for k, v in sorted(Counter(s.status for s in group).items())},
+            "rps": round(len(group) / elapsed, 2),
+            "p50": round(percentile(ok, 0.50), 4),
+            "p95": round(percentile(ok, 0.95), 4),
+            "p99": round(percentile(ok, 0.99), 4),
+            "max": round(max(ok), 4) if ok else math.nan,
+            "first_byte_p95": round(percentile([s.first_byte for s in group if not math.isnan(s.first_byte)], 0.95), 4),
+        }
+    all_ok = [s.latency for s in samples if 200 <= s.status < 400]
+    return {
+        "requests": len(samples),
+        "errors": sum(o["errors"] for o in operations.values()),
+        "throughput": round(len(all_ok) / elapsed, 2),
+        "p50": round(percentile(all_ok, 0.50), 4),
+        "p95": round(percentile(all_ok, 0.95), 4),
+        "p99": round(percentile(all_ok, 0.99), 4),
+        "operations": operations,
+    }
@@ -0,0 +1,256 @@
+"""Benchmark the API end to end, offline.
+
+Usage (from backend/):
+
+    python -m bench.run --mix default --rps 20 --duration 60
+    python -m bench.run --mix read --rps 200 --workers 4 --json out.json
+    python -m bench.run --mix generate --async-mode --baseline out.json
+
+Starts an ephemeral Postgres (bench.postgres), the fake OpenAI server
+(bench.fake_openai) and the API under uvicorn, registers users, seeds
+stories, then offers the chosen request mix at a fixed rate. Reports
+p50/p95/p99 latency per operation, throughput, API memory (RSS across
+uvicorn workers) and database connection counts. With ``--baseline`` the
+run fails if any operation's p95 regressed by more than
+``--max-regression``.
+"""
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Iterator, List
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import psycopg2
+
+from bench import loadgen
+from bench.postgres import ephemeral_postgres, free_port
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _wait_http(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{url} did not come up within {timeout}s")
+        time.sleep(0.2)
+
+
+@contextmanager
+def _server(app: str, port: int, env: dict, workers: int = 1, log: Path | None = None) -> Iterator[subprocess.Popen]:
+    out = open(log, "wb") if log else subprocess.DEVNULL
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--no-access-log"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=out,
+        stderr=subprocess.STDOUT,
+    )
+    try:
+        _wait_http(f"http://127.0.0.1:{port}/docs" if app.startswith("bench") else f"http://127.0.0.1:{port}/health")
+        yield proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        if log:
+            out.close()
+
+
+def _rss_bytes(pid: int) -> int:
+    """Resident memory of ``pid`` and its children (uvicorn workers), from /proc."""
+    pids, total = [pid], 0
+    try:
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                            pids.append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    continue
+        for p in pids:
+            try:
+                with open(f"/proc/{p}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) * 1024
+            except OSError:
+                continue
+    except OSError:
+        return 0
+    return total
+
+
+async def _sample_resources(api_pid: int, db_env: dict, stop: asyncio.Event, interval: float = 1.0) -> dict:
+    """Poll API memory and Postgres connections until ``stop`` is set."""
+    rss: List[int] = []
+    db_connections: List[int] = []
+    conn = psycopg2.connect(
+        host=db_env["DB_HOST"], port=db_env["DB_PORT"], dbname=db_env["DB_NAME"], user=db_env["DB_USER"], password=db_env["DB_PASS"]
+    )
+    conn.autocommit = True
+
+    def sample() -> None:
+        rss.append(_rss_bytes(api_pid))
+        with conn.cursor() as cur:
+            # excludes this sampling connection
+            cur.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = %s AND pid <> pg_backend_pid()", (db_env["DB_NAME"],))
+            db_connections.append(cur.fetchone()[0])
+
+    try:
+        while not stop.is_set():
+            # off the event loop so sampling does not delay scheduled requests
+            await asyncio.to_thread(sample)
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        conn.close()
+    mib = 1024 * 1024
+    return {
+        "rss_mib_start": round(rss[0] / mib, 1) if rss else None,
+        "rss_mib_peak": round(max(rss) / mib, 1) if rss else None,
+        "rss_mib_end": round(rss[-1] / mib, 1) if rss else None,
+        "db_connections_peak": max(db_connections, default=0),
+        "db_connections_mean": round(sum(db_connections) / len(db_connections), 1) if db_connections else 0,
+    }
+
+
+async def _benchmark(args, base_url: str, api_pid: int, db_env: dict, fake_url: str) -> dict:
+    mix = loadgen.MIXES[args.mix]
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        session = await loadgen.setup_session(client, args.users, args.stories_per_user)
+        if args.warmup > 0:
+            await loadgen.run_load(client, session, mix, args.rps, args.warmup, args.max_in_flight)
+        stop = asyncio.Event()
+        sampler = asyncio.ensure_future(_sample_resources(api_pid, db_env, stop))
+        started = time.perf_counter()
+        samples, dropped = await loadgen.run_load(client, session, mix, args.rps, args.duration, args.max_in_flight)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        resources = await sampler
+        health = (await client.get("/health")).json()
+    upstream = httpx.get(f"{fake_url}/_control").json()["counters"]
+    return {
+        "config": {
+            "mix": args.mix, "rps": args.rps, "duration": args.duration, "workers": args.workers,
+            "async_mode": args.async_mode, "users": args.users,
+        },
+        "elapsed": round(elapsed, 2),
+        "dropped": dropped,
+        **loadgen.summarize(samples, elapsed),
+        "resources": resources,
+        "db_pool": health.get("db_pool"),
+        "upstream_calls": upstream,
+    }
+
+
+def _print_report(report: dict) -> None:
+    c = report["config"]
+    print(f"\nmix={c['mix']} rps={c['rps']} duration={c['duration']}s workers={c['workers']} async={c['async_mode']}")
+    print(f"{'operation':<16}{'count':>7}{'err':>6}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    rows = list(report["operations"].items()) + [("TOTAL", {**report, "count": report["requests"], "rps": report["throughput"], "max": math.nan})]
+    for name, o in rows:
+        print(f"{name:<16}{o['count']:>7}{o['errors']:>6}{o['rps']:>8}{o['p50']:>9}{o['p95']:>9}{o['p99']:>9}{o['max']:>9}")
+    r = report["resources"]
+    print(
+        f"\nthroughput {report['throughput']} req/s ok, dropped {report['dropped']}; "
+        f"RSS {r['rss_mib_start']} -> peak {r['rss_mib_peak']} MiB; "
+        f"DB connections peak {r['db_connections_peak']} (mean {r['db_connections_mean']})"
+    )
+    print(f"upstream calls: {report['upstream_calls']}")
+
+
+def _regressions(report: dict, baseline: dict, max_regression: float) -> List[str]:
+    found = []
+    for name, o in report["operations"].items():
+        before = baseline.get("operations", {}).get(name)
+        if not before or not before.get("p95") or math.isnan(before["p95"]) or math.isnan(o["p95"]):
+            continue
+        if o["p95"] > before["p95"] * (1 + max_regression):
+            found.append(f"{name}: p95 {before['p95']}s -> {o['p95']}s")
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline load test against a fake OpenAI backend")
+    parser.add_argument("--mix", choices=sorted(loadgen.MIXES), default="default")
+    parser.add_argument("--rps", type=float, default=20.0, help="offered requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds before the run")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--stories-per-user", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--async-mode", action="store_true", help="run the API with ASYNC_MODE=true")
+    parser.add_argument("--max-in-flight", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", type=Path, help="write the report here")
+    parser.add_argument("--baseline", type=Path, help="compare p95 per operation with an earlier --json report")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 increase over the baseline (0.2 = 20%%)")
+    parser.add_argument("--keep-logs", action="store_true", help="keep server logs in the temp directory")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-"))
+    try:
+        with ExitStack() as stack:
+            print("Starting Postgres...", flush=True)
+            db_env = stack.enter_context(ephemeral_postgres())
+            fake_port, api_port = free_port(), free_port()
+            fake_url = f"http://127.0.0.1:{fake_port}"
+            stack.enter_context(_server("bench.fake_openai:app", fake_port, dict(os.environ), log=workdir / "fake_openai.log"))
+            env = {
+                # a few bench users stand in for many real ones; anything exported by the caller wins
+                "USER_OPENAI_RPM": "100000",
+                **os.environ,
+                **db_env,
+                "OPENAI_API_KEY": "bench",
+                "OPENAI_BASE_URL": f"{fake_url}/v1",
+                "BLOB_DIR": str(workdir / "blobs"),
+                "ASYNC_MODE": "true" if args.async_mode else os.environ.get("ASYNC_MODE", "false"),
+            }
+            if args.workers > 1:
+                (workdir / "prometheus").mkdir()
+                env["PROMETHEUS_MULTIPROC_DIR"] = str(workdir / "prometheus")
+            print("Starting API...", flush=True)
+            api = stack.enter_context(_server("main:app", api_port, env, workers=args.workers, log=workdir / "api.log"))
+            print(f"Running {args.mix} at {args.rps} req/s for {args.duration}s...", flush=True)
+            report = asyncio.run(_benchmark(args, f"http://127.0.0.1:{api_port}", api.pid, db_env, fake_url))
+    finally:
+        if args.keep_logs:
+            print(f"Logs in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    _print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        regressions = _regressions(report, json.loads(args.baseline.read_text()), args.max_regression)
+        if regressions:
+            print("\nRegressions against baseline:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo p95 regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
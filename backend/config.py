@@ -5,22 +5,148 @@ class Settings:
     def __init__(self) -> None:
         # App
         self.cors_allow_origins: str = os.getenv("CORS_ALLOW_ORIGINS", "*")
+        # Serve story/image/TTS routes from async handlers (AsyncOpenAI + asyncpg)
+        self.async_mode: bool = os.getenv("ASYNC_MODE", "false").lower() in ("1", "true", "yes")
+        # Response compression (brotli when installed, else gzip) for JSON/text bodies of at least this size
+        self.response_compression: bool = os.getenv("RESPONSE_COMPRESSION", "true").lower() in ("1", "true", "yes")
+        self.compression_min_bytes: int = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+        self.gzip_level: int = int(os.getenv("GZIP_LEVEL", "6"))
+        self.brotli_quality: int = int(os.getenv("BROTLI_QUALITY", "5"))
+        # Image lists larger than this are streamed as an incrementally serialized JSON array
+        self.json_stream_min_bytes: int = int(os.getenv("JSON_STREAM_MIN_BYTES", "1048576"))
         # DB
         self.db_host: str = os.getenv("DB_HOST", "db")
+        self.db_port: int = int(os.getenv("DB_PORT", "5432"))
         self.db_name: str = os.getenv("DB_NAME", "stories")
         self.db_user: str = os.getenv("DB_USER", "user")
         self.db_pass: str = os.getenv("DB_PASS", "pass")
+        self.db_connect_timeout: int = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+        self.db_pool_min: int = int(os.getenv("DB_POOL_MIN", "2"))
+        self.db_pool_max: int = int(os.getenv("DB_POOL_MAX", "20"))
+        self.db_pool_timeout: float = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+        self.db_pool_max_lifetime: float = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+        self.db_pool_max_idle: float = float(os.getenv("DB_POOL_MAX_IDLE", "60"))
+        # asyncpg closes connections idle this long (it has no ping-after-idle like DB_POOL_MAX_IDLE)
+        self.db_pool_max_inactive: float = float(os.getenv("DB_POOL_MAX_INACTIVE", "300"))
+        # Blob storage for generated media ("local" filesystem or "s3"-compatible)
+        self.blob_backend: str = os.getenv("BLOB_BACKEND", "local").lower()
+        self.blob_dir: str = os.getenv("BLOB_DIR", "data/blobs")
+        self.s3_bucket: str = os.getenv("S3_BUCKET", "stories-media")
+        self.s3_prefix: str = os.getenv("S3_PREFIX", "")
+        self.s3_endpoint_url: str | None = os.getenv("S3_ENDPOINT_URL")
+        # /blobs URLs are signed: universal media never expires, private media after BLOB_URL_TTL..2x seconds
+        self.blob_url_secret: str = os.getenv("BLOB_URL_SECRET") or os.getenv("JWT_SECRET", "change-me-in-prod")
+        self.blob_url_ttl: int = int(os.getenv("BLOB_URL_TTL", "86400"))
+        # Coalescing of identical in-flight generations (in-process + lease rows across workers);
+        # a lease whose holder died is taken over after COALESCE_LEASE_TTL seconds
+        self.coalesce_wait_timeout: float = float(os.getenv("COALESCE_WAIT_TIMEOUT", "120"))
+        self.coalesce_lease_ttl: float = float(os.getenv("COALESCE_LEASE_TTL", "300"))
+        # Background jobs (worker.py)
+        self.job_worker_concurrency: int = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+        self.job_poll_interval: float = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+        self.job_max_attempts: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self.job_retry_base_seconds: float = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+        self.job_visibility_timeout: float = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "600"))
+        # Comma-separated user ids allowed to queue jobs with priority above 0 (operators, pre-seeding)
+        self.job_trusted_user_ids: str = os.getenv("JOB_TRUSTED_USER_IDS", "")
+        # Universal stories catalog cache: how often the cached snapshot checks cache_versions
+        self.catalog_version_check_seconds: float = float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", "5"))
+        # Pre-generate images and audio for every universal story (python warmup.py, or on startup)
+        self.universal_warmup_on_startup: bool = os.getenv("UNIVERSAL_WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+        self.universal_warmup_voices: str = os.getenv("UNIVERSAL_WARMUP_VOICES", os.getenv("OPENAI_TTS_VOICE", "alloy"))
+        self.universal_warmup_images: int = int(os.getenv("UNIVERSAL_WARMUP_IMAGES", "3"))
+        self.universal_warmup_size: str = os.getenv("UNIVERSAL_WARMUP_SIZE", "1024x1024")
+        self.universal_warmup_concurrency: int = int(os.getenv("UNIVERSAL_WARMUP_CONCURRENCY", "2"))
+        # POST /stories/batch: stories per request, generated at most STORY_BATCH_CONCURRENCY at a time
+        # per batch on a process-wide pool of STORY_BATCH_WORKERS threads
+        self.story_batch_max_items: int = int(os.getenv("STORY_BATCH_MAX_ITEMS", "50"))
+        self.story_batch_concurrency: int = int(os.getenv("STORY_BATCH_CONCURRENCY", "8"))
+        self.story_batch_workers: int = int(os.getenv("STORY_BATCH_WORKERS", "16"))
         # Auth
         self.jwt_secret: str = os.getenv("JWT_SECRET", "change-me-in-prod")
         self.jwt_algorithm: str = os.getenv("JWT_ALGORITHM", "HS256")
         self.jwt_exp_minutes: int = int(os.getenv("JWT_EXP_MINUTES", "60"))
+        # Verified tokens are cached (bounded LRU, never past their exp) to skip re-verification
+        self.jwt_cache_size: int = int(os.getenv("JWT_CACHE_SIZE", "4096"))
+        self.jwt_cache_ttl: float = float(os.getenv("JWT_CACHE_TTL", "300"))
+        # Embed story_age/story_complexity in tokens so story creation skips the users lookup
+        self.jwt_embed_story_settings: bool = os.getenv("JWT_EMBED_STORY_SETTINGS", "true").lower() in ("1", "true", "yes")
+        # Password hashing runs in a separate process pool; beyond the queue limit logins get 429
+        self.bcrypt_rounds: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+        self.password_hash_workers: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+        self.password_hash_queue_limit: int = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+        self.password_hash_timeout: float = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+        # Thumbnail/medium WebP+JPEG variants of generated images, rendered at generation time
+        # in a process pool (services/image_variants.py); beyond the queue limit images are stored without
+        self.image_variants: bool = os.getenv("IMAGE_VARIANTS", "true").lower() in ("1", "true", "yes")
+        self.image_variant_workers: int = int(os.getenv("IMAGE_VARIANT_WORKERS", "2"))
+        self.image_variant_queue_limit: int = int(os.getenv("IMAGE_VARIANT_QUEUE_LIMIT", "16"))
+        self.image_variant_quality: int = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+        self.image_variant_timeout: float = float(os.getenv("IMAGE_VARIANT_TIMEOUT", "30"))
         # OpenAI
         self.openai_api_key: str | None = os.getenv("OPENAI_API_KEY")
         self.openai_timeout: float = float(os.getenv("OPENAI_TIMEOUT", "30"))
+        # Point the clients at another endpoint, e.g. a local fake server for tests/benchmarks
+        self.openai_base_url: str | None = os.getenv("OPENAI_BASE_URL") or None
+        # Resilience (services/resilience.py): per-operation timeouts, jittered retries,
+        # circuit breaker and optional hedging of chat completions (0 = off)
+        self.openai_chat_timeout: float = float(os.getenv("OPENAI_CHAT_TIMEOUT", "20"))
+        self.openai_image_timeout: float = float(os.getenv("OPENAI_IMAGE_TIMEOUT", "60"))
+        self.openai_tts_timeout: float = float(os.getenv("OPENAI_TTS_TIMEOUT", "30"))
+        self.openai_max_retries: int = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+        self.openai_retry_base: float = float(os.getenv("OPENAI_RETRY_BASE", "0.5"))
+        self.openai_retry_max: float = float(os.getenv("OPENAI_RETRY_MAX", "8"))
+        self.openai_breaker_threshold: int = int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5"))
+        self.openai_breaker_reset: float = float(os.getenv("OPENAI_BREAKER_RESET", "30"))
+        self.openai_hedge_after: float = float(os.getenv("OPENAI_HEDGE_AFTER", "0"))
+        # Rate limits per operation (0 = unlimited), shared via Postgres ("postgres") or per process ("local")
+        self.rate_limit_backend: str = os.getenv("RATE_LIMIT_BACKEND", "postgres").lower()
+        self.openai_chat_rpm: int = int(os.getenv("OPENAI_CHAT_RPM", "500"))
+        self.openai_chat_tpm: int = int(os.getenv("OPENAI_CHAT_TPM", "200000"))
+        self.openai_image_rpm: int = int(os.getenv("OPENAI_IMAGE_RPM", "50"))
+        self.openai_tts_rpm: int = int(os.getenv("OPENAI_TTS_RPM", "100"))
+        # Share of each bucket that background work (images, TTS, jobs) may not dip into
+        self.openai_interactive_reserve: float = float(os.getenv("OPENAI_INTERACTIVE_RESERVE", "0.2"))
+        self.openai_rate_limit_max_wait: float = float(os.getenv("OPENAI_RATE_LIMIT_MAX_WAIT", "10"))
+        self.user_openai_rpm: int = int(os.getenv("USER_OPENAI_RPM", "30"))
         self.openai_tts_model: str = os.getenv("OPENAI_TTS_MODEL", "gpt-4o-mini-tts")
         self.openai_tts_voice: str = os.getenv("OPENAI_TTS_VOICE", "alloy")
+        # Stream TTS audio to the client while it is synthesized instead of returning it in one response
+        self.tts_streaming: bool = os.getenv("TTS_STREAMING", "true").lower() in ("1", "true", "yes")
+        self.tts_stream_chunk_bytes: int = int(os.getenv("TTS_STREAM_CHUNK_BYTES", "16384"))
+        # Long stories are synthesized per paragraph (services/tts_segments.py): segments are cached
+        # individually, run up to TTS_SEGMENT_PARALLELISM at a time per story and are stitched into one MP3
+        self.tts_segmented: bool = os.getenv("TTS_SEGMENTED", "true").lower() in ("1", "true", "yes")
+        self.tts_segment_max_chars: int = int(os.getenv("TTS_SEGMENT_MAX_CHARS", "1200"))
+        self.tts_segment_min_chars: int = int(os.getenv("TTS_SEGMENT_MIN_CHARS", "80"))
+        self.tts_segment_parallelism: int = int(os.getenv("TTS_SEGMENT_PARALLELISM", "3"))
+        self.tts_segment_workers: int = int(os.getenv("TTS_SEGMENT_WORKERS", "8"))
+        # Content-addressed TTS cache (LRU-evicted beyond TTS_CACHE_MAX_BYTES)
+        self.tts_cache_max_bytes: int = int(os.getenv("TTS_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+        self.tts_cache_wait_timeout: float = float(os.getenv("TTS_CACHE_WAIT_TIMEOUT", "120"))
+        # Segments of long stories are cached separately, under their own LRU budget
+        self.tts_segment_cache_max_bytes: int = int(os.getenv("TTS_SEGMENT_CACHE_MAX_BYTES", str(1024 ** 3)))
+        # Storage lifecycle (services/storage_lifecycle.py, maintenance.py): retention in days, 0 keeps forever.
+        # The worker runs it every MAINTENANCE_INTERVAL seconds (0 disables); blobs younger than
+        # BLOB_GC_GRACE_SECONDS are never collected since their rows may not be committed yet
+        self.maintenance_interval: float = float(os.getenv("MAINTENANCE_INTERVAL", str(6 * 3600)))
+        self.maintenance_batch_size: int = int(os.getenv("MAINTENANCE_BATCH_SIZE", "200"))
+        self.story_audio_retention_days: float = float(os.getenv("STORY_AUDIO_RETENTION_DAYS", "90"))
+        self.tts_cache_retention_days: float = float(os.getenv("TTS_CACHE_RETENTION_DAYS", "0"))
+        self.job_retention_days: float = float(os.getenv("JOB_RETENTION_DAYS", "14"))
+        self.rate_limit_bucket_idle_days: float = float(os.getenv("RATE_LIMIT_BUCKET_IDLE_DAYS", "1"))
+        self.blob_gc_grace_seconds: float = float(os.getenv("BLOB_GC_GRACE_SECONDS", str(24 * 3600)))
+        # Opt-in cache of chat completions (stories, image prompts); keeps up to
+        # GENERATION_CACHE_VARIETY distinct completions per request and rotates among them
+        self.generation_cache_enabled: bool = os.getenv("GENERATION_CACHE", "false").lower() in ("1", "true", "yes")
+        self.generation_cache_variety: int = int(os.getenv("GENERATION_CACHE_VARIETY", "3"))
+        self.generation_cache_ttl: float = float(os.getenv("GENERATION_CACHE_TTL", str(7 * 24 * 3600)))
+        self.generation_cache_local_entries: int = int(os.getenv("GENERATION_CACHE_LOCAL_ENTRIES", "1024"))
+        self.generation_cache_max_rows: int = int(os.getenv("GENERATION_CACHE_MAX_ROWS", "100000"))
         self.openai_image_model: str = os.getenv("OPENAI_IMAGE_MODEL", "gpt-image-1")
         self.openai_image_fallback_model: str = os.getenv("OPENAI_IMAGE_FALLBACK_MODEL", "dall-e-3")
+        self.openai_image_concurrency: int = int(os.getenv("OPENAI_IMAGE_CONCURRENCY", "4"))
+        self.openai_image_deadline: float = float(os.getenv("OPENAI_IMAGE_DEADLINE", "90"))
 
 
 settings = Settings()
@@ -1,28 +1,364 @@
+import asyncio
 import psycopg2
-from contextlib import contextmanager
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
 from config import settings
+from services import metrics
 
 
 def get_connection():
     return psycopg2.connect(
         host=settings.db_host,
+        port=settings.db_port,
         database=settings.db_name,
         user=settings.db_user,
         password=settings.db_pass,
+        connect_timeout=settings.db_connect_timeout,
     )
 
 
+class PoolTimeout(Exception):
+    """Raised when no pooled connection became available within the wait timeout."""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used_at")
+
+    def __init__(self, conn) -> None:
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used_at = now
+
+
+class ConnectionPool:
+    """Bounded, thread-safe psycopg2 connection pool.
+
+    Connections are health-checked on checkout when they have been idle for a
+    while, recycled after ``max_lifetime`` seconds and discarded whenever the
+    driver reports them broken.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, max_lifetime: float, max_idle: float, connect=get_connection) -> None:
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self._connect = connect
+        self._idle: list[_PooledConnection] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        # Metrics
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+        self.recycled = 0
+        self.broken = 0
+
+    def _open(self) -> _PooledConnection:
+        return _PooledConnection(self._connect())
+
+    def _discard(self, pooled: _PooledConnection) -> None:
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def prefill(self) -> None:
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                pooled = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append(pooled)
+                self._cond.notify()
+
+    def _is_usable(self, pooled: _PooledConnection, now: float) -> bool:
+        conn = pooled.conn
+        if conn.closed:
+            return False
+        if self.max_lifetime and now - pooled.created_at > self.max_lifetime:
+            with self._cond:
+                self.recycled += 1
+            return False
+        if self.max_idle and now - pooled.last_used_at > self.max_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                with self._cond:
+                    self.broken += 1
+                return False
+        return True
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                pooled = None
+                if self._idle:
+                    pooled = self._idle.pop()
+                elif self._size < self.maxconn:
+                    self._size += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"No database connection available within {self.timeout}s")
+                    waited = True
+                    self._cond.wait(remaining)
+                    continue
+            if pooled is None:
+                try:
+                    pooled = self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_usable(pooled, time.monotonic()):
+                self._discard(pooled)
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                continue
+            break
+        elapsed = time.monotonic() - start
+        with self._cond:
+            self.acquired += 1
+            if waited:
+                self.waits += 1
+            self.wait_seconds_total += elapsed
+            self.wait_seconds_max = max(self.wait_seconds_max, elapsed)
+        return pooled
+
+    def putconn(self, pooled: _PooledConnection, discard: bool = False) -> None:
+        conn = pooled.conn
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        if discard or conn.closed:
+            self._discard(pooled)
+            with self._cond:
+                self.broken += 1
+                self._size -= 1
+                self._cond.notify()
+            return
+        pooled.last_used_at = time.monotonic()
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                self._discard(pooled)
+                return
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    def closeall(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max": self.maxconn,
+                "acquired": self.acquired,
+                "waits": self.waits,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "timeouts": self.timeouts,
+                "recycled": self.recycled,
+                "broken": self.broken,
+            }
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    minconn=settings.db_pool_min,
+                    maxconn=settings.db_pool_max,
+                    timeout=settings.db_pool_timeout,
+                    max_lifetime=settings.db_pool_max_lifetime,
+                    max_idle=settings.db_pool_max_idle,
+                )
+    return _pool
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def pool_stats() -> dict:
+    return get_pool().stats()
+
+
 @contextmanager
 def db_cursor():
-    conn = get_connection()
+    pool = get_pool()
+    start = time.perf_counter()
+    pooled = pool.getconn()
+    acquired = time.perf_counter()
+    metrics.DB_ACQUIRE.labels("sync").observe(acquired - start)
+    conn = pooled.conn
+    discard = False
     try:
         cur = conn.cursor()
-        yield conn, cur
-        conn.commit()
-    finally:
         try:
-            conn.close()
-        except Exception:
-            pass
+            yield conn, cur
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            metrics.DB_ERRORS.labels("sync").inc()
+            raise
+        except BaseException as exc:
+            # handler errors (HTTPException, ...) raised inside the block are not database errors
+            if isinstance(exc, psycopg2.Error):
+                metrics.DB_ERRORS.labels("sync").inc()
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass
+    finally:
+        pool.putconn(pooled, discard=discard)
+        metrics.DB_TRANSACTION.labels("sync").observe(time.perf_counter() - acquired)
+
+
+_PLACEHOLDER = "%s"
+
+
+def _to_asyncpg_sql(sql: str) -> str:
+    """Rewrite psycopg2 ``%s`` placeholders to asyncpg's ``$n`` form."""
+    parts = sql.replace("%%", "\0").split(_PLACEHOLDER)
+    out = parts[0]
+    for i, part in enumerate(parts[1:], start=1):
+        out += f"${i}" + part
+    return out.replace("\0", "%")
+
+
+class AsyncCursor:
+    """Minimal cursor facade over an asyncpg connection.
+
+    Mirrors the subset of the DB-API used by the routers (``execute``,
+    ``fetchone``, ``fetchall``) so SQL can be shared with the sync path.
+    """
+
+    def __init__(self, conn) -> None:
+        self._conn = conn
+        self._rows: list = []
+
+    async def execute(self, sql: str, params=()) -> None:
+        query = _to_asyncpg_sql(sql)
+        if "RETURNING" in query.upper() or query.lstrip().upper().startswith(("SELECT", "WITH")):
+            self._rows = list(await self._conn.fetch(query, *params))
+        else:
+            await self._conn.execute(query, *params)
+            self._rows = []
 
+    async def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
 
+    async def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+
+_async_pool = None
+_async_pool_lock = None
+
+
+async def get_async_pool():
+    global _async_pool, _async_pool_lock
+    import asyncpg  # only required when ASYNC_MODE is enabled
+
+    if _async_pool_lock is None:
+        _async_pool_lock = asyncio.Lock()
+    async with _async_pool_lock:
+        if _async_pool is None:
+            _async_pool = await asyncpg.create_pool(
+                host=settings.db_host,
+                port=settings.db_port,
+                database=settings.db_name,
+                user=settings.db_user,
+                password=settings.db_pass,
+                min_size=settings.db_pool_min,
+                max_size=settings.db_pool_max,
+                timeout=settings.db_connect_timeout,
+                max_inactive_connection_lifetime=settings.db_pool_max_inactive,
+            )
+    return _async_pool
+
+
+async def close_async_pool() -> None:
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+
+@asynccontextmanager
+async def async_db_cursor():
+    pool = await get_async_pool()
+    start = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=settings.db_pool_timeout)
+    except Exception as exc:
+        raise PoolTimeout(f"No database connection available within {settings.db_pool_timeout}s") from exc
+    acquired = time.perf_counter()
+    metrics.DB_ACQUIRE.labels("async").observe(acquired - start)
+    try:
+        async with conn.transaction():
+            yield conn, AsyncCursor(conn)
+    except BaseException as exc:
+        import asyncpg  # already loaded by get_async_pool
+
+        if isinstance(exc, (asyncpg.PostgresError, asyncpg.InterfaceError)):
+            metrics.DB_ERRORS.labels("async").inc()
+        raise
+    finally:
+        await pool.release(conn)
+        metrics.DB_TRANSACTION.labels("async").observe(time.perf_counter() - acquired)
@@ -1,13 +1,19 @@
 from fastapi import FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 import logging
 from config import settings
+from responses import CompressionMiddleware
+from db import get_pool, close_pool, pool_stats, close_async_pool
 from typing import List  # for remnants in docstrings/type hints
-from routers import auth, stories, universal
+from services import generation_cache, image_variants, metrics, passwords, rate_limit, resilience, tts_cache, warmup
+import anyio.to_thread
+import math
+import threading
+from routers import auth, stories, universal, generation_async, blobs, jobs
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # CORS
 _cors_origins_env = settings.cors_allow_origins
@@ -25,6 +31,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if settings.response_compression:
+    app.add_middleware(CompressionMiddleware)
+# Outermost, so latency includes CORS handling and unhandled errors count as 500
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Logging and global error handler
 logger = logging.getLogger("uvicorn.error")
@@ -37,6 +47,14 @@ def global_error_handler(request: Request, exc: Exception):
         pass
     return JSONResponse(status_code=500, content={"detail": "Internal server error"})
 
+@app.exception_handler(rate_limit.Throttled)
+def throttled_handler(request: Request, exc: rate_limit.Throttled):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests, try again shortly"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
 """
 Refactor note: Generation functions moved into services; legacy helpers removed from main.
 """
@@ -47,13 +65,54 @@ def root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "db_pool": pool_stats(),
+        "tts_cache": tts_cache.stats(),
+        "generation_cache": generation_cache.stats(),
+        "upstream": resilience.stats(),
+        "rate_limit": rate_limit.stats(),
+    }
+
+metrics.register_stats({
+    "db_pool": pool_stats,
+    "tts_cache": tts_cache.stats,
+    "generation_cache": generation_cache.stats,
+    "upstream": resilience.stats,
+})
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    metrics.THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+    metrics.THREADPOOL_SIZE.set(limiter.total_tokens)
+    body, content_type = metrics.exposition()
+    return Response(body, media_type=content_type)
 
 # Routers
+if settings.async_mode:
+    # Registered first so these handlers take precedence over the sync ones on the same paths
+    app.include_router(generation_async.router)
 app.include_router(auth.router)
 app.include_router(stories.router)
 app.include_router(universal.router)
+app.include_router(blobs.router)
+app.include_router(jobs.router)
 
 @app.on_event("startup")
 def app_started():
-    logger.info("API startup complete")
\ No newline at end of file
+    try:
+        get_pool().prefill()
+    except Exception:
+        logger.warning("Could not prefill DB connection pool", exc_info=True)
+    if settings.universal_warmup_on_startup:
+        threading.Thread(target=warmup.warm_on_startup, name="universal-warmup", daemon=True).start()
+    logger.info("API startup complete")
+
+
+@app.on_event("shutdown")
+async def app_stopped():
+    close_pool()
+    await close_async_pool()
+    passwords.shutdown()
+    image_variants.shutdown()
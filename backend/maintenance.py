@@ -0,0 +1,53 @@
+"""Storage maintenance: retention, compaction and blob garbage collection.
+
+Usage: python maintenance.py [--dry-run] [--skip-retention] [--skip-compaction]
+                             [--skip-gc] [--grace SECONDS]
+
+Prints the rows and bytes each step reclaimed (or would reclaim with
+``--dry-run``). Retention ages come from the ``*_RETENTION_DAYS`` settings.
+The job worker runs the same pass every ``MAINTENANCE_INTERVAL`` seconds.
+"""
+import argparse
+import logging
+import sys
+from config import settings
+from db import close_pool
+from services import storage_lifecycle
+
+
+def _human(size: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reclaim story media storage")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be reclaimed")
+    parser.add_argument("--skip-retention", action="store_true")
+    parser.add_argument("--skip-compaction", action="store_true")
+    parser.add_argument("--skip-gc", action="store_true")
+    parser.add_argument("--grace", type=float, default=settings.blob_gc_grace_seconds, help="Never collect blobs younger than this (seconds)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    report = storage_lifecycle.run(
+        dry_run=args.dry_run,
+        retention=not args.skip_retention,
+        compaction=not args.skip_compaction,
+        gc=not args.skip_gc,
+        grace=args.grace,
+    )
+    close_pool()
+    if report is None:
+        print("Another maintenance pass is running", file=sys.stderr)
+        sys.exit(1)
+    for step, stat in report.items():
+        print(f"{step:32} rows={stat['rows']:<8} bytes={stat['bytes']:<12} ({_human(stat['bytes'])})")
+    total = sum(stat["bytes"] for stat in report.values())
+    print(f"{'would reclaim' if args.dry_run else 'reclaimed'} {_human(total)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""one story_images row per image index
+
+Revision ID: 3a9d5f7c2e10
+Revises: f1c3a8e5d207
+Create Date: 2025-09-22 14:03:27.551840
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3a9d5f7c2e10'
+down_revision: Union[str, Sequence[str], None] = 'f1c3a8e5d207'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Keep the newest row per (story_id, image_index) and make the pair unique so images can be upserted one by one."""
+    op.execute(
+        sa.text(
+            """
+            DELETE FROM story_images a
+            USING story_images b
+            WHERE a.story_id = b.story_id AND a.image_index = b.image_index AND a.id < b.id;
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_story_images_story_index ON story_images(story_id, image_index);
+            DROP INDEX IF EXISTS idx_story_images_story_id;
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Restore the non-unique story index."""
+    op.execute(
+        sa.text(
+            """
+            CREATE INDEX IF NOT EXISTS idx_story_images_story_id ON story_images(story_id);
+            DROP INDEX IF EXISTS uq_story_images_story_index;
+            """
+        )
+    )
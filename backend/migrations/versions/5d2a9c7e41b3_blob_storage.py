@@ -0,0 +1,109 @@
+"""move media to blob storage
+
+Revision ID: 5d2a9c7e41b3
+Revises: 12b5f313a6d8
+Create Date: 2025-09-02 10:14:52.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import base64
+
+from services.blob_store import get_blob_store, put_data_url, content_type_for
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2a9c7e41b3'
+down_revision: Union[str, Sequence[str], None] = '12b5f313a6d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 50
+
+
+def upgrade() -> None:
+    """Add blob_key columns and move existing image/audio payloads into the blob store."""
+    op.execute(
+        sa.text(
+            """
+            ALTER TABLE story_images ADD COLUMN IF NOT EXISTS blob_key VARCHAR(80);
+            ALTER TABLE story_images ALTER COLUMN data_url DROP NOT NULL;
+            ALTER TABLE story_audio ADD COLUMN IF NOT EXISTS blob_key VARCHAR(80);
+            ALTER TABLE story_audio ADD COLUMN IF NOT EXISTS size_bytes BIGINT;
+            ALTER TABLE story_audio ALTER COLUMN audio_bytes DROP NOT NULL;
+            """
+        )
+    )
+
+    bind = op.get_bind()
+    store = get_blob_store()
+
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text(
+                "SELECT id, data_url FROM story_images WHERE id > :last AND blob_key IS NULL AND data_url IS NOT NULL ORDER BY id LIMIT :n"
+            ),
+            {"last": last_id, "n": BATCH},
+        ).fetchall()
+        if not rows:
+            break
+        for row_id, data_url in rows:
+            last_id = row_id
+            if not data_url.startswith("data:"):
+                continue
+            key = put_data_url(data_url)
+            bind.execute(
+                sa.text("UPDATE story_images SET blob_key = :key, data_url = NULL WHERE id = :id"),
+                {"key": key, "id": row_id},
+            )
+
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text(
+                "SELECT id, audio_bytes FROM story_audio WHERE id > :last AND blob_key IS NULL AND audio_bytes IS NOT NULL ORDER BY id LIMIT :n"
+            ),
+            {"last": last_id, "n": BATCH},
+        ).fetchall()
+        if not rows:
+            break
+        for row_id, audio in rows:
+            last_id = row_id
+            audio = bytes(audio)
+            if not audio:
+                bind.execute(sa.text("DELETE FROM story_audio WHERE id = :id"), {"id": row_id})
+                continue
+            key = store.put(audio, "audio/mpeg")
+            bind.execute(
+                sa.text("UPDATE story_audio SET blob_key = :key, size_bytes = :size, audio_bytes = NULL WHERE id = :id"),
+                {"key": key, "size": len(audio), "id": row_id},
+            )
+
+
+def downgrade() -> None:
+    """Copy blobs back into the row columns and drop the blob_key columns."""
+    bind = op.get_bind()
+    store = get_blob_store()
+
+    for row_id, key in bind.execute(sa.text("SELECT id, blob_key FROM story_images WHERE blob_key IS NOT NULL")).fetchall():
+        data_url = f"data:{content_type_for(key)};base64," + base64.b64encode(store.get(key)).decode()
+        bind.execute(sa.text("UPDATE story_images SET data_url = :d WHERE id = :id"), {"d": data_url, "id": row_id})
+    for row_id, key in bind.execute(sa.text("SELECT id, blob_key FROM story_audio WHERE blob_key IS NOT NULL")).fetchall():
+        bind.execute(sa.text("UPDATE story_audio SET audio_bytes = :b WHERE id = :id"), {"b": store.get(key), "id": row_id})
+
+    op.execute(
+        sa.text(
+            """
+            DELETE FROM story_images WHERE data_url IS NULL;
+            DELETE FROM story_audio WHERE audio_bytes IS NULL;
+            ALTER TABLE story_images DROP COLUMN IF EXISTS blob_key;
+            ALTER TABLE story_images ALTER COLUMN data_url SET NOT NULL;
+            ALTER TABLE story_audio DROP COLUMN IF EXISTS blob_key;
+            ALTER TABLE story_audio DROP COLUMN IF EXISTS size_bytes;
+            ALTER TABLE story_audio ALTER COLUMN audio_bytes SET NOT NULL;
+            """
+        )
+    )
@@ -0,0 +1,42 @@
+"""downscaled image variants next to the originals
+
+Revision ID: 7c4e2b9a1f63
+Revises: 3a9d5f7c2e10
+Create Date: 2025-09-24 10:41:08.312954
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c4e2b9a1f63'
+down_revision: Union[str, Sequence[str], None] = '3a9d5f7c2e10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Add a variants map ({"thumb.webp": blob_key, ...}) to story_images and universal_story_images."""
+    op.execute(
+        sa.text(
+            """
+            ALTER TABLE story_images ADD COLUMN IF NOT EXISTS variants JSONB NOT NULL DEFAULT '{}'::jsonb;
+            ALTER TABLE universal_story_images ADD COLUMN IF NOT EXISTS variants JSONB NOT NULL DEFAULT '{}'::jsonb;
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Drop the variants columns."""
+    op.execute(
+        sa.text(
+            """
+            ALTER TABLE universal_story_images DROP COLUMN IF EXISTS variants;
+            ALTER TABLE story_images DROP COLUMN IF EXISTS variants;
+            """
+        )
+    )
@@ -0,0 +1,75 @@
+"""content-addressed tts cache
+
+Revision ID: 8f3b6e2d1c90
+Revises: 5d2a9c7e41b3
+Create Date: 2025-09-04 09:41:07.552310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from config import settings
+from services.tts_cache import cache_key
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f3b6e2d1c90'
+down_revision: Union[str, Sequence[str], None] = '5d2a9c7e41b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create tts_cache and seed it from the newest story_audio blob per (story, voice)."""
+    op.execute(
+        sa.text(
+            """
+            CREATE TABLE IF NOT EXISTS tts_cache (
+                cache_key CHAR(64) PRIMARY KEY,
+                blob_key VARCHAR(80) NOT NULL,
+                size_bytes BIGINT NOT NULL DEFAULT 0,
+                voice VARCHAR(50) NOT NULL,
+                model VARCHAR(100) NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_tts_cache_last_used_at ON tts_cache(last_used_at);
+            CREATE INDEX IF NOT EXISTS idx_tts_cache_blob_key ON tts_cache(blob_key);
+            CREATE INDEX IF NOT EXISTS idx_story_audio_blob_key ON story_audio(blob_key);
+            """
+        )
+    )
+
+    # Existing audio was synthesized with the configured model; keying it here
+    # avoids paying for every story's first listen again after the upgrade.
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.text(
+            """
+            SELECT DISTINCT ON (a.story_id, a.voice) a.voice, a.blob_key, COALESCE(a.size_bytes, 0), s.content
+            FROM story_audio a JOIN stories s ON s.id = a.story_id
+            WHERE a.blob_key IS NOT NULL
+            ORDER BY a.story_id, a.voice, a.created_at DESC
+            """
+        )
+    ).fetchall()
+    for voice, blob_key, size, content in rows:
+        bind.execute(
+            sa.text(
+                """
+                INSERT INTO tts_cache (cache_key, blob_key, size_bytes, voice, model)
+                VALUES (:key, :blob, :size, :voice, :model)
+                ON CONFLICT (cache_key) DO NOTHING
+                """
+            ),
+            {"key": cache_key(content, voice), "blob": blob_key, "size": size, "voice": voice, "model": settings.openai_tts_model},
+        )
+
+
+def downgrade() -> None:
+    """Drop the TTS cache (blobs stay referenced by story_audio where applicable)."""
+    op.execute(sa.text("DROP INDEX IF EXISTS idx_story_audio_blob_key"))
+    op.execute(sa.text("DROP TABLE IF EXISTS tts_cache CASCADE"))
@@ -0,0 +1,65 @@
+"""one story_audio row per (story, voice, model)
+
+Revision ID: 9e6d4c1b7a52
+Revises: 7c4e2b9a1f63
+Create Date: 2025-10-02 14:18:36.907145
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e6d4c1b7a52'
+down_revision: Union[str, Sequence[str], None] = '7c4e2b9a1f63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Add story_audio.model, keep only the newest row per (story, voice, model) and make that unique."""
+    op.execute(sa.text("ALTER TABLE story_audio ADD COLUMN IF NOT EXISTS model VARCHAR(100)"))
+    # The TTS cache knows which model produced a blob; anything else came from the configured one
+    op.execute(
+        sa.text(
+            """
+            UPDATE story_audio a SET model = c.model
+            FROM tts_cache c
+            WHERE a.model IS NULL AND c.blob_key = a.blob_key
+            """
+        )
+    )
+    op.execute(
+        sa.text("UPDATE story_audio SET model = :model WHERE model IS NULL").bindparams(model=settings.openai_tts_model)
+    )
+    op.execute(
+        sa.text(
+            """
+            ALTER TABLE story_audio ALTER COLUMN model SET NOT NULL;
+            DELETE FROM story_audio a USING story_audio b
+            WHERE a.story_id = b.story_id AND a.voice = b.voice AND a.model = b.model
+              AND (COALESCE(a.created_at, 'epoch'), a.id) < (COALESCE(b.created_at, 'epoch'), b.id);
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_story_audio_story_voice_model ON story_audio(story_id, voice, model);
+            DROP INDEX IF EXISTS idx_story_audio_story_id;
+            CREATE INDEX IF NOT EXISTS idx_story_audio_created_at ON story_audio(created_at);
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Drop the unique index and the model column (superseded rows are not restored)."""
+    op.execute(
+        sa.text(
+            """
+            DROP INDEX IF EXISTS idx_story_audio_created_at;
+            DROP INDEX IF EXISTS uq_story_audio_story_voice_model;
+            CREATE INDEX IF NOT EXISTS idx_story_audio_story_id ON story_audio(story_id);
+            ALTER TABLE story_audio DROP COLUMN IF EXISTS model;
+            """
+        )
+    )
@@ -0,0 +1,52 @@
+"""background jobs table
+
+Revision ID: a41c07d95e18
+Revises: 8f3b6e2d1c90
+Create Date: 2025-09-08 14:02:33.871442
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41c07d95e18'
+down_revision: Union[str, Sequence[str], None] = '8f3b6e2d1c90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create the jobs queue table."""
+    op.execute(
+        sa.text(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id BIGSERIAL PRIMARY KEY,
+                kind VARCHAR(50) NOT NULL,
+                payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+                status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                priority INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                run_after TIMESTAMP NOT NULL DEFAULT now(),
+                result JSONB,
+                error TEXT,
+                user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                locked_by VARCHAR(200),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs(priority DESC, run_after, id) WHERE status = 'queued';
+            CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs(started_at) WHERE status = 'running';
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Drop the jobs queue table."""
+    op.execute(sa.text("DROP TABLE IF EXISTS jobs CASCADE"))
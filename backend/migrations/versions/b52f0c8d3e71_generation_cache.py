@@ -0,0 +1,43 @@
+"""generation cache for chat completions
+
+Revision ID: b52f0c8d3e71
+Revises: e3b8d61a7f25
+Create Date: 2025-09-13 10:05:19.442871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b52f0c8d3e71'
+down_revision: Union[str, Sequence[str], None] = 'e3b8d61a7f25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create the generation_cache table (variety pools of completions per request key)."""
+    op.execute(
+        sa.text(
+            """
+            CREATE TABLE IF NOT EXISTS generation_cache (
+                cache_key CHAR(64) NOT NULL,
+                value_hash CHAR(64) NOT NULL,
+                value JSONB NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT now(),
+                last_used_at TIMESTAMP NOT NULL DEFAULT now(),
+                PRIMARY KEY (cache_key, value_hash)
+            );
+            CREATE INDEX IF NOT EXISTS idx_generation_cache_created_at ON generation_cache(created_at);
+            CREATE INDEX IF NOT EXISTS idx_generation_cache_last_used_at ON generation_cache(last_used_at);
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Drop the generation_cache table."""
+    op.execute(sa.text("DROP TABLE IF EXISTS generation_cache"))
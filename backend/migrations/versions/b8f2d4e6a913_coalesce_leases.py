@@ -0,0 +1,38 @@
+"""lease rows for cross-worker coalescing
+
+Revision ID: b8f2d4e6a913
+Revises: 9e6d4c1b7a52
+Create Date: 2025-10-06 09:12:44.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8f2d4e6a913'
+down_revision: Union[str, Sequence[str], None] = '9e6d4c1b7a52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create coalesce_leases (replaces transaction-scoped advisory locks)."""
+    op.execute(
+        sa.text(
+            """
+            CREATE TABLE IF NOT EXISTS coalesce_leases (
+                lease_key CHAR(64) PRIMARY KEY,
+                holder VARCHAR(64) NOT NULL,
+                expires_at TIMESTAMP NOT NULL
+            );
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Drop coalesce_leases."""
+    op.execute(sa.text("DROP TABLE IF EXISTS coalesce_leases"))
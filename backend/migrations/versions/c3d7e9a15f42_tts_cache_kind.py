@@ -0,0 +1,42 @@
+"""tts_cache.kind: segments get their own eviction budget
+
+Revision ID: c3d7e9a15f42
+Revises: b8f2d4e6a913
+Create Date: 2025-10-07 10:41:19.302756
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3d7e9a15f42'
+down_revision: Union[str, Sequence[str], None] = 'b8f2d4e6a913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Add tts_cache.kind ('story' or 'segment') and index eviction order per kind."""
+    op.execute(
+        sa.text(
+            """
+            ALTER TABLE tts_cache ADD COLUMN IF NOT EXISTS kind VARCHAR(16) NOT NULL DEFAULT 'story';
+            CREATE INDEX IF NOT EXISTS idx_tts_cache_kind_last_used_at ON tts_cache(kind, last_used_at);
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Drop tts_cache.kind; segment entries stay and share the story budget again."""
+    op.execute(
+        sa.text(
+            """
+            DROP INDEX IF EXISTS idx_tts_cache_kind_last_used_at;
+            ALTER TABLE tts_cache DROP COLUMN IF EXISTS kind;
+            """
+        )
+    )
@@ -0,0 +1,42 @@
+"""stories keyset listing index
+
+Revision ID: c7e2a95f1b04
+Revises: a41c07d95e18
+Create Date: 2025-09-10 09:41:12.305118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e2a95f1b04'
+down_revision: Union[str, Sequence[str], None] = 'a41c07d95e18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Index stories for per-user listing newest first; supersedes idx_stories_user_id."""
+    op.execute(
+        sa.text(
+            """
+            CREATE INDEX IF NOT EXISTS idx_stories_user_created ON stories(user_id, created_at DESC, id DESC);
+            DROP INDEX IF EXISTS idx_stories_user_id;
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Restore the single-column user index."""
+    op.execute(
+        sa.text(
+            """
+            CREATE INDEX IF NOT EXISTS idx_stories_user_id ON stories(user_id);
+            DROP INDEX IF EXISTS idx_stories_user_created;
+            """
+        )
+    )
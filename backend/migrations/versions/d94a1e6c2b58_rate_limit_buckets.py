@@ -0,0 +1,38 @@
+"""shared rate limit buckets
+
+Revision ID: d94a1e6c2b58
+Revises: b52f0c8d3e71
+Create Date: 2025-09-15 08:47:03.690215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd94a1e6c2b58'
+down_revision: Union[str, Sequence[str], None] = 'b52f0c8d3e71'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create rate_limit_buckets (one token bucket per operation budget or user)."""
+    op.execute(
+        sa.text(
+            """
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                name VARCHAR(100) PRIMARY KEY,
+                tokens DOUBLE PRECISION NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Drop rate_limit_buckets."""
+    op.execute(sa.text("DROP TABLE IF EXISTS rate_limit_buckets"))
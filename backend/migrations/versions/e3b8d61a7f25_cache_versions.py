@@ -0,0 +1,60 @@
+"""cache versions for process-local caches
+
+Revision ID: e3b8d61a7f25
+Revises: c7e2a95f1b04
+Create Date: 2025-09-11 16:20:47.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3b8d61a7f25'
+down_revision: Union[str, Sequence[str], None] = 'c7e2a95f1b04'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create cache_versions and bump the universal_stories version on every write."""
+    op.execute(
+        sa.text(
+            """
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name VARCHAR(100) PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 1,
+                updated_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+            INSERT INTO cache_versions (name) VALUES ('universal_stories') ON CONFLICT (name) DO NOTHING;
+
+            CREATE OR REPLACE FUNCTION bump_cache_version() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO cache_versions (name, version, updated_at) VALUES (TG_ARGV[0], 1, now())
+                ON CONFLICT (name) DO UPDATE SET version = cache_versions.version + 1, updated_at = now();
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS trg_universal_stories_version ON universal_stories;
+            CREATE TRIGGER trg_universal_stories_version
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON universal_stories
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_cache_version('universal_stories');
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Drop the version trigger, function and table."""
+    op.execute(
+        sa.text(
+            """
+            DROP TRIGGER IF EXISTS trg_universal_stories_version ON universal_stories;
+            DROP FUNCTION IF EXISTS bump_cache_version();
+            DROP TABLE IF EXISTS cache_versions;
+            """
+        )
+    )
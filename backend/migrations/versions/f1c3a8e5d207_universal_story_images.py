@@ -0,0 +1,42 @@
+"""stored images for universal stories
+
+Revision ID: f1c3a8e5d207
+Revises: d94a1e6c2b58
+Create Date: 2025-09-16 13:22:58.104377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c3a8e5d207'
+down_revision: Union[str, Sequence[str], None] = 'd94a1e6c2b58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create universal_story_images (one image set per story and size)."""
+    op.execute(
+        sa.text(
+            """
+            CREATE TABLE IF NOT EXISTS universal_story_images (
+                story_id VARCHAR(50) NOT NULL REFERENCES universal_stories(id) ON DELETE CASCADE,
+                size VARCHAR(20) NOT NULL,
+                image_index INTEGER NOT NULL,
+                blob_key VARCHAR(80) NOT NULL,
+                prompt TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (story_id, size, image_index)
+            );
+            """
+        )
+    )
+
+
+def downgrade() -> None:
+    """Drop universal_story_images."""
+    op.execute(sa.text("DROP TABLE IF EXISTS universal_story_images"))
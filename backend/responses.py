@@ -0,0 +1,163 @@
+"""Response serialization and compression.
+
+- :func:`json_with_stream` sends bodies with a very large list (image data
+  URLs) as a stream, serializing one element at a time instead of building
+  the whole document in memory.
+- :class:`CompressionMiddleware` negotiates brotli or gzip for text-like
+  responses above ``COMPRESSION_MIN_BYTES``; streamed bodies are flushed per
+  chunk so SSE-style streaming keeps working.
+"""
+from typing import Any, Iterator, Optional
+from fastapi.responses import StreamingResponse
+from config import settings
+import anyio.to_thread
+import gzip
+import orjson
+import zlib
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+def _iter_json(body: dict, key: str) -> Iterator[bytes]:
+    yield b"{"
+    for i, (name, value) in enumerate(body.items()):
+        yield (b"," if i else b"") + orjson.dumps(name) + b":"
+        if name != key:
+            yield orjson.dumps(value)
+            continue
+        yield b"["
+        for j, item in enumerate(value):
+            yield (b"," if j else b"") + orjson.dumps(item)
+        yield b"]"
+    yield b"}"
+
+
+def json_with_stream(body: dict, key: str, status_code: int = 200) -> Any:
+    """Return ``body`` as-is, or stream it when ``body[key]`` is larger than ``JSON_STREAM_MIN_BYTES``."""
+    items = body.get(key) or []
+    size = sum(len(item) if isinstance(item, (str, bytes)) else 64 for item in items)
+    if size < settings.json_stream_min_bytes:
+        return body
+    return StreamingResponse(_iter_json(body, key), status_code=status_code, media_type="application/json")
+
+
+# Text-like types worth compressing; media is already compressed
+_COMPRESSIBLE = ("application/json", "text/plain", "text/html", "text/css", "text/csv", "application/javascript", "image/svg+xml")
+# Compress larger bodies off the event loop
+_THREAD_MIN_BYTES = 128 * 1024
+
+
+def _accepted(accept_encoding: str) -> Optional[str]:
+    """Pick ``br`` or ``gzip`` from an Accept-Encoding header, honouring ``q=0``."""
+    offered = {}
+    for part in accept_encoding.split(","):
+        coding, *params = [p.strip() for p in part.split(";")]
+        q = next((p[2:] for p in params if p.startswith("q=")), "1")
+        try:
+            offered[coding.lower()] = float(q)
+        except ValueError:
+            offered[coding.lower()] = 0.0
+    wildcard = offered.get("*", 0.0)
+    for coding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if offered.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+
+class _Compressor:
+    def __init__(self, coding: str) -> None:
+        self.coding = coding
+        if coding == "br":
+            self._br = brotli.Compressor(quality=settings.brotli_quality)
+        else:
+            # wbits 16+ produces a gzip container
+            self._gz = zlib.compressobj(settings.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress and flush, so the client can decode what was sent so far."""
+        if self.coding == "br":
+            return self._br.process(data) + self._br.flush()
+        return self._gz.compress(data) + self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._br.finish() if self.coding == "br" else self._gz.flush(zlib.Z_FINISH)
+
+
+def compress(coding: str, data: bytes) -> bytes:
+    if coding == "br":
+        return brotli.compress(data, quality=settings.brotli_quality)
+    return gzip.compress(data, compresslevel=settings.gzip_level, mtime=0)
+
+
+class CompressionMiddleware:
+    """Negotiated brotli/gzip for JSON and text responses.
+
+    Responses that already carry a Content-Encoding (the precomputed catalog)
+    or are below the size threshold pass through untouched.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        coding = _accepted(accept)
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[dict] = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body, more = message.get("body", b""), message.get("more_body", False)
+            if compressor is None:
+                headers = {k.lower(): v for k, v in start["headers"]}
+                content_type = headers.get(b"content-type", b"").decode("latin-1").split(";")[0].strip()
+                if (
+                    b"content-encoding" in headers
+                    or content_type not in _COMPRESSIBLE
+                    or start["status"] in (204, 206, 304)
+                    or (not more and len(body) < settings.compression_min_bytes)
+                ):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = _Compressor(coding)
+                start["headers"] = [(k, v) for k, v in start["headers"] if k.lower() != b"content-length"]
+                start["headers"] += [(b"content-encoding", coding.encode()), (b"vary", b"Accept-Encoding")]
+                if not more:
+                    if len(body) >= _THREAD_MIN_BYTES:
+                        data = await anyio.to_thread.run_sync(compress, coding, body)
+                    else:
+                        data = compress(coding, body)
+                    start["headers"].append((b"content-length", str(len(data)).encode()))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": data})
+                    return
+                await send(start)
+            data = compressor.chunk(body) if body else b""
+            if not more:
+                data += compressor.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, send_wrapper)
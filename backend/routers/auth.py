@@ -1,37 +1,26 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException
 from schemas import LoginRequest, RegisterRequest
 from db import db_cursor
 from security import create_access_token
-from passlib.hash import bcrypt
-import hashlib
+from services import passwords
+from services.passwords import PasswordPoolBusy
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 
 router = APIRouter()
 
 
-def _sha256_hash(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
-
-
-def _verify_and_upgrade_password(provided_password: str, stored_hash: str, user_id: int) -> bool:
+def _password_op(fn, *args):
     try:
-        if stored_hash.startswith("$2a$") or stored_hash.startswith("$2b$"):
-            return bcrypt.verify(provided_password, stored_hash)
-    except Exception:
-        pass
-    # legacy sha256
-    if _sha256_hash(provided_password) == stored_hash:
-        try:
-            with db_cursor() as (conn, cur):
-                cur.execute("UPDATE users SET password = %s WHERE id = %s", (bcrypt.hash(provided_password), user_id))
-        except Exception:
-            pass
-        return True
-    return False
+        return fn(*args)
+    except PasswordPoolBusy:
+        raise HTTPException(429, "Too many login attempts, try again shortly", headers={"Retry-After": "1"})
+    except FutureTimeoutError:
+        raise HTTPException(503, "Authentication temporarily unavailable", headers={"Retry-After": "5"})
 
 
 @router.post("/login")
-def login(request: LoginRequest):
+def login(request: LoginRequest, background_tasks: BackgroundTasks):
     with db_cursor() as (conn, cur):
         cur.execute(
             """
@@ -45,15 +34,19 @@ def login(request: LoginRequest):
     if not row:
         raise HTTPException(401, "Invalid login")
     user_id, username, stored_hash, story_age, story_complexity = row
-    if not _verify_and_upgrade_password(request.password, stored_hash, user_id):
+    if not _password_op(passwords.verify_password, request.password, stored_hash):
         raise HTTPException(401, "Invalid login")
-    token = create_access_token(user_id)
+    if passwords.needs_rehash(stored_hash):
+        # legacy sha256 or outdated bcrypt cost; upgrade after the response is sent
+        background_tasks.add_task(passwords.upgrade_hash, user_id, request.password, stored_hash)
+    story_age, story_complexity = story_age or 5, story_complexity or "medium"
+    token = create_access_token(user_id, (story_age, story_complexity))
     return {
         "id": user_id,
         "username": username,
         "settings": {
-            "storyAge": story_age or 5,
-            "storyComplexity": story_complexity or "medium",
+            "storyAge": story_age,
+            "storyComplexity": story_complexity,
         },
         "token": token,
     }
@@ -61,6 +54,7 @@ def login(request: LoginRequest):
 
 @router.post("/register")
 def register(request: RegisterRequest):
+    password_hash = _password_op(passwords.hash_password, request.password)
     try:
         with db_cursor() as (conn, cur):
             cur.execute(
@@ -68,10 +62,8 @@ def register(request: RegisterRequest):
                 INSERT INTO users (username, password, story_age, story_complexity)
                 VALUES (%s, %s, %s, %s)
                 """,
-                (request.username, bcrypt.hash(request.password), 5, "medium"),
+                (request.username, password_hash, 5, "medium"),
             )
         return {"message": "User created", "username": request.username}
     except Exception:
         raise HTTPException(400, "User already exists")
-
-
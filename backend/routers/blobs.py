@@ -0,0 +1,96 @@
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from config import settings
+from services.blob_store import get_blob_store, content_type_for, is_valid_key
+import hashlib
+import hmac
+import re
+import time
+
+
+router = APIRouter()
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Parse a single ``bytes=`` range; multi-range requests fall back to the full body."""
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise HTTPException(416, "Requested range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def blob_response(request: Request, key: str, cache_control: str = _IMMUTABLE) -> Response:
+    """Serve a stored blob with a strong ETag (its content hash) and single-range support."""
+    store = get_blob_store()
+    try:
+        size = store.size(key)
+    except Exception:
+        raise HTTPException(404, "Blob not found")
+    etag = f'"{key.split(".")[0]}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    media_type = content_type_for(key)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    byte_range = _parse_range(range_header, size) if range_header and (not if_range or if_range == etag) else None
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(store.iter_range(key, start, end), status_code=206, media_type=media_type, headers=headers)
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(store.iter_range(key), media_type=media_type, headers=headers)
+
+
+def _signature(key: str, expires: int) -> str:
+    return hmac.new(settings.blob_url_secret.encode(), f"{key}:{expires}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def blob_url(request: Request, key: str, public: bool = False) -> str:
+    """Signed URL for a blob.
+
+    Keys are content hashes and show up in job results and shared caches, so
+    knowing one is not enough to fetch it. ``public`` URLs (universal story
+    media) never expire; private ones expire on a ``BLOB_URL_TTL`` grid, so
+    repeated listings hand out the same URL and browsers keep their cache.
+    """
+    ttl = max(1, settings.blob_url_ttl)
+    expires = 0 if public else (int(time.time()) // ttl + 2) * ttl
+    url = request.url_for("get_blob", key=key)
+    return str(url.include_query_params(exp=expires, sig=_signature(key, expires)))
+
+
+def _signed_response(request: Request, key: str, exp: int, sig: str) -> Response:
+    if not is_valid_key(key):
+        raise HTTPException(404, "Blob not found")
+    remaining = exp - int(time.time())
+    if not hmac.compare_digest(sig, _signature(key, exp)) or (exp and remaining <= 0):
+        raise HTTPException(403, "Invalid or expired link")
+    cache_control = _IMMUTABLE if not exp else f"private, max-age={remaining}, immutable"
+    return blob_response(request, key, cache_control=cache_control)
+
+
+@router.get("/blobs/{key}")
+def get_blob(key: str, request: Request, exp: int = Query(default=0), sig: str = Query(default="")):
+    return _signed_response(request, key, exp, sig)
+
+
+@router.head("/blobs/{key}")
+def head_blob(key: str, request: Request, exp: int = Query(default=0), sig: str = Query(default="")):
+    response = _signed_response(request, key, exp, sig)
+    return Response(status_code=response.status_code, headers=dict(response.headers))
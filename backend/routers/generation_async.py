@@ -0,0 +1,403 @@
+"""Async variants of the generation routes (story, images, TTS).
+
+Mounted ahead of the sync routers when ``ASYNC_MODE`` is enabled. Handlers
+await the async OpenAI client and asyncpg, so a worker does not park a
+threadpool thread for the duration of an upstream call.
+"""
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from schemas import BatchCreateStoriesRequest, CreateStoryRequest
+from security import get_current_claims, get_current_user_id, story_settings_from_claims
+from db import async_db_cursor
+from responses import json_with_stream
+from routers.blobs import blob_response, blob_url
+from services.openai_service import (
+    StoryStreamInterrupted,
+    generate_story_async,
+    generate_story_stream_async,
+    image_prompts_from_story_async,
+    images_as_completed_async,
+    images_from_prompts_async,
+)
+from routers.stories import batch_items, story_prompt_and_title, sse_event, SSE_HEADERS, PRIVATE_REVALIDATE, TtsCacheWriter
+from services import catalog_cache, coalesce, image_variants, rate_limit, story_batch, story_media, tts_cache, tts_segments
+from services.image_variants import ImageFormat, Variant
+from config import settings
+from datetime import datetime
+from typing import AsyncIterator, Callable, Optional
+import asyncio
+import json
+import logging
+
+
+router = APIRouter()
+logger = logging.getLogger("uvicorn.error")
+
+
+async def _start_tts_stream_async(text: str, voice: str) -> AsyncIterator[bytes]:
+    chunks = tts_segments.synthesize_stream_async(text, voice)
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except rate_limit.Throttled:
+        raise
+    except Exception:
+        raise HTTPException(500, "TTS generation failed")
+
+    async def stream():
+        if first:
+            yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return stream()
+
+
+# TTS pumps outlive a disconnected client; keep references so they are not collected mid-stream
+_pumps: set = set()
+
+
+async def _wait_for_flight(call) -> str:
+    # shield: a timeout here must not cancel the call other requests are waiting on
+    return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(call)), timeout=settings.tts_cache_wait_timeout)
+
+
+async def _serve_tts_async(request: Request, text: str, voice: str, on_stored: Optional[Callable[[str, int], None]] = None) -> Response:
+    """Async counterpart of ``routers.stories.serve_tts``; cache bookkeeping runs on the threadpool."""
+    key = tts_cache.cache_key(text, voice)
+    try:
+        blob = await run_in_threadpool(tts_cache.lookup, key)
+    except Exception:
+        blob = None
+    if blob:
+        return blob_response(request, blob, cache_control=PRIVATE_REVALIDATE)
+
+    call, leader = tts_cache.flight.acquire(key)
+    if not leader:
+        try:
+            return blob_response(request, await _wait_for_flight(call), cache_control=PRIVATE_REVALIDATE)
+        except Exception:
+            return StreamingResponse(await _start_tts_stream_async(text, voice), media_type="audio/mpeg")
+    lease, blob = await run_in_threadpool(tts_cache.claim, key)
+    if blob:
+        tts_cache.flight.resolve(key, call, blob)
+        return blob_response(request, blob, cache_control=PRIVATE_REVALIDATE)
+
+    if not settings.tts_streaming:
+        try:
+            audio = await tts_segments.synthesize_bytes_async(text, voice)
+            blob = await run_in_threadpool(tts_cache.store_audio, key, audio, voice)
+        except Exception as exc:
+            tts_cache.flight.fail(key, call, exc)
+            if isinstance(exc, rate_limit.Throttled):
+                raise
+            raise HTTPException(500, "TTS generation failed")
+        finally:
+            await run_in_threadpool(tts_cache.release, lease)
+        tts_cache.flight.resolve(key, call, blob)
+        if on_stored:
+            try:
+                await run_in_threadpool(on_stored, blob, len(audio))
+            except Exception:
+                pass
+        return blob_response(request, blob, cache_control=PRIVATE_REVALIDATE)
+
+    writer = TtsCacheWriter(key, voice, call, on_stored, lease)
+    try:
+        chunks = await _start_tts_stream_async(text, voice)
+    except BaseException:
+        await run_in_threadpool(writer.finish, False)
+        raise
+
+    out: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        # drained independently of the client, so the blob is committed and the lease
+        # released as soon as synthesis ends, however slowly the client downloads
+        completed = False
+        try:
+            async for chunk in chunks:
+                writer.write(chunk)
+                out.put_nowait(chunk)
+            completed = True
+        except Exception as exc:
+            out.put_nowait(exc)
+        finally:
+            await run_in_threadpool(writer.finish, completed)
+            out.put_nowait(None)
+
+    task = asyncio.ensure_future(pump())
+    _pumps.add(task)
+    task.add_done_callback(_pumps.discard)
+
+    async def tee():
+        while True:
+            item = await out.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    return StreamingResponse(tee(), media_type="audio/mpeg")
+
+
+@router.get("/stories/{story_id}/tts")
+async def tts_story(story_id: int, request: Request, voice: str = Query(default="alloy")):
+    async with async_db_cursor() as (conn, cur):
+        await cur.execute("SELECT content FROM stories WHERE id = %s", (story_id,))
+        row = await cur.fetchone()
+    if not row:
+        raise HTTPException(404, "Story not found")
+    text = row[0] or ""
+    if not text.strip():
+        raise HTTPException(400, "Story has no content")
+    return await _serve_tts_async(request, text, voice, on_stored=lambda key, size: story_media.save_story_audio(story_id, voice, key, size))
+
+
+async def _user_story_settings_async(user_id: int, claims: dict) -> tuple[int, str]:
+    embedded = story_settings_from_claims(claims)
+    if embedded:
+        return embedded
+    async with async_db_cursor() as (conn, cur):
+        await cur.execute("SELECT story_age, story_complexity FROM users WHERE id = %s", (user_id,))
+        user = await cur.fetchone()
+    if not user:
+        raise HTTPException(404, "User not found")
+    return user[0] or 5, user[1] or "medium"
+
+
+@router.post("/stories")
+async def create_story(story: CreateStoryRequest, current_user_id: int = Depends(get_current_user_id), claims: dict = Depends(get_current_claims)):
+    age, complexity = await _user_story_settings_async(current_user_id, claims)
+
+    prompt, title = story_prompt_and_title(story)
+    content = await generate_story_async(prompt, age, complexity)
+
+    async with async_db_cursor() as (conn, cur):
+        await cur.execute(
+            """
+            INSERT INTO stories (user_id, title, content, story_type, created_at)
+            VALUES (%s, %s, %s, %s, %s) RETURNING id
+            """,
+            (current_user_id, title, content, story.storyType, datetime.now()),
+        )
+        story_id = (await cur.fetchone())[0]
+
+    return {"id": story_id, "title": title, "content": content, "storyType": story.storyType, "createdAt": datetime.now().isoformat()}
+
+
+@router.post("/stories/batch")
+async def create_stories_batch(
+    batch: BatchCreateStoriesRequest, current_user_id: int = Depends(get_current_user_id), claims: dict = Depends(get_current_claims)
+):
+    items = batch_items(batch)
+    await run_in_threadpool(rate_limit.charge_request, len(items))
+    age, complexity = await _user_story_settings_async(current_user_id, claims)
+    results = await story_batch.run_batch_async(current_user_id, items, age, complexity)
+    return {"results": results, "created": sum(r["status"] == "created" for r in results)}
+
+
+@router.post("/stories/stream")
+async def create_story_stream(story: CreateStoryRequest, current_user_id: int = Depends(get_current_user_id), claims: dict = Depends(get_current_claims)):
+    age, complexity = await _user_story_settings_async(current_user_id, claims)
+    prompt, title = story_prompt_and_title(story)
+
+    async def events():
+        yield sse_event("start", {"title": title, "storyType": story.storyType})
+        parts = []
+        try:
+            async for delta in generate_story_stream_async(prompt, age, complexity):
+                parts.append(delta)
+                yield sse_event("token", {"text": delta})
+        except rate_limit.Throttled as exc:
+            yield sse_event("error", {"detail": "Too many story requests, try again shortly", "retryAfter": round(exc.retry_after, 1)})
+            return
+        except StoryStreamInterrupted:
+            logger.warning("Story stream broke off after %d deltas", len(parts), exc_info=True)
+            yield sse_event("error", {"detail": "Story generation was interrupted"})
+            return
+        content = "".join(parts).strip()
+        try:
+            async with async_db_cursor() as (conn, cur):
+                await cur.execute(
+                    """
+                    INSERT INTO stories (user_id, title, content, story_type, created_at)
+                    VALUES (%s, %s, %s, %s, %s) RETURNING id
+                    """,
+                    (current_user_id, title, content, story.storyType, datetime.now()),
+                )
+                story_id = (await cur.fetchone())[0]
+        except Exception:
+            yield sse_event("error", {"detail": "Could not save story"})
+            return
+        yield sse_event("done", {"id": story_id, "title": title, "storyType": story.storyType, "createdAt": datetime.now().isoformat()})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+async def _story_for_images_async(story_id: int) -> tuple[str, str]:
+    async with async_db_cursor() as (conn, cur):
+        await cur.execute("SELECT title, content FROM stories WHERE id = %s", (story_id,))
+        row = await cur.fetchone()
+    if not row:
+        raise HTTPException(404, "Story not found")
+    title, content = row[0] or "Saga", row[1] or ""
+    if not content.strip():
+        raise HTTPException(400, "Story has no content")
+    return title, content
+
+
+async def _save_story_image_async(story_id: int, index: int, key: str, prompt: str, variants: dict) -> None:
+    async with async_db_cursor() as (conn, cur):
+        await cur.execute(story_media.UPSERT_STORY_IMAGE, (story_id, index, key, prompt, json.dumps(variants), datetime.now()))
+
+
+async def _save_story_image_set_async(story_id: int, stored: list, prompts: list) -> None:
+    """The whole set in one transaction, so coalesced waiters never read half of it."""
+    rows, now = list(zip(stored, prompts)), datetime.now()
+    async with async_db_cursor() as (conn, cur):
+        for idx, ((key, variants), pr) in enumerate(rows):
+            await cur.execute(story_media.UPSERT_STORY_IMAGE, (story_id, idx, key, pr, json.dumps(variants), now))
+        await cur.execute(story_media.PRUNE_STORY_IMAGES, (story_id, list(range(len(rows)))))
+
+
+async def _prune_story_images_async(story_id: int, keep: list) -> None:
+    async with async_db_cursor() as (conn, cur):
+        await cur.execute(story_media.PRUNE_STORY_IMAGES, (story_id, keep))
+
+
+@router.post("/stories/{story_id}/images")
+async def generate_story_images(
+    story_id: int,
+    request: Request,
+    num_images: int = Query(default=3, ge=1, le=6),
+    size: str = Query(default="1024x1024"),
+    variant: Variant = Query(default="original"),
+    fmt: ImageFormat = Query(default="webp", alias="format"),
+):
+    title, content = await _story_for_images_async(story_id)
+    started = datetime.now()
+
+    async def lookup() -> Optional[dict]:
+        async with async_db_cursor() as (conn, cur):
+            await cur.execute(
+                "SELECT blob_key, variants, prompt FROM story_images WHERE story_id = %s AND created_at >= %s ORDER BY image_index ASC",
+                (story_id, started),
+            )
+            rows = [r for r in await cur.fetchall() if r[0]]
+        if not rows:
+            return None
+        return {
+            "title": title,
+            "images": [blob_url(request, image_variants.select(r[0], r[1], variant, fmt)) for r in rows],
+            "prompts": [r[2] for r in rows],
+        }
+
+    async def compute() -> dict:
+        prompts = await image_prompts_from_story_async(content, num_images=num_images)
+        images = await images_from_prompts_async(prompts, size=size)
+        if not images:
+            raise HTTPException(500, "Image generation failed")
+        try:
+            stored = await run_in_threadpool(story_media.put_images, images)
+            await _save_story_image_set_async(story_id, stored, prompts)
+        except Exception:
+            return {"title": title, "images": images, "prompts": prompts}
+        return {"title": title, "images": [blob_url(request, k) for k, _ in stored], "prompts": prompts[: len(stored)]}
+
+    result = await coalesce.run_async("story_images", (story_id, num_images, size), compute, lookup)
+    if variant != image_variants.ORIGINAL:
+        # generation stores every variant, but shared results carry the originals
+        result = await lookup() or result
+    return json_with_stream(result, "images")
+
+
+@router.post("/stories/{story_id}/images/stream")
+async def generate_story_images_stream(
+    story_id: int,
+    request: Request,
+    num_images: int = Query(default=3, ge=1, le=6),
+    size: str = Query(default="1024x1024"),
+    variant: Variant = Query(default="original"),
+    fmt: ImageFormat = Query(default="webp", alias="format"),
+):
+    title, content = await _story_for_images_async(story_id)
+
+    async def events():
+        stored = []
+        try:
+            prompts = await image_prompts_from_story_async(content, num_images=num_images)
+            yield sse_event("prompts", {"title": title, "prompts": prompts})
+            async for idx, data_url in images_as_completed_async(prompts, size=size):
+                key, variants = await run_in_threadpool(story_media.put_image, data_url)
+                await _save_story_image_async(story_id, idx, key, prompts[idx], variants)
+                stored.append(idx)
+                url = blob_url(request, image_variants.select(key, variants, variant, fmt))
+                yield sse_event("image", {"index": idx, "url": url, "prompt": prompts[idx]})
+            if stored:
+                await _prune_story_images_async(story_id, stored)
+        except rate_limit.Throttled as exc:
+            yield sse_event("error", {"detail": "Too many story requests, try again shortly", "retryAfter": round(exc.retry_after, 1)})
+            return
+        except Exception:
+            logger.warning("Streaming image generation failed for story %s", story_id, exc_info=True)
+        if not stored:
+            yield sse_event("error", {"detail": "Image generation failed"})
+            return
+        yield sse_event("done", {"count": len(stored)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.get("/universal-stories/{story_id}/tts")
+async def tts_universal_story(story_id: str, request: Request, voice: str = Query(default=settings.openai_tts_voice)):
+    async with async_db_cursor() as (conn, cur):
+        await cur.execute("SELECT content FROM universal_stories WHERE id = %s", (story_id,))
+        row = await cur.fetchone()
+    if not row:
+        raise HTTPException(404, "Universal story not found")
+    return await _serve_tts_async(request, row[0], voice)
+
+
+@router.post("/universal-stories/{story_id}/images")
+async def generate_universal_story_images(
+    story_id: str,
+    request: Request,
+    num_images: int = Query(default=3, ge=1, le=6),
+    size: str = Query(default="1024x1024"),
+    variant: Variant = Query(default="original"),
+    fmt: ImageFormat = Query(default="webp", alias="format"),
+):
+    story = await run_in_threadpool(catalog_cache.story_content, story_id)
+    if not story:
+        raise HTTPException(404, "Universal story not found")
+    title, content = story
+
+    async def lookup() -> Optional[tuple]:
+        keys, prompts = await run_in_threadpool(story_media.stored_universal_images, story_id, size, variant, fmt)
+        return (keys[:num_images], prompts[:num_images]) if len(keys) >= num_images else None
+
+    async def compute() -> tuple:
+        prompts = await image_prompts_from_story_async(content, num_images=num_images)
+        images = await images_from_prompts_async(prompts, size=size)
+        if not images:
+            raise RuntimeError("Image generation failed")
+        keys = await run_in_threadpool(story_media.store_universal_images, story_id, size, images, prompts)
+        return keys, prompts[: len(images)]
+
+    try:
+        found = await lookup()
+        if found is None:
+            found = await coalesce.run_async("universal_images", (story_id, num_images, size), compute, lookup)
+            if variant != image_variants.ORIGINAL:
+                # generation stores every variant, but shared results carry the originals
+                found = await lookup() or found
+        keys, prompts = found
+    except rate_limit.Throttled:
+        raise
+    except Exception:
+        raise HTTPException(500, "Image generation failed")
+    return {"title": title, "images": [blob_url(request, k, public=True) for k in keys], "prompts": prompts}
@@ -0,0 +1,127 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from db import db_cursor
+from routers.blobs import blob_url
+from routers.stories import batch_items
+from schemas import BatchCreateStoriesRequest
+from security import get_current_user_id
+from services import jobs, rate_limit
+from config import settings
+
+
+router = APIRouter()
+
+
+def _require_row(table: str, story_id, user_id: Optional[int] = None) -> None:
+    """404 unless the story exists and, for personal stories, belongs to ``user_id``."""
+    owner = " AND user_id = %s" if user_id is not None else ""
+    with db_cursor() as (conn, cur):
+        cur.execute(f"SELECT 1 FROM {table} WHERE id = %s{owner}", (story_id,) + ((user_id,) if owner else ()))
+        if cur.fetchone() is None:
+            raise HTTPException(404, "Story not found" if table == "stories" else "Universal story not found")
+
+
+def _require_priority(priority: int, user_id: int) -> None:
+    """Jumping the queue is reserved for ``JOB_TRUSTED_USER_IDS``; anyone may lower their own jobs."""
+    trusted = {int(u) for u in settings.job_trusted_user_ids.split(",") if u.strip()}
+    if priority > 0 and user_id not in trusted:
+        raise HTTPException(403, "Priority above 0 is not allowed")
+
+
+def _job_response(request: Request, job: dict) -> dict:
+    body = {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "error": job["error"] if job["status"] != "succeeded" else None,
+        "createdAt": job["created_at"].isoformat() if job["created_at"] else None,
+        "finishedAt": job["finished_at"].isoformat() if job["finished_at"] else None,
+    }
+    result = job["result"] or {}
+    if "blobKeys" in result:
+        body["images"] = [blob_url(request, k) for k in result["blobKeys"]]
+        body["prompts"] = result.get("prompts", [])
+    if "blobKey" in result:
+        body["audioUrl"] = blob_url(request, result["blobKey"])
+    if "stories" in result:
+        body["stories"] = result["stories"]
+    return body
+
+
+def _accepted(request: Request, job_id: int) -> dict:
+    return {"id": job_id, "status": "queued", "statusUrl": str(request.url_for("get_job", job_id=job_id))}
+
+
+@router.post("/stories/{story_id}/images/jobs", status_code=202)
+def enqueue_story_images(
+    story_id: int,
+    request: Request,
+    num_images: int = Query(default=3, ge=1, le=6),
+    size: str = Query(default="1024x1024"),
+    priority: int = Query(default=0, ge=-100, le=100),
+    current_user_id: int = Depends(get_current_user_id),
+):
+    _require_priority(priority, current_user_id)
+    _require_row("stories", story_id, current_user_id)
+    # the worker runs without a user, so the quota is charged here, as for a synchronous request
+    rate_limit.charge_request()
+    job_id = jobs.enqueue(
+        jobs.JOB_STORY_IMAGES, {"story_id": story_id, "num_images": num_images, "size": size}, priority, user_id=current_user_id
+    )
+    return _accepted(request, job_id)
+
+
+@router.post("/stories/{story_id}/tts/jobs", status_code=202)
+def enqueue_story_tts(
+    story_id: int,
+    request: Request,
+    voice: str = Query(default="alloy"),
+    priority: int = Query(default=0, ge=-100, le=100),
+    current_user_id: int = Depends(get_current_user_id),
+):
+    _require_priority(priority, current_user_id)
+    _require_row("stories", story_id, current_user_id)
+    rate_limit.charge_request()
+    job_id = jobs.enqueue(jobs.JOB_STORY_TTS, {"story_id": story_id, "voice": voice}, priority, user_id=current_user_id)
+    return _accepted(request, job_id)
+
+
+@router.post("/universal-stories/{story_id}/tts/jobs", status_code=202)
+def enqueue_universal_tts(
+    story_id: str,
+    request: Request,
+    voice: str = Query(default=settings.openai_tts_voice),
+    priority: int = Query(default=0, ge=-100, le=100),
+    current_user_id: int = Depends(get_current_user_id),
+):
+    _require_priority(priority, current_user_id)
+    _require_row("universal_stories", story_id)
+    rate_limit.charge_request()
+    job_id = jobs.enqueue(jobs.JOB_UNIVERSAL_TTS, {"story_id": story_id, "voice": voice}, priority, user_id=current_user_id)
+    return _accepted(request, job_id)
+
+
+@router.post("/stories/batch/jobs", status_code=202)
+def enqueue_story_batch(
+    batch: BatchCreateStoriesRequest,
+    request: Request,
+    priority: int = Query(default=0, ge=-100, le=100),
+    current_user_id: int = Depends(get_current_user_id),
+):
+    """Queue a story batch for the worker (pre-seeding); the job's ``stories`` holds the per-item results."""
+    _require_priority(priority, current_user_id)
+    items = batch_items(batch)
+    # the worker runs without a user, so the quota is charged here, one unit per story
+    rate_limit.charge_request(len(items))
+    job_id = jobs.enqueue(jobs.JOB_STORY_BATCH, {"user_id": current_user_id, "items": items}, priority, user_id=current_user_id)
+    return _accepted(request, job_id)
+
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: int, request: Request, current_user_id: int = Depends(get_current_user_id)):
+    # ids are sequential and results carry story content: other users' jobs look missing
+    job = jobs.get(job_id, current_user_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return _job_response(request, job)
@@ -1,15 +1,189 @@
-from fastapi import APIRouter, HTTPException, Depends, Query, Response
-from schemas import UpdateSettingsRequest, CreateStoryRequest
-from security import get_current_user_id
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from schemas import UpdateSettingsRequest, CreateStoryRequest, BatchCreateStoriesRequest
+from security import create_access_token, get_current_claims, get_current_user_id, story_settings_from_claims
 from db import db_cursor
-from services.openai_service import generate_story, image_prompts_from_story, images_from_prompts, synthesize_tts_bytes
+from responses import json_with_stream
+from routers.blobs import blob_response, blob_url
+from services.blob_store import get_blob_store
+from services import coalesce, image_variants, rate_limit, story_batch, story_media, tts_cache, tts_segments
+from services.image_variants import ImageFormat, Variant
+from services.coalesce import Lease
+from config import settings
+from services.openai_service import StoryStreamInterrupted, generate_story, generate_story_stream
 from datetime import datetime
-import psycopg2
+from concurrent.futures import Future
+from queue import Queue
+from typing import Callable, Iterator, List, Optional
+import base64
+import contextvars
+import itertools
+import json
+import logging
+import threading
 
 
 router = APIRouter()
+logger = logging.getLogger("uvicorn.error")
+
+# TTS responses for a story can change (regeneration, compaction), so clients revalidate via ETag
+PRIVATE_REVALIDATE = "private, no-cache"
+
+
+def story_prompt_and_title(story: CreateStoryRequest) -> tuple[str, str]:
+    if story.storyType == "character" and story.character:
+        return f"en historia med {story.character}", f"Äventyr med {story.character}"
+    if story.storyType == "custom" and story.prompt:
+        return story.prompt, story.title or "Ditt Äventyr"
+    prompt = f"{story.character or 'en hjälte'} i {story.setting or 'ett magiskt land'} som {story.adventure or 'går på äventyr'}"
+    return prompt, story.title or "Ett Magiskt Äventyr"
+
+
+class TtsCacheWriter:
+    """Tee streamed TTS chunks into the blob store and register them in the TTS cache.
+
+    The writer belongs to the single-flight leader for its cache key: when the
+    upstream body ends it commits the blob, releases the lease and resolves
+    the in-flight call, so coalesced requests can serve the stored file. The
+    upstream is drained at its own pace, independent of how fast the client
+    downloads, and a client disconnect does not stop it. A partial stream
+    (upstream error) is discarded and fails the call instead. Cache write
+    failures never break playback.
+    """
+
+    def __init__(self, cache_key: str, voice: str, flight_call: Future, on_stored: Optional[Callable[[str, int], None]] = None, lease: Optional[Lease] = None) -> None:
+        self.cache_key = cache_key
+        self.voice = voice
+        self._call = flight_call
+        self._on_stored = on_stored
+        self._lease = lease
+        self._writer = None
+        self.failed = False
+        try:
+            self._writer = get_blob_store().open_writer("audio/mpeg")
+        except Exception:
+            self.failed = True
+
+    def write(self, chunk: bytes) -> None:
+        if self.failed:
+            return
+        try:
+            self._writer.write(chunk)
+        except Exception:
+            self.failed = True
+
+    def finish(self, completed: bool) -> None:
+        try:
+            if not completed or self.failed or not self._writer.size:
+                raise TtsStreamIncomplete(self.cache_key)
+            key = self._writer.commit()
+            tts_cache.store(self.cache_key, key, self._writer.size, self.voice)
+            if self._on_stored:
+                self._on_stored(key, self._writer.size)
+            tts_cache.flight.resolve(self.cache_key, self._call, key)
+        except Exception as exc:
+            if self._writer is not None and self._writer.key is None:
+                self._writer.abort()
+            tts_cache.flight.fail(self.cache_key, self._call, exc)
+        finally:
+            tts_cache.release(self._lease)
+
+    def pump(self, chunks: Iterator[bytes], out: "Queue[object]") -> None:
+        """Drain ``chunks`` into the blob and ``out``; ends with ``None`` or the upstream error."""
+        completed = False
+        try:
+            for chunk in chunks:
+                self.write(chunk)
+                out.put(chunk)
+            completed = True
+        except Exception as exc:
+            out.put(exc)
+        finally:
+            self.finish(completed)
+            out.put(None)
+
+    def tee(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        out: "Queue[object]" = Queue()
+        # copy the request's context so the rate limiter sees its user for later segments
+        threading.Thread(target=contextvars.copy_context().run, args=(self.pump, chunks, out), name="tts-pump", daemon=True).start()
+        while True:
+            item = out.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class TtsStreamIncomplete(Exception):
+    """The leading TTS stream ended before its audio could be cached."""
+
+
+def start_tts_stream(text: str, voice: str) -> Iterator[bytes]:
+    """Start synthesis and pull the first chunk so upstream failures still map to an HTTP error."""
+    chunks = tts_segments.synthesize_stream(text, voice)
+    try:
+        first = next(chunks)
+    except StopIteration:
+        return iter(())
+    except rate_limit.Throttled:
+        raise
+    except Exception:
+        raise HTTPException(500, "TTS generation failed")
+    return itertools.chain([first], chunks)
+
+
+def serve_tts(request: Request, text: str, voice: str, on_stored: Optional[Callable[[str, int], None]] = None) -> Response:
+    """Serve TTS for ``text`` from the shared cache, synthesizing at most once per key concurrently."""
+    key = tts_cache.cache_key(text, voice)
+    try:
+        blob = tts_cache.lookup(key)
+    except Exception:
+        blob = None
+    if blob:
+        return blob_response(request, blob, cache_control=PRIVATE_REVALIDATE)
+
+    if not settings.tts_streaming:
+        try:
+            blob = tts_segments.get_or_synthesize(text, voice)
+        except rate_limit.Throttled:
+            raise
+        except Exception:
+            raise HTTPException(500, "TTS generation failed")
+        if on_stored:
+            try:
+                on_stored(blob, get_blob_store().size(blob))
+            except Exception:
+                pass
+        return blob_response(request, blob, cache_control=PRIVATE_REVALIDATE)
+
+    call, leader = tts_cache.flight.acquire(key)
+    if not leader:
+        try:
+            return blob_response(request, call.result(timeout=settings.tts_cache_wait_timeout), cache_control=PRIVATE_REVALIDATE)
+        except Exception:
+            # Leader failed or timed out: synthesize uncached rather than failing the listener
+            return StreamingResponse(start_tts_stream(text, voice), media_type="audio/mpeg")
+    lease, blob = tts_cache.claim(key)
+    if blob:
+        tts_cache.flight.resolve(key, call, blob)
+        return blob_response(request, blob, cache_control=PRIVATE_REVALIDATE)
+    writer = TtsCacheWriter(key, voice, call, on_stored, lease)
+    try:
+        chunks = start_tts_stream(text, voice)
+    except BaseException:
+        writer.finish(False)
+        raise
+    body = writer.tee(chunks)
+    try:
+        first = next(body)
+    except StopIteration:
+        return Response(content=b"", media_type="audio/mpeg")
+    return StreamingResponse(itertools.chain([first], body), media_type="audio/mpeg")
+
+
 @router.get("/stories/{story_id}/tts")
-def tts_story(story_id: int, voice: str = Query(default="alloy")):
+def tts_story(story_id: int, request: Request, voice: str = Query(default="alloy")):
     # Fetch story text
     with db_cursor() as (conn, cur):
         cur.execute("SELECT content FROM stories WHERE id = %s", (story_id,))
@@ -19,34 +193,7 @@ def tts_story(story_id: int, voice: str = Query(default="alloy")):
     text = row[0] or ""
     if not text.strip():
         raise HTTPException(400, "Story has no content")
-    # Try return cached audio first
-    try:
-        with db_cursor() as (conn, cur):
-            cur.execute(
-                "SELECT audio_bytes FROM story_audio WHERE story_id = %s AND voice = %s ORDER BY created_at DESC LIMIT 1",
-                (story_id, voice),
-            )
-            row_audio = cur.fetchone()
-        if row_audio and row_audio[0]:
-            blob = row_audio[0]
-            return Response(content=(blob.tobytes() if hasattr(blob, 'tobytes') else blob), media_type="audio/mpeg")
-    except Exception:
-        pass
-    # Generate fresh, then save
-    try:
-        audio_bytes = synthesize_tts_bytes(text, voice)
-        try:
-            with db_cursor() as (conn, cur):
-                cur.execute(
-                    "INSERT INTO story_audio (story_id, voice, audio_bytes, created_at) VALUES (%s, %s, %s, %s)",
-                    (story_id, voice, psycopg2.Binary(audio_bytes), datetime.now()),
-                )
-        except Exception:
-            pass
-        return Response(content=audio_bytes, media_type="audio/mpeg")
-    except Exception:
-        raise HTTPException(500, "TTS generation failed")
-
+    return serve_tts(request, text, voice, on_stored=lambda key, size: story_media.save_story_audio(story_id, voice, key, size))
 
 
 @router.put("/users/{user_id}/settings")
@@ -61,70 +208,194 @@ def update_user_settings(user_id: int, settings: UpdateSettingsRequest, current_
     if settings.storyComplexity is not None:
         updates.append("story_complexity = %s")
         params.append(settings.storyComplexity)
-    if updates:
-        params.append(user_id)
-        with db_cursor() as (conn, cur):
-            cur.execute(f"UPDATE users SET {', '.join(updates)} WHERE id = %s", params)
-    return {"message": "Settings updated"}
+    params.append(user_id)
+    with db_cursor() as (conn, cur):
+        if updates:
+            cur.execute(f"UPDATE users SET {', '.join(updates)} WHERE id = %s RETURNING story_age, story_complexity", params)
+        else:
+            cur.execute("SELECT story_age, story_complexity FROM users WHERE id = %s", params)
+        row = cur.fetchone()
+    if not row:
+        raise HTTPException(404, "User not found")
+    # Reissue the token so the story settings embedded in it stay current
+    return {"message": "Settings updated", "token": create_access_token(user_id, (row[0] or 5, row[1] or "medium"))}
 
 
-@router.post("/stories")
-def create_story(story: CreateStoryRequest, current_user_id: int = Depends(get_current_user_id)):
+def _user_story_settings(user_id: int, claims: Optional[dict] = None) -> tuple[int, str]:
+    embedded = story_settings_from_claims(claims) if claims else None
+    if embedded:
+        return embedded
     with db_cursor() as (conn, cur):
-        cur.execute("SELECT story_age, story_complexity FROM users WHERE id = %s", (current_user_id,))
+        cur.execute("SELECT story_age, story_complexity FROM users WHERE id = %s", (user_id,))
         user = cur.fetchone()
-        if not user:
-            raise HTTPException(404, "User not found")
-        age, complexity = user[0] or 5, user[1] or "medium"
-
-        if story.storyType == "character" and story.character:
-            prompt = f"en historia med {story.character}"
-            title = f"Äventyr med {story.character}"
-        elif story.storyType == "custom" and story.prompt:
-            prompt = story.prompt
-            title = story.title or "Ditt Äventyr"
-        else:
-            prompt = f"{story.character or 'en hjälte'} i {story.setting or 'ett magiskt land'} som {story.adventure or 'går på äventyr'}"
-            title = story.title or "Ett Magiskt Äventyr"
+    if not user:
+        raise HTTPException(404, "User not found")
+    return user[0] or 5, user[1] or "medium"
 
-        content = generate_story(prompt, age, complexity)
 
+def _insert_story(user_id: int, title: str, content: str, story_type: str) -> int:
+    with db_cursor() as (conn, cur):
         cur.execute(
             """
             INSERT INTO stories (user_id, title, content, story_type, created_at)
             VALUES (%s, %s, %s, %s, %s) RETURNING id
             """,
-            (current_user_id, title, content, story.storyType, datetime.now()),
+            (user_id, title, content, story_type, datetime.now()),
         )
-        story_id = cur.fetchone()[0]
+        return cur.fetchone()[0]
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@router.post("/stories")
+def create_story(story: CreateStoryRequest, current_user_id: int = Depends(get_current_user_id), claims: dict = Depends(get_current_claims)):
+    age, complexity = _user_story_settings(current_user_id, claims)
+
+    # Generate outside the DB block so a pooled connection is not held for the upstream call
+    prompt, title = story_prompt_and_title(story)
+    content = generate_story(prompt, age, complexity)
+    story_id = _insert_story(current_user_id, title, content, story.storyType)
 
     return {"id": story_id, "title": title, "content": content, "storyType": story.storyType, "createdAt": datetime.now().isoformat()}
 
 
+def batch_items(batch: BatchCreateStoriesRequest) -> List[story_batch.BatchItem]:
+    if not batch.stories:
+        raise HTTPException(400, "No stories in batch")
+    if len(batch.stories) > settings.story_batch_max_items:
+        raise HTTPException(400, f"At most {settings.story_batch_max_items} stories per batch")
+    return [(*story_prompt_and_title(story), story.storyType) for story in batch.stories]
+
+
+@router.post("/stories/batch")
+def create_stories_batch(
+    batch: BatchCreateStoriesRequest, current_user_id: int = Depends(get_current_user_id), claims: dict = Depends(get_current_claims)
+):
+    """Create many stories at once (a class, a catalog).
+
+    Generation runs with bounded concurrency and the stories are saved with a
+    single insert. ``results`` follows the request order with a per-item
+    ``status``: ``created``, ``throttled`` (retry after ``retryAfter``) or ``failed``.
+    """
+    items = batch_items(batch)
+    # one unit per story up front; the generations themselves then belong to this request
+    rate_limit.charge_request(len(items))
+    age, complexity = _user_story_settings(current_user_id, claims)
+    results = story_batch.run_batch(current_user_id, items, age, complexity)
+    return {"results": results, "created": sum(r["status"] == "created" for r in results)}
+
+
+@router.post("/stories/stream")
+def create_story_stream(story: CreateStoryRequest, current_user_id: int = Depends(get_current_user_id), claims: dict = Depends(get_current_claims)):
+    """Server-Sent Events variant of POST /stories.
+
+    Emits ``start``, then one ``token`` event per text delta, and finally
+    ``done`` with the persisted story id, or ``error`` if generation broke
+    off mid-story (nothing is saved) or saving failed.
+    """
+    age, complexity = _user_story_settings(current_user_id, claims)
+    prompt, title = story_prompt_and_title(story)
+
+    def events():
+        yield sse_event("start", {"title": title, "storyType": story.storyType})
+        parts = []
+        try:
+            for delta in generate_story_stream(prompt, age, complexity):
+                parts.append(delta)
+                yield sse_event("token", {"text": delta})
+        except rate_limit.Throttled as exc:
+            yield sse_event("error", {"detail": "Too many story requests, try again shortly", "retryAfter": round(exc.retry_after, 1)})
+            return
+        except StoryStreamInterrupted:
+            logger.warning("Story stream broke off after %d deltas", len(parts), exc_info=True)
+            yield sse_event("error", {"detail": "Story generation was interrupted"})
+            return
+        content = "".join(parts).strip()
+        try:
+            story_id = _insert_story(current_user_id, title, content, story.storyType)
+        except Exception:
+            yield sse_event("error", {"detail": "Could not save story"})
+            return
+        yield sse_event("done", {"id": story_id, "title": title, "storyType": story.storyType, "createdAt": datetime.now().isoformat()})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+STORY_EXCERPT_CHARS = 160
+STORY_LIST_FIELDS = {"content"}
+
+
+def _encode_cursor(created_at: datetime, story_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), story_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, story_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(story_id)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
+
+
 @router.get("/stories")
-def get_user_stories(current_user_id: int = Depends(get_current_user_id)):
+def get_user_stories(
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: Optional[str] = Query(default=None),
+    fields: Optional[str] = Query(default=None, description="Comma-separated extra fields, e.g. 'content'"),
+    current_user_id: int = Depends(get_current_user_id),
+):
+    """List the user's stories newest first, one keyset page at a time.
+
+    Items carry a short excerpt; pass ``fields=content`` for the full text.
+    Follow ``nextCursor`` for the next page (null on the last one).
+    """
+    extra = {f.strip() for f in (fields or "").split(",") if f.strip()}
+    if extra - STORY_LIST_FIELDS:
+        raise HTTPException(400, f"Unknown fields: {', '.join(sorted(extra - STORY_LIST_FIELDS))}")
+    with_content = "content" in extra
+    body_column = "content" if with_content else "left(content, %s)" % (STORY_EXCERPT_CHARS + 1)
+    params: list = [current_user_id]
+    after = ""
+    if cursor:
+        after = "AND (created_at, id) < (%s, %s)"
+        params.extend(_decode_cursor(cursor))
+    params.append(limit + 1)
     with db_cursor() as (conn, cur):
         cur.execute(
-            """
-            SELECT id, title, content, story_type, created_at
+            f"""
+            SELECT id, title, {body_column}, story_type, created_at
             FROM stories
-            WHERE user_id = %s
-            ORDER BY created_at DESC
+            WHERE user_id = %s {after}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
             """,
-            (current_user_id,),
+            params,
         )
         rows = cur.fetchall()
-    stories = [
-        {
+    page = rows[:limit]
+    stories = []
+    for r in page:
+        text = r[2] or ""
+        item = {
             "id": r[0],
             "title": r[1],
-            "content": r[2],
+            "excerpt": text[:STORY_EXCERPT_CHARS].rstrip() + ("…" if len(text) > STORY_EXCERPT_CHARS else ""),
             "storyType": r[3],
             "createdAt": r[4].isoformat() if r[4] else None,
         }
-        for r in rows
-    ]
-    return {"stories": stories}
+        if with_content:
+            item["content"] = text
+        stories.append(item)
+    next_cursor = None
+    if len(rows) > limit and page[-1][4] is not None:
+        next_cursor = _encode_cursor(page[-1][4], page[-1][0])
+    return {"stories": stories, "nextCursor": next_cursor}
 
 
 @router.get("/stories/{story_id}")
@@ -159,8 +430,33 @@ def delete_story(story_id: int, current_user_id: int = Depends(get_current_user_
     return {"message": "Story deleted"}
 
 
-@router.post("/stories/{story_id}/images")
-def generate_story_images(story_id: int, num_images: int = Query(default=3, ge=1, le=6), size: str = Query(default="1024x1024")):
+def _image_url(request: Request, story_id: int, row, variant: str, fmt: str) -> str:
+    """URL for a ``(image_index, blob_key, variants)`` row: a /blobs URL, or the per-image route for legacy rows."""
+    if row[1]:
+        return blob_url(request, image_variants.select(row[1], row[2], variant, fmt))
+    url = request.url_for("get_story_image", story_id=story_id, index=row[0])
+    return str(url.include_query_params(variant=variant, format=fmt) if variant != image_variants.ORIGINAL else url)
+
+
+def _stored_images(
+    request: Request, story_id: int, since: Optional[datetime] = None, variant: str = image_variants.ORIGINAL, fmt: str = "webp"
+) -> dict:
+    query = "SELECT image_index, blob_key, variants, prompt FROM story_images WHERE story_id = %s"
+    params: list = [story_id]
+    if since is not None:
+        query += " AND created_at >= %s"
+        params.append(since)
+    with db_cursor() as (conn, cur):
+        cur.execute(query + " ORDER BY image_index ASC", params)
+        rows = cur.fetchall()
+    # Stored images are returned as /blobs URLs; rows not yet migrated are served one by one
+    return {
+        "images": [_image_url(request, story_id, r, variant, fmt) for r in rows],
+        "prompts": [r[3] for r in rows],
+    }
+
+
+def _story_for_images(story_id: int) -> tuple[str, str]:
     with db_cursor() as (conn, cur):
         cur.execute("SELECT title, content FROM stories WHERE id = %s", (story_id,))
         row = cur.fetchone()
@@ -169,31 +465,118 @@ def generate_story_images(story_id: int, num_images: int = Query(default=3, ge=1
     title, content = row[0] or "Saga", row[1] or ""
     if not content.strip():
         raise HTTPException(400, "Story has no content")
-    prompts = image_prompts_from_story(content, num_images=num_images)
-    images = images_from_prompts(prompts, size=size)
-    if not images:
-        raise HTTPException(500, "Image generation failed")
-    try:
-        with db_cursor() as (conn, cur):
-            cur.execute("DELETE FROM story_images WHERE story_id = %s", (story_id,))
-            for idx, (img, pr) in enumerate(zip(images, prompts)):
-                cur.execute(
-                    "INSERT INTO story_images (story_id, image_index, data_url, prompt, created_at) VALUES (%s, %s, %s, %s, %s)",
-                    (story_id, idx, img, pr, datetime.now()),
-                )
-    except Exception:
-        pass
-    return {"title": title, "images": images, "prompts": prompts}
+    return title, content
+
+
+@router.post("/stories/{story_id}/images")
+def generate_story_images(
+    story_id: int,
+    request: Request,
+    num_images: int = Query(default=3, ge=1, le=6),
+    size: str = Query(default="1024x1024"),
+    variant: Variant = Query(default="original"),
+    fmt: ImageFormat = Query(default="webp", alias="format"),
+):
+    title, content = _story_for_images(story_id)
+    started = datetime.now()
+
+    def lookup() -> Optional[dict]:
+        # Another worker finished the same generation while we waited for the lease
+        stored = _stored_images(request, story_id, since=started, variant=variant, fmt=fmt)
+        return {"title": title, **stored} if stored["images"] else None
+
+    def compute() -> dict:
+        images, prompts = story_media.generate_story_images(content, num_images, size)
+        if not images:
+            raise HTTPException(500, "Image generation failed")
+        try:
+            keys = story_media.store_story_images(story_id, images, prompts)
+        except Exception:
+            # not stored: hand back the data URLs themselves
+            return {"title": title, "images": images, "prompts": prompts}
+        return {"title": title, "images": [blob_url(request, k) for k in keys], "prompts": prompts[: len(keys)]}
+
+    result = coalesce.run("story_images", (story_id, num_images, size), compute, lookup)
+    if variant != image_variants.ORIGINAL:
+        # generation stores every variant, but shared results carry the originals
+        result = lookup() or result
+    return json_with_stream(result, "images")
+
+
+@router.post("/stories/{story_id}/images/stream")
+def generate_story_images_stream(
+    story_id: int,
+    request: Request,
+    num_images: int = Query(default=3, ge=1, le=6),
+    size: str = Query(default="1024x1024"),
+    variant: Variant = Query(default="original"),
+    fmt: ImageFormat = Query(default="webp", alias="format"),
+):
+    """Server-Sent Events variant of POST /stories/{id}/images.
+
+    Emits ``prompts``, then one ``image`` event per picture as soon as it is
+    stored (its ``url``, of the requested ``variant``, can be fetched right
+    away), and finally ``done`` with the number of images (or ``error``).
+    """
+    title, content = _story_for_images(story_id)
+
+    def events():
+        count = 0
+        try:
+            for kind, data in story_media.stream_story_images(story_id, content, num_images, size):
+                if kind == "prompts":
+                    yield sse_event("prompts", {"title": title, "prompts": data})
+                    continue
+                index, key, variants, prompt = data
+                count += 1
+                url = blob_url(request, image_variants.select(key, variants, variant, fmt))
+                yield sse_event("image", {"index": index, "url": url, "prompt": prompt})
+        except rate_limit.Throttled as exc:
+            yield sse_event("error", {"detail": "Too many story requests, try again shortly", "retryAfter": round(exc.retry_after, 1)})
+            return
+        except Exception:
+            logger.warning("Streaming image generation failed for story %s", story_id, exc_info=True)
+        if not count:
+            yield sse_event("error", {"detail": "Image generation failed"})
+            return
+        yield sse_event("done", {"count": count})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 @router.get("/stories/{story_id}/images")
-def get_story_images(story_id: int):
-    with db_cursor() as (conn, cur):
-        cur.execute(
-            "SELECT image_index, data_url, prompt FROM story_images WHERE story_id = %s ORDER BY image_index ASC",
-            (story_id,),
-        )
-        rows = cur.fetchall()
-    return {"images": [r[1] for r in rows], "prompts": [r[2] for r in rows]}
+def get_story_images(
+    story_id: int, request: Request, variant: Variant = Query(default="original"), fmt: ImageFormat = Query(default="webp", alias="format")
+):
+    """Stored image URLs; ``variant=thumb|medium`` selects a downscaled copy in ``format`` where one was rendered."""
+    return _stored_images(request, story_id, variant=variant, fmt=fmt)
+
 
+@router.get("/stories/{story_id}/images/{index}")
+def get_story_image(
+    story_id: int, index: int, request: Request, variant: Variant = Query(default="original"), fmt: Optional[ImageFormat] = Query(default=None, alias="format")
+):
+    """One stored image as raw bytes, revalidated by ETag since regenerating replaces it.
 
+    Without ``format`` a variant is sent as WebP when the Accept header allows it, JPEG otherwise.
+    """
+    with db_cursor() as (conn, cur):
+        cur.execute("SELECT id, blob_key, data_url, variants FROM story_images WHERE story_id = %s AND image_index = %s", (story_id, index))
+        row = cur.fetchone()
+    if not row or not (row[1] or row[2]):
+        raise HTTPException(404, "Image not found")
+    key, variants = row[1], row[3]
+    if key is None:
+        # row from before blob storage: move it over (and render its variants) on first access
+        key, variants = story_media.put_image(row[2])
+        with db_cursor() as (conn, cur):
+            cur.execute(
+                "UPDATE story_images SET blob_key = %s, data_url = NULL, variants = %s::jsonb WHERE id = %s",
+                (key, json.dumps(variants), row[0]),
+            )
+    negotiated = fmt is None and variant != image_variants.ORIGINAL
+    fmt = fmt or image_variants.preferred_format(request.headers.get("accept", ""))
+    response = blob_response(request, image_variants.select(key, variants, variant, fmt), cache_control=PRIVATE_REVALIDATE)
+    if negotiated:
+        response.headers["Vary"] = "Accept"
+    return response
@@ -1,67 +1,103 @@
-from fastapi import APIRouter, HTTPException, Query, Response
-from db import db_cursor
-from services.openai_service import images_from_prompts, image_prompts_from_story, synthesize_tts_bytes
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from services import catalog_cache, rate_limit, story_media
+from routers.blobs import blob_url
+from services.catalog_cache import CachedPayload
+from services.image_variants import ImageFormat, Variant
+from routers.stories import serve_tts
 from config import settings
 
 
 router = APIRouter()
 
 
+# Catalog changes are rare but should show up promptly, so clients revalidate against the ETag
+_CATALOG_CACHE_CONTROL = "public, no-cache"
+
+
+def _accepts_gzip(request: Request) -> bool:
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, *params = [p.strip() for p in part.split(";")]
+        if coding.lower() not in ("gzip", "*"):
+            continue
+        q = next((p[2:] for p in params if p.startswith("q=")), "1")
+        try:
+            return float(q) > 0
+        except ValueError:
+            return False
+    return False
+
+
+def cached_json_response(request: Request, payload: CachedPayload) -> Response:
+    """Serve a precomputed JSON payload, answering matching ``If-None-Match`` with 304.
+
+    The gzip and identity bodies are different representations, so each gets
+    its own strong ETag (the gzip one with a ``-gz`` suffix).
+    """
+    gzipped = _accepts_gzip(request)
+    etag = f'{payload.etag[:-1]}-gz"' if gzipped else payload.etag
+    headers = {"ETag": etag, "Cache-Control": _CATALOG_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match")
+    # If-None-Match uses weak comparison, so a W/ added by a proxy still matches
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+        return Response(payload.gzipped, media_type="application/json", headers=headers)
+    return Response(payload.body, media_type="application/json", headers=headers)
+
+
 @router.get("/universal-stories")
-def get_universal_stories():
-    with db_cursor() as (conn, cur):
-        cur.execute(
-            """
-            SELECT id, title, description, COALESCE(icon, ''), COALESCE(category, '')
-            FROM universal_stories
-            ORDER BY title ASC
-            """
-        )
-        rows = cur.fetchall()
-    stories = [
-        {"id": r[0], "title": r[1], "description": r[2], "icon": r[3] or "", "category": r[4] or ""}
-        for r in rows
-    ]
-    return {"stories": stories}
+def get_universal_stories(request: Request):
+    return cached_json_response(request, catalog_cache.snapshot().listing)
 
 
 @router.get("/universal-stories/{story_id}")
-def get_universal_story(story_id: str):
-    with db_cursor() as (conn, cur):
-        cur.execute("SELECT id, title, content FROM universal_stories WHERE id = %s", (story_id,))
-        row = cur.fetchone()
-    if not row:
+def get_universal_story(story_id: str, request: Request):
+    payload = catalog_cache.snapshot().stories.get(story_id)
+    if payload is None:
         raise HTTPException(404, "Universal story not found")
-    return {"id": row[0], "title": row[1], "content": row[2], "storyType": "universal"}
+    return cached_json_response(request, payload)
 
 
 @router.get("/universal-stories/{story_id}/tts")
-def tts_universal_story(story_id: str, voice: str = Query(default=settings.openai_tts_voice)):
-    with db_cursor() as (conn, cur):
-        cur.execute("SELECT content FROM universal_stories WHERE id = %s", (story_id,))
-        row = cur.fetchone()
-    if not row:
+def tts_universal_story(story_id: str, request: Request, voice: str = Query(default=settings.openai_tts_voice)):
+    story = catalog_cache.story_content(story_id)
+    if not story:
         raise HTTPException(404, "Universal story not found")
-    text = row[0]
-    try:
-        audio_bytes = synthesize_tts_bytes(text, voice)
-        return Response(content=audio_bytes, media_type="audio/mpeg")
-    except Exception:
-        raise HTTPException(500, "TTS generation failed")
+    return serve_tts(request, story[1], voice)
 
 
 @router.post("/universal-stories/{story_id}/images")
-def generate_universal_story_images(story_id: str, num_images: int = Query(default=3, ge=1, le=6), size: str = Query(default="1024x1024")):
-    with db_cursor() as (conn, cur):
-        cur.execute("SELECT title, content FROM universal_stories WHERE id = %s", (story_id,))
-        row = cur.fetchone()
-    if not row:
+def generate_universal_story_images(
+    story_id: str,
+    request: Request,
+    num_images: int = Query(default=3, ge=1, le=6),
+    size: str = Query(default="1024x1024"),
+    variant: Variant = Query(default="original"),
+    fmt: ImageFormat = Query(default="webp", alias="format"),
+):
+    story = catalog_cache.story_content(story_id)
+    if not story:
         raise HTTPException(404, "Universal story not found")
-    title, content = row[0], row[1]
-    prompts = image_prompts_from_story(content, num_images=num_images)
-    images = images_from_prompts(prompts, size=size)
-    if not images:
+    title, content = story
+    try:
+        keys, prompts = story_media.universal_images(story_id, content, num_images, size, variant, fmt)
+    except rate_limit.Throttled:
+        raise
+    except Exception:
         raise HTTPException(500, "Image generation failed")
-    return {"title": title, "images": images, "prompts": prompts}
+    return {"title": title, "images": [blob_url(request, k, public=True) for k in keys], "prompts": prompts}
 
 
+@router.get("/universal-stories/{story_id}/images")
+def get_universal_story_images(
+    story_id: str,
+    request: Request,
+    size: str = Query(default="1024x1024"),
+    variant: Variant = Query(default="original"),
+    fmt: ImageFormat = Query(default="webp", alias="format"),
+):
+    if not catalog_cache.story_content(story_id):
+        raise HTTPException(404, "Universal story not found")
+    keys, prompts = story_media.stored_universal_images(story_id, size, variant, fmt)
+    return {"images": [blob_url(request, k, public=True) for k in keys], "prompts": prompts}
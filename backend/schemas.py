@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 class LoginRequest(BaseModel):
     username: str
@@ -23,4 +23,7 @@ class CreateStoryRequest(BaseModel):
     setting: Optional[str] = None
     adventure: Optional[str] = None
     prompt: Optional[str] = None
-    storyType: str = "custom" 
\ No newline at end of file
+    storyType: str = "custom" 
+
+class BatchCreateStoriesRequest(BaseModel):
+    stories: List[CreateStoryRequest]
@@ -2,36 +2,92 @@ from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
+from collections import OrderedDict
 from typing import Optional
 from config import settings
+from services import rate_limit
+import threading
+import time
 
 
 security = HTTPBearer(auto_error=False)
 
+# token -> (claims, cached_until); entries never outlive the token's own exp. Settings are read
+# once at startup, so a key rotation means a restart, which starts with an empty cache.
+_token_cache: "OrderedDict[str, tuple[dict, float]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
 
-def create_access_token(user_id: int) -> str:
+
+def create_access_token(user_id: int, story_settings: Optional[tuple[int, str]] = None) -> str:
     now = datetime.utcnow()
     payload = {
         "sub": str(user_id),
         "iat": int(now.timestamp()),
         "exp": int((now + timedelta(minutes=settings.jwt_exp_minutes)).timestamp()),
     }
+    if story_settings is not None and settings.jwt_embed_story_settings:
+        payload["story"] = {"age": story_settings[0], "complexity": story_settings[1]}
     return jwt.encode(payload, settings.jwt_secret, algorithm=settings.jwt_algorithm)
 
 
-def get_current_user_id(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> int:
-    if not credentials or credentials.scheme.lower() != "bearer":
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    token = credentials.credentials
+def _cached_claims(token: str) -> Optional[dict]:
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is None:
+            return None
+        claims, cached_until = entry
+        if time.time() >= cached_until:
+            del _token_cache[token]
+            return None
+        _token_cache.move_to_end(token)
+        return claims
+
+
+def _cache_claims(token: str, claims: dict) -> None:
+    cached_until = min(float(claims.get("exp", 0)), time.time() + settings.jwt_cache_ttl)
+    with _token_cache_lock:
+        _token_cache[token] = (claims, cached_until)
+        _token_cache.move_to_end(token)
+        while len(_token_cache) > settings.jwt_cache_size:
+            _token_cache.popitem(last=False)
+
+
+def decode_token(token: str) -> dict:
+    claims = _cached_claims(token)
+    if claims is not None:
+        return claims
     try:
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
-        sub = payload.get("sub")
-        if not sub:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return int(sub)
+        claims = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm], options={"require": ["exp", "sub"]})
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid token")
+    try:
+        int(claims["sub"])
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if settings.jwt_cache_size > 0:
+        _cache_claims(token, claims)
+    return claims
+
+
+# async so they run in the request's own context: the user id set here is what the
+# rate limiter sees for upstream calls made while handling the request
+async def get_current_claims(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> dict:
+    if not credentials or credentials.scheme.lower() != "bearer":
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    claims = decode_token(credentials.credentials)
+    rate_limit.begin_action(int(claims["sub"]))
+    return claims
+
+
+async def get_current_user_id(claims: dict = Depends(get_current_claims)) -> int:
+    return int(claims["sub"])
 
 
+def story_settings_from_claims(claims: dict) -> Optional[tuple[int, str]]:
+    """``(age, complexity)`` embedded at login/settings update, or None for tokens without them."""
+    story = claims.get("story")
+    if not isinstance(story, dict) or "age" not in story or "complexity" not in story:
+        return None
+    return story["age"], story["complexity"]
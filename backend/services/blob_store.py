@@ -0,0 +1,297 @@
+"""Content-addressed blob storage for generated images and audio.
+
+Blobs are keyed by ``<sha256>.<ext>`` so identical media is stored once and
+the key doubles as a strong ETag. The database only keeps keys.
+"""
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Iterator, Optional, Tuple
+from config import settings
+import base64
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+
+
+EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp", "audio/mpeg": "mp3"}
+
+
+def blob_key(digest: str, content_type: str) -> str:
+    return f"{digest}.{EXTENSIONS.get(content_type, 'bin')}"
+
+
+def content_type_for(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+def is_valid_key(key: str) -> bool:
+    digest, _, ext = key.partition(".")
+    return len(digest) == 64 and all(c in "0123456789abcdef" for c in digest) and ext in EXTENSIONS.values()
+
+
+class BlobWriter:
+    """Incremental writer: hashes while spooling to a temp file, commits under the content hash."""
+
+    def __init__(self, store: "BlobStore", content_type: str) -> None:
+        self._store = store
+        self._content_type = content_type
+        self._hash = hashlib.sha256()
+        self._tmp = store._temp_file()
+        self.size = 0
+        self.key: Optional[str] = None
+
+    def write(self, chunk: bytes) -> None:
+        self._hash.update(chunk)
+        self._tmp.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> str:
+        self.key = blob_key(self._hash.hexdigest(), self._content_type)
+        self._tmp.flush()
+        self._store._commit_temp(self._tmp, self.key)
+        return self.key
+
+    def abort(self) -> None:
+        self._store._discard_temp(self._tmp)
+
+
+class BlobStore(ABC):
+    def put(self, data: bytes, content_type: str) -> str:
+        writer = self.open_writer(content_type)
+        try:
+            writer.write(data)
+            return writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def open_writer(self, content_type: str) -> BlobWriter:
+        return BlobWriter(self, content_type)
+
+    def get(self, key: str) -> bytes:
+        return b"".join(self.iter_range(key))
+
+    # Backend interface
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def size(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    def modified(self, key: str) -> float:
+        """When the blob was last written or reused, in epoch seconds."""
+
+    @abstractmethod
+    def iter_range(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = 65536) -> Iterator[bytes]:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def iter_blobs(self) -> Iterator[Tuple[str, int, float]]:
+        """Every stored blob as ``(key, size, modified)``, ``modified`` in epoch seconds."""
+
+    def purge_temp(self, max_age: float) -> Tuple[int, int]:
+        """Remove abandoned partial writes older than ``max_age`` seconds; returns ``(files, bytes)``."""
+        return 0, 0
+
+    @abstractmethod
+    def _temp_file(self) -> BinaryIO:
+        ...
+
+    @abstractmethod
+    def _commit_temp(self, tmp: BinaryIO, key: str) -> None:
+        ...
+
+    def _discard_temp(self, tmp: BinaryIO) -> None:
+        try:
+            tmp.close()
+        except Exception:
+            pass
+
+
+class LocalBlobStore(BlobStore):
+    """Filesystem backend, sharded as ``<root>/ab/cd/<key>``."""
+
+    def __init__(self, root: str) -> None:
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key))
+
+    def modified(self, key: str) -> float:
+        return os.path.getmtime(self.path(key))
+
+    def iter_range(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = 65536) -> Iterator[bytes]:
+        with open(self.path(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def iter_blobs(self) -> Iterator[Tuple[str, int, float]]:
+        tmp = os.path.join(self.root, "tmp")
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != tmp]
+            for name in filenames:
+                if not is_valid_key(name):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    continue
+                yield name, st.st_size, st.st_mtime
+
+    def purge_temp(self, max_age: float) -> Tuple[int, int]:
+        files = size = 0
+        cutoff = time.time() - max_age
+        with os.scandir(os.path.join(self.root, "tmp")) as entries:
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                    if entry.is_file() and st.st_mtime < cutoff:
+                        os.remove(entry.path)
+                        files, size = files + 1, size + st.st_size
+                except FileNotFoundError:
+                    continue
+        return files, size
+
+    def _temp_file(self) -> BinaryIO:
+        return tempfile.NamedTemporaryFile(dir=os.path.join(self.root, "tmp"), delete=False)
+
+    def _commit_temp(self, tmp: BinaryIO, key: str) -> None:
+        tmp.close()
+        dest = self.path(key)
+        if os.path.exists(dest):
+            os.remove(tmp.name)
+            # a fresh reference to old content: restart its garbage-collection grace period
+            os.utime(dest)
+            return
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp.name, dest)
+
+    def _discard_temp(self, tmp: BinaryIO) -> None:
+        super()._discard_temp(tmp)
+        try:
+            os.remove(tmp.name)
+        except Exception:
+            pass
+
+
+class S3BlobStore(BlobStore):
+    """S3-compatible backend (AWS S3, MinIO or any local stand-in speaking the S3 API)."""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None) -> None:
+        import boto3  # only required when BLOB_BACKEND=s3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self._s3 = boto3.client("s3", endpoint_url=endpoint_url or None)
+
+    def _object(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._s3.head_object(Bucket=self.bucket, Key=self._object(key))
+            return True
+        except Exception:
+            return False
+
+    def size(self, key: str) -> int:
+        return self._s3.head_object(Bucket=self.bucket, Key=self._object(key))["ContentLength"]
+
+    def modified(self, key: str) -> float:
+        return self._s3.head_object(Bucket=self.bucket, Key=self._object(key))["LastModified"].timestamp()
+
+    def iter_range(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = 65536) -> Iterator[bytes]:
+        kwargs = {}
+        if start or end is not None:
+            kwargs["Range"] = f"bytes={start}-{'' if end is None else end}"
+        body = self._s3.get_object(Bucket=self.bucket, Key=self._object(key), **kwargs)["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def delete(self, key: str) -> None:
+        self._s3.delete_object(Bucket=self.bucket, Key=self._object(key))
+
+    def iter_blobs(self) -> Iterator[Tuple[str, int, float]]:
+        for page in self._s3.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                key = obj["Key"][len(self.prefix):]
+                if is_valid_key(key):
+                    yield key, obj["Size"], obj["LastModified"].timestamp()
+
+    def _temp_file(self) -> BinaryIO:
+        return tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+
+    def _commit_temp(self, tmp: BinaryIO, key: str) -> None:
+        try:
+            if self.exists(key):
+                # same as the local utime: an in-place copy bumps LastModified, restarting the GC grace period
+                self._s3.copy_object(
+                    Bucket=self.bucket, Key=self._object(key), CopySource={"Bucket": self.bucket, "Key": self._object(key)},
+                    MetadataDirective="REPLACE", ContentType=content_type_for(key),
+                )
+                return
+            tmp.seek(0)
+            self._s3.upload_fileobj(tmp, self.bucket, self._object(key), ExtraArgs={"ContentType": content_type_for(key)})
+        finally:
+            tmp.close()
+
+
+_store: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.blob_backend == "s3":
+                    _store = S3BlobStore(settings.s3_bucket, settings.s3_prefix, settings.s3_endpoint_url)
+                else:
+                    _store = LocalBlobStore(settings.blob_dir)
+    return _store
+
+
+def decode_data_url(data_url: str) -> Tuple[bytes, str]:
+    """Split a ``data:<type>;base64,...`` URL into its bytes and content type."""
+    header, _, payload = data_url.partition(",")
+    content_type = header[len("data:"):].split(";")[0] or "application/octet-stream"
+    return base64.b64decode(payload), content_type
+
+
+def put_data_url(data_url: str) -> str:
+    """Store a ``data:<type>;base64,...`` URL as raw bytes and return its key."""
+    data, content_type = decode_data_url(data_url)
+    return get_blob_store().put(data, content_type)
@@ -0,0 +1,114 @@
+"""Process-local cache of the universal stories catalog.
+
+The whole table is small and seeded, so it is loaded as one snapshot: the
+list payload and every story payload are serialized once, gzipped once and
+given a strong ETag. A hit is a dict lookup. Staleness is bounded by a
+version counter in ``cache_versions`` that a trigger bumps on any write to
+``universal_stories`` (migrations, admin edits); the snapshot re-reads it at
+most every ``CATALOG_VERSION_CHECK_SECONDS`` and reloads when it changed.
+"""
+from dataclasses import dataclass
+from typing import Dict, Optional
+from config import settings
+from db import db_cursor
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger("uvicorn.error")
+
+CATALOG = "universal_stories"
+
+
+@dataclass(frozen=True)
+class CachedPayload:
+    body: bytes
+    gzipped: bytes
+    etag: str
+
+    @classmethod
+    def build(cls, payload) -> "CachedPayload":
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return cls(body, gzip.compress(body, compresslevel=9, mtime=0), f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    version: Optional[int]
+    listing: CachedPayload
+    stories: Dict[str, CachedPayload]
+    contents: Dict[str, tuple]
+
+
+_lock = threading.Lock()
+_snapshot: Optional[Snapshot] = None
+_checked_at = 0.0
+
+
+def _current_version(cur) -> Optional[int]:
+    cur.execute("SELECT version FROM cache_versions WHERE name = %s", (CATALOG,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _load(cur, version: Optional[int]) -> Snapshot:
+    cur.execute(
+        """
+        SELECT id, title, description, COALESCE(icon, ''), COALESCE(category, ''), content
+        FROM universal_stories
+        ORDER BY title ASC
+        """
+    )
+    rows = cur.fetchall()
+    listing = {"stories": [{"id": r[0], "title": r[1], "description": r[2], "icon": r[3], "category": r[4]} for r in rows]}
+    stories = {r[0]: CachedPayload.build({"id": r[0], "title": r[1], "content": r[5], "storyType": "universal"}) for r in rows}
+    return Snapshot(version, CachedPayload.build(listing), stories, {r[0]: (r[1], r[5]) for r in rows})
+
+
+def snapshot() -> Snapshot:
+    """Return the current snapshot, reloading it if the catalog version moved."""
+    global _snapshot, _checked_at
+    snap = _snapshot
+    if snap is not None and time.monotonic() - _checked_at < settings.catalog_version_check_seconds:
+        return snap
+    with _lock:
+        if _snapshot is not None and time.monotonic() - _checked_at < settings.catalog_version_check_seconds:
+            return _snapshot
+        try:
+            with db_cursor() as (conn, cur):
+                version = _current_version(cur)
+                if _snapshot is None or version is None or version != _snapshot.version:
+                    _snapshot = _load(cur, version)
+        except Exception:
+            if _snapshot is None:
+                raise
+            logger.warning("Catalog version check failed; serving cached snapshot", exc_info=True)
+        _checked_at = time.monotonic()
+        return _snapshot
+
+
+def invalidate() -> None:
+    """Drop the local snapshot so the next request reloads it."""
+    global _snapshot
+    with _lock:
+        _snapshot = None
+
+
+def bump_version(cur) -> None:
+    """Mark the catalog changed for every process; call inside the writing transaction."""
+    cur.execute(
+        """
+        INSERT INTO cache_versions (name, version, updated_at) VALUES (%s, 1, now())
+        ON CONFLICT (name) DO UPDATE SET version = cache_versions.version + 1, updated_at = now()
+        """,
+        (CATALOG,),
+    )
+
+
+def story_content(story_id: str) -> Optional[tuple]:
+    """``(title, content)`` for a universal story, or None if it does not exist."""
+    return snapshot().contents.get(story_id)
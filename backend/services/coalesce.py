@@ -0,0 +1,186 @@
+"""Request coalescing for expensive generations.
+
+Identical concurrent requests, keyed by ``(operation, *params)``, share one
+execution: within a process through :class:`SingleFlight`, and across
+uvicorn workers through a :class:`Lease` row in ``coalesce_leases``. Taking
+and releasing a lease are one short statement each, so no pooled connection
+is held while the leader calls OpenAI; callers that find the lease taken poll
+``lookup`` with backoff and pick up the result the other worker stored
+instead of recomputing.
+"""
+from typing import Awaitable, Callable, Hashable, Optional, Tuple, TypeVar
+from config import settings
+from db import async_db_cursor, db_cursor
+from services.singleflight import SingleFlight
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+
+
+T = TypeVar("T")
+
+flight = SingleFlight(max_age=settings.coalesce_wait_timeout)
+
+# Waiters re-check for the leader's result this often, doubling up to the maximum
+_POLL_MIN = 0.05
+_POLL_MAX = 1.0
+
+# An expired lease (its holder crashed or overran the TTL) is taken over by the next caller
+TAKE_LEASE = """
+    INSERT INTO coalesce_leases (lease_key, holder, expires_at)
+    VALUES (%s, %s, now() + make_interval(secs => %s))
+    ON CONFLICT (lease_key) DO UPDATE SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+    WHERE coalesce_leases.expires_at < now()
+    RETURNING holder
+"""
+DROP_LEASE = "DELETE FROM coalesce_leases WHERE lease_key = %s AND holder = %s"
+
+
+def coalesce_key(operation: str, *parts: Hashable) -> str:
+    return json.dumps([operation, *parts], separators=(",", ":"), default=str)
+
+
+def _lease_key(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class Lease:
+    """Cross-process mutual exclusion that expires after ``ttl`` seconds if never released."""
+
+    def __init__(self, key: str, ttl: Optional[float] = None) -> None:
+        self.key = key
+        self.lease_key = _lease_key(key)
+        self.ttl = settings.coalesce_lease_ttl if ttl is None else ttl
+        self.holder = uuid.uuid4().hex
+        self.held = False
+
+    def try_acquire(self) -> bool:
+        with db_cursor() as (conn, cur):
+            cur.execute(TAKE_LEASE, (self.lease_key, self.holder, float(self.ttl)))
+            self.held = cur.fetchone() is not None
+        return self.held
+
+    def acquire(self, lookup: Optional[Callable[[], Optional[T]]] = None, timeout: Optional[float] = None) -> Tuple[bool, Optional[T]]:
+        """Poll for the lease; returns ``(True, None)`` once held, ``(False, found)`` when
+        ``lookup`` finds the holder's result, or ``(False, None)`` after ``timeout``."""
+        deadline = time.monotonic() + (settings.coalesce_wait_timeout if timeout is None else timeout)
+        delay = _POLL_MIN
+        while True:
+            if self.try_acquire():
+                return True, None
+            found = lookup() if lookup is not None else None
+            remaining = deadline - time.monotonic()
+            if found is not None or remaining <= 0:
+                return False, found
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, _POLL_MAX)
+
+    def release(self) -> None:
+        if not self.held:
+            return
+        self.held = False
+        with db_cursor() as (conn, cur):
+            cur.execute(DROP_LEASE, (self.lease_key, self.holder))
+
+    async def try_acquire_async(self) -> bool:
+        async with async_db_cursor() as (conn, cur):
+            await cur.execute(TAKE_LEASE, (self.lease_key, self.holder, float(self.ttl)))
+            self.held = await cur.fetchone() is not None
+        return self.held
+
+    async def acquire_async(
+        self, lookup: Optional[Callable[[], Awaitable[Optional[T]]]] = None, timeout: Optional[float] = None
+    ) -> Tuple[bool, Optional[T]]:
+        deadline = time.monotonic() + (settings.coalesce_wait_timeout if timeout is None else timeout)
+        delay = _POLL_MIN
+        while True:
+            if await self.try_acquire_async():
+                return True, None
+            found = await lookup() if lookup is not None else None
+            remaining = deadline - time.monotonic()
+            if found is not None or remaining <= 0:
+                return False, found
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, _POLL_MAX)
+
+    async def release_async(self) -> None:
+        if not self.held:
+            return
+        self.held = False
+        async with async_db_cursor() as (conn, cur):
+            await cur.execute(DROP_LEASE, (self.lease_key, self.holder))
+
+
+def run(operation: str, parts: tuple, compute: Callable[[], T], lookup: Optional[Callable[[], Optional[T]]] = None) -> T:
+    """Run ``compute`` once for concurrent identical requests, in this process and across workers.
+
+    If the database is unavailable the lock is skipped and only in-process
+    coalescing applies.
+    """
+    key = coalesce_key(operation, *parts)
+
+    def leader() -> T:
+        lease = Lease(key)
+        try:
+            locked, found = lease.acquire(lookup)
+        except Exception:
+            locked, found = False, None
+        if found is not None:
+            return found
+        try:
+            # the previous holder may have stored its result just before we took over
+            if locked and lookup is not None:
+                found = lookup()
+                if found is not None:
+                    return found
+            return compute()
+        finally:
+            try:
+                lease.release()
+            except Exception:
+                pass
+
+    return flight.do(key, leader, timeout=settings.coalesce_wait_timeout)
+
+
+async def run_async(
+    operation: str,
+    parts: tuple,
+    compute: Callable[[], Awaitable[T]],
+    lookup: Optional[Callable[[], Awaitable[Optional[T]]]] = None,
+) -> T:
+    """Async counterpart of :func:`run`, taking the lease over asyncpg."""
+    key = coalesce_key(operation, *parts)
+    call, leader = flight.acquire(key)
+    if not leader:
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(call)), timeout=settings.coalesce_wait_timeout)
+    try:
+        result = await _run_locked_async(key, compute, lookup)
+    except BaseException as exc:
+        flight.fail(key, call, exc)
+        raise
+    flight.resolve(key, call, result)
+    return result
+
+
+async def _run_locked_async(key, compute, lookup):
+    lease = Lease(key)
+    try:
+        locked, found = await lease.acquire_async(lookup)
+    except Exception:
+        locked, found = False, None
+    if found is not None:
+        return found
+    try:
+        if locked and lookup is not None:
+            found = await lookup()
+            if found is not None:
+                return found
+        return await compute()
+    finally:
+        try:
+            await lease.release_async()
+        except Exception:
+            pass
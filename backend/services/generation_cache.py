@@ -0,0 +1,171 @@
+"""Opt-in cache for chat completions (``GENERATION_CACHE=true``).
+
+Requests are keyed by operation, model, temperature and normalized inputs.
+Each key holds a *variety pool* of up to N distinct completions: until the
+pool is full every request generates (and adds) a fresh one, after that
+requests rotate through the pool. Pools live in a bounded in-process LRU
+backed by the ``generation_cache`` table, and entries expire after
+``GENERATION_CACHE_TTL`` so pools refresh over time.
+
+Only genuine model output is cached; callers must not ``add`` fallbacks.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+from psycopg2.extras import Json
+from config import settings
+from db import db_cursor
+import hashlib
+import itertools
+import json
+import logging
+import threading
+import time
+import unicodedata
+
+
+logger = logging.getLogger("uvicorn.error")
+
+# Expired rows are purged from Postgres at most this often per process
+_PURGE_INTERVAL = 600.0
+
+
+class _Pool:
+    __slots__ = ("values", "expires_at", "turn")
+
+    def __init__(self, values: List[Any], expires_at: float) -> None:
+        self.values = values
+        self.expires_at = expires_at
+        self.turn = itertools.count()
+
+
+_lock = threading.Lock()
+_pools: "OrderedDict[str, _Pool]" = OrderedDict()
+_counters = {"hits": 0, "misses": 0, "stores": 0}
+_last_purge = 0.0
+
+
+def enabled() -> bool:
+    return settings.generation_cache_enabled
+
+
+def normalize(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(operation: str, *parts: Any) -> str:
+    payload = json.dumps([operation, *parts], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _remember(key: str, values: List[Any], expires_at: float) -> _Pool:
+    pool = _Pool(values, expires_at)
+    _pools[key] = pool
+    _pools.move_to_end(key)
+    while len(_pools) > settings.generation_cache_local_entries:
+        _pools.popitem(last=False)
+    return pool
+
+
+def _load(key: str, variety: int) -> tuple[List[Any], float]:
+    with db_cursor() as (conn, cur):
+        cur.execute(
+            """
+            UPDATE generation_cache SET last_used_at = now()
+            WHERE cache_key = %s AND created_at > now() - make_interval(secs => %s)
+            RETURNING value, EXTRACT(EPOCH FROM created_at - now())
+            """,
+            (key, settings.generation_cache_ttl),
+        )
+        rows = sorted(cur.fetchall(), key=lambda r: r[1])[:variety]
+    # the pool expires with its oldest completion
+    age = -float(rows[0][1]) if rows else 0.0
+    return [r[0] for r in rows], time.time() + settings.generation_cache_ttl - age
+
+
+def pick(key: str, variety: int) -> Optional[Any]:
+    """Return the next cached completion for ``key`` once its pool is full, else None."""
+    now = time.time()
+    with _lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.expires_at > now and len(pool.values) >= variety:
+            _pools.move_to_end(key)
+            _counters["hits"] += 1
+            return pool.values[next(pool.turn) % len(pool.values)]
+    try:
+        values, expires_at = _load(key, variety)
+    except Exception:
+        logger.debug("Generation cache lookup failed", exc_info=True)
+        values, expires_at = [], now + settings.generation_cache_ttl
+    with _lock:
+        local = _pools.get(key)
+        if local is not None and local.expires_at > now:
+            # keep completions added here that the database did not return (e.g. it is unreachable)
+            values = local.values + [v for v in values if v not in local.values]
+            expires_at = min(expires_at, local.expires_at)
+        pool = _remember(key, values[:variety], expires_at)
+        if len(pool.values) >= variety:
+            _counters["hits"] += 1
+            return pool.values[next(pool.turn) % len(pool.values)]
+        _counters["misses"] += 1
+    return None
+
+
+def add(key: str, value: Any, variety: int) -> None:
+    """Add a fresh completion to the pool for ``key`` (ignored once the pool is full)."""
+    with _lock:
+        pool = _pools.get(key) or _remember(key, [], time.time() + settings.generation_cache_ttl)
+        if len(pool.values) >= variety or value in pool.values:
+            return
+        pool.values.append(value)
+        _counters["stores"] += 1
+    value_hash = hashlib.sha256(json.dumps(value, ensure_ascii=False).encode("utf-8")).hexdigest()
+    try:
+        with db_cursor() as (conn, cur):
+            cur.execute(
+                """
+                INSERT INTO generation_cache (cache_key, value_hash, value, created_at, last_used_at)
+                VALUES (%s, %s, %s, now(), now())
+                ON CONFLICT (cache_key, value_hash) DO NOTHING
+                """,
+                (key, value_hash, Json(value)),
+            )
+        _maybe_purge()
+    except Exception:
+        logger.debug("Generation cache store failed", exc_info=True)
+
+
+def get_or_generate(key: str, generate: Callable[[], Any], variety: int) -> Any:
+    cached = pick(key, variety)
+    if cached is not None:
+        return cached
+    value = generate()
+    add(key, value, variety)
+    return value
+
+
+def _maybe_purge() -> None:
+    global _last_purge
+    now = time.monotonic()
+    with _lock:
+        if now - _last_purge < _PURGE_INTERVAL:
+            return
+        _last_purge = now
+    with db_cursor() as (conn, cur):
+        cur.execute(
+            "DELETE FROM generation_cache WHERE created_at < now() - make_interval(secs => %s)",
+            (settings.generation_cache_ttl,),
+        )
+        cur.execute(
+            """
+            DELETE FROM generation_cache WHERE (cache_key, value_hash) IN (
+                SELECT cache_key, value_hash FROM generation_cache
+                ORDER BY last_used_at DESC OFFSET %s
+            )
+            """,
+            (settings.generation_cache_max_rows,),
+        )
+
+
+def stats() -> dict:
+    with _lock:
+        return {"enabled": enabled(), "entries": len(_pools), **_counters}
@@ -0,0 +1,121 @@
+"""Downscaled WebP/JPEG variants of generated images.
+
+Generated images are 1024px PNGs of several hundred kB, while the library
+and gallery only show them a few hundred pixels wide. Each image is
+therefore rendered once, when it is stored, into every size in
+:data:`VARIANTS` and both formats in :data:`FORMATS`; the blob keys are kept
+next to the original as a ``{"thumb.webp": key, ...}`` map. Resizing and
+encoding hold the GIL, so they run in a small dedicated process pool like
+password hashing. When the pool is saturated, Pillow is missing or rendering
+fails, the image is stored without variants and readers get the original.
+"""
+from concurrent.futures import Future
+from typing import Dict, List, Literal, Optional
+from config import settings
+from services.blob_store import get_blob_store
+from services.process_pool import BoundedProcessPool
+import importlib.util
+import io
+import json
+import logging
+
+
+logger = logging.getLogger("uvicorn.error")
+
+# name -> longest edge in pixels
+VARIANTS: Dict[str, int] = {"thumb": 256, "medium": 640}
+# query value -> (Pillow format, extension, content type)
+FORMATS: Dict[str, tuple] = {
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+ORIGINAL = "original"
+# values accepted by the ``variant=`` / ``format=`` query parameters
+Variant = Literal["original", "thumb", "medium"]
+ImageFormat = Literal["webp", "jpeg"]
+
+
+def _render(data: bytes, quality: int) -> Dict[str, bytes]:
+    """Runs in a pool process: every variant of ``data``, keyed ``<variant>.<ext>``."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEG has no alpha; generated images are opaque anyway
+        source = img.convert("RGB")
+    rendered = {}
+    for name, edge in VARIANTS.items():
+        scaled = source.copy()
+        scaled.thumbnail((edge, edge), Image.LANCZOS)
+        for fmt, ext, _ in FORMATS.values():
+            buf = io.BytesIO()
+            if fmt == "JPEG":
+                scaled.save(buf, fmt, quality=quality, optimize=True, progressive=True)
+            else:
+                scaled.save(buf, fmt, quality=quality, method=4)
+            rendered[f"{name}.{ext}"] = buf.getvalue()
+    return rendered
+
+
+_available = importlib.util.find_spec("PIL") is not None
+_pool = BoundedProcessPool(settings.image_variant_workers, settings.image_variant_queue_limit)
+
+
+def _submit(data: bytes) -> Optional[Future]:
+    """Queue a render, or return None when variants are off or the pool is full."""
+    if not (settings.image_variants and _available):
+        return None
+    future = _pool.try_submit(_render, data, settings.image_variant_quality)
+    if future is None:
+        logger.info("Image variant pool busy; storing image without variants")
+    return future
+
+
+def _collect(future: Optional[Future]) -> Dict[str, str]:
+    if future is None:
+        return {}
+    try:
+        rendered = future.result(timeout=settings.image_variant_timeout)
+    except Exception:
+        logger.warning("Rendering image variants failed", exc_info=True)
+        return {}
+    store = get_blob_store()
+    return {name: store.put(blob, content_type_for_name(name)) for name, blob in rendered.items()}
+
+
+def store_variants(data: bytes) -> Dict[str, str]:
+    """Render and store every variant of one image; returns the ``{"thumb.webp": key}`` map (maybe empty)."""
+    return _collect(_submit(data))
+
+
+def store_variants_many(images: List[bytes]) -> List[Dict[str, str]]:
+    """Like :func:`store_variants` for a whole set, rendering the images in parallel."""
+    futures = [_submit(data) for data in images]
+    return [_collect(f) for f in futures]
+
+
+def content_type_for_name(name: str) -> str:
+    ext = name.rsplit(".", 1)[-1]
+    return next(ct for _, e, ct in FORMATS.values() if e == ext)
+
+
+def loads(value) -> Dict[str, str]:
+    """The stored map; psycopg2 decodes JSONB itself, asyncpg hands back text."""
+    if not value:
+        return {}
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def select(original: str, variants, variant: str, fmt: str) -> str:
+    """Blob key for ``variant`` in ``fmt``, falling back to the original when it was never rendered."""
+    if variant == ORIGINAL:
+        return original
+    return loads(variants).get(f"{variant}.{FORMATS[fmt][1]}", original)
+
+
+def preferred_format(accept: str) -> str:
+    """WebP for clients that advertise it, JPEG otherwise."""
+    return "webp" if "image/webp" in accept else "jpeg"
+
+
+def shutdown() -> None:
+    _pool.shutdown()
@@ -0,0 +1,198 @@
+"""Durable background jobs backed by the ``jobs`` table.
+
+Workers claim work with ``FOR UPDATE SKIP LOCKED`` so any number of them can
+poll the same table without blocking each other. Higher ``priority`` runs
+first; failed jobs are retried with exponential backoff until
+``max_attempts`` is reached. A job left ``running`` longer than
+``JOB_VISIBILITY_TIMEOUT`` (crashed worker) is claimed again while it has
+attempts left, and failed otherwise. Results are only recorded by the worker
+that still holds the job (``locked_by``), so a slow worker whose job was
+reclaimed cannot overwrite the new run.
+"""
+from typing import Callable, Dict, Optional
+from psycopg2.extras import Json
+from config import settings
+from db import db_cursor
+from services import rate_limit, story_batch, story_media, tts_segments
+from services.blob_store import get_blob_store
+import logging
+
+
+logger = logging.getLogger("uvicorn.error")
+
+JOB_STORY_IMAGES = "story_images"
+JOB_STORY_TTS = "story_tts"
+JOB_UNIVERSAL_TTS = "universal_tts"
+JOB_STORY_BATCH = "story_batch"
+
+_COLUMNS = "id, kind, payload, status, priority, attempts, max_attempts, result, error, created_at, started_at, finished_at, user_id"
+
+
+class JobFailed(Exception):
+    """Permanent failure: the job is not retried."""
+
+
+def _row_to_job(row) -> dict:
+    return dict(zip([c.strip() for c in _COLUMNS.split(",")], row))
+
+
+def enqueue(kind: str, payload: dict, priority: int = 0, max_attempts: Optional[int] = None, user_id: Optional[int] = None) -> int:
+    with db_cursor() as (conn, cur):
+        cur.execute(
+            """
+            INSERT INTO jobs (kind, payload, priority, max_attempts, user_id)
+            VALUES (%s, %s, %s, %s, %s) RETURNING id
+            """,
+            (kind, Json(payload), priority, max_attempts or settings.job_max_attempts, user_id),
+        )
+        job_id = cur.fetchone()[0]
+        cur.execute("SELECT pg_notify('jobs', %s)", (kind,))
+    return job_id
+
+
+def get(job_id: int, user_id: Optional[int] = None) -> Optional[dict]:
+    """The job, or None when it does not exist or (with ``user_id``) was queued by someone else."""
+    owner = " AND user_id = %s" if user_id is not None else ""
+    with db_cursor() as (conn, cur):
+        cur.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = %s{owner}", (job_id,) + ((user_id,) if owner else ()))
+        row = cur.fetchone()
+    return _row_to_job(row) if row else None
+
+
+def claim(worker_id: str) -> Optional[dict]:
+    with db_cursor() as (conn, cur):
+        # abandoned on its last attempt: nothing left to retry
+        cur.execute(
+            """
+            UPDATE jobs SET status = 'failed', error = 'Worker lost on the last attempt', finished_at = now(), locked_by = NULL
+            WHERE status = 'running' AND attempts >= max_attempts AND started_at < now() - make_interval(secs => %s)
+            """,
+            (settings.job_visibility_timeout,),
+        )
+        cur.execute(
+            f"""
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = now(), locked_by = %s
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE (status = 'queued' AND run_after <= now())
+                   OR (status = 'running' AND attempts < max_attempts AND started_at < now() - make_interval(secs => %s))
+                ORDER BY priority DESC, run_after, id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING {_COLUMNS}
+            """,
+            (worker_id, settings.job_visibility_timeout),
+        )
+        row = cur.fetchone()
+    return _row_to_job(row) if row else None
+
+
+def complete(job_id: int, result: dict, worker_id: str) -> bool:
+    """Record success; False when the job was reclaimed by another worker meanwhile (lost the lease)."""
+    with db_cursor() as (conn, cur):
+        cur.execute(
+            """
+            UPDATE jobs SET status = 'succeeded', result = %s, error = NULL, finished_at = now(), locked_by = NULL
+            WHERE id = %s AND status = 'running' AND locked_by = %s
+            """,
+            (Json(result), job_id, worker_id),
+        )
+        return cur.rowcount > 0
+
+
+def fail(job: dict, error: str, worker_id: str, retry: bool = True) -> bool:
+    """Requeue with backoff or fail for good; False when the job was reclaimed by another worker meanwhile."""
+    with db_cursor() as (conn, cur):
+        if retry and job["attempts"] < job["max_attempts"]:
+            backoff = settings.job_retry_base_seconds * (2 ** (job["attempts"] - 1))
+            cur.execute(
+                """
+                UPDATE jobs SET status = 'queued', error = %s, locked_by = NULL,
+                       run_after = now() + make_interval(secs => %s)
+                WHERE id = %s AND status = 'running' AND locked_by = %s
+                """,
+                (error, backoff, job["id"], worker_id),
+            )
+        else:
+            cur.execute(
+                """
+                UPDATE jobs SET status = 'failed', error = %s, finished_at = now(), locked_by = NULL
+                WHERE id = %s AND status = 'running' AND locked_by = %s
+                """,
+                (error, job["id"], worker_id),
+            )
+        return cur.rowcount > 0
+
+
+def _story_content(table: str, story_id) -> str:
+    with db_cursor() as (conn, cur):
+        cur.execute(f"SELECT content FROM {table} WHERE id = %s", (story_id,))
+        row = cur.fetchone()
+    if not row or not (row[0] or "").strip():
+        raise JobFailed("Story not found or empty")
+    return row[0]
+
+
+def _run_story_images(payload: dict) -> dict:
+    story_id = payload["story_id"]
+    content = _story_content("stories", story_id)
+    images, prompts = story_media.generate_story_images(content, payload.get("num_images", 3), payload.get("size", "1024x1024"))
+    if not images:
+        raise RuntimeError("Image generation failed")
+    keys = story_media.store_story_images(story_id, images, prompts)
+    return {"blobKeys": keys, "prompts": prompts[: len(keys)]}
+
+
+def _run_story_tts(payload: dict) -> dict:
+    story_id, voice = payload["story_id"], payload["voice"]
+    key = tts_segments.get_or_synthesize(_story_content("stories", story_id), voice)
+    story_media.save_story_audio(story_id, voice, key, get_blob_store().size(key))
+    return {"blobKey": key}
+
+
+def _run_universal_tts(payload: dict) -> dict:
+    key = tts_segments.get_or_synthesize(_story_content("universal_stories", payload["story_id"]), payload["voice"])
+    return {"blobKey": key}
+
+
+def _run_story_batch(payload: dict) -> dict:
+    user_id = payload["user_id"]
+    with db_cursor() as (conn, cur):
+        cur.execute("SELECT story_age, story_complexity FROM users WHERE id = %s", (user_id,))
+        row = cur.fetchone()
+    if not row:
+        raise JobFailed("User not found")
+    items = [tuple(item) for item in payload["items"]]
+    return {"stories": story_batch.run_batch(user_id, items, row[0] or 5, row[1] or "medium")}
+
+
+HANDLERS: Dict[str, Callable[[dict], dict]] = {
+    JOB_STORY_IMAGES: _run_story_images,
+    JOB_STORY_TTS: _run_story_tts,
+    JOB_UNIVERSAL_TTS: _run_universal_tts,
+    JOB_STORY_BATCH: _run_story_batch,
+}
+
+
+def run_one(worker_id: str) -> bool:
+    """Claim and execute a single job; returns False when the queue had nothing runnable."""
+    job = claim(worker_id)
+    if job is None:
+        return False
+    handler = HANDLERS.get(job["kind"])
+    try:
+        if handler is None:
+            raise JobFailed(f"Unknown job kind {job['kind']!r}")
+        with rate_limit.priority(rate_limit.BACKGROUND):
+            result = handler(job["payload"])
+    except JobFailed as exc:
+        recorded = fail(job, str(exc), worker_id, retry=False)
+    except Exception as exc:
+        logger.warning("Job %s (%s) attempt %s failed: %s", job["id"], job["kind"], job["attempts"], exc)
+        recorded = fail(job, str(exc) or exc.__class__.__name__, worker_id)
+    else:
+        recorded = complete(job["id"], result, worker_id)
+    if not recorded:
+        logger.warning("Job %s (%s) was reclaimed by another worker; dropping this attempt's outcome", job["id"], job["kind"])
+    return True
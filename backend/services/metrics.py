@@ -0,0 +1,138 @@
+"""Prometheus metrics.
+
+Request latency is recorded by :class:`MetricsMiddleware`, database timings
+by ``db_cursor``/``async_db_cursor``, upstream timings and outcomes by
+``services.resilience`` and token usage by ``services.openai_service``.
+Pool and cache counters that modules already keep are exported at scrape
+time by a collector instead of being duplicated.
+
+With several worker processes set ``PROMETHEUS_MULTIPROC_DIR`` so the
+exposition aggregates all of them.
+"""
+from typing import Callable, Dict, Iterable
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+import os
+import time
+
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time until the response body was fully sent", ["method", "route"], buckets=_LATENCY_BUCKETS
+)
+HTTP_FIRST_BYTE = Histogram(
+    "http_response_start_seconds", "Time until response headers were sent", ["method", "route"], buckets=_LATENCY_BUCKETS
+)
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being handled", ["method"], multiprocess_mode="livesum")
+THREADPOOL_BUSY = Gauge("threadpool_busy_threads", "Worker threads in use for sync handlers", multiprocess_mode="livesum")
+THREADPOOL_SIZE = Gauge("threadpool_max_threads", "Thread limit for sync handlers", multiprocess_mode="livemax")
+
+DB_ACQUIRE = Histogram("db_pool_acquire_seconds", "Time to get a pooled connection", ["pool"], buckets=_LATENCY_BUCKETS)
+DB_TRANSACTION = Histogram(
+    "db_transaction_seconds", "Time a db_cursor block held its connection", ["pool"], buckets=_LATENCY_BUCKETS
+)
+DB_ERRORS = Counter("db_transaction_errors_total", "db_cursor blocks that rolled back", ["pool"])
+
+UPSTREAM_LATENCY = Histogram(
+    "openai_request_duration_seconds", "Upstream call attempts", ["operation", "function"], buckets=_LATENCY_BUCKETS
+)
+UPSTREAM_REQUESTS = Counter("openai_requests_total", "Upstream call attempts by outcome", ["operation", "function", "outcome"])
+UPSTREAM_TOKENS = Counter("openai_tokens_total", "Tokens reported by the API", ["function", "type"])
+TTS_CHARACTERS = Counter("openai_tts_characters_total", "Characters sent for speech synthesis")
+RATE_LIMIT_WAIT = Histogram(
+    "openai_rate_limit_wait_seconds", "Time spent waiting for rate limit capacity", ["operation"], buckets=_LATENCY_BUCKETS
+)
+
+
+def record_usage(function: str, usage) -> None:
+    if usage is None:
+        return
+    UPSTREAM_TOKENS.labels(function, "prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    UPSTREAM_TOKENS.labels(function, "completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+class _StatsCollector:
+    """Export counters kept by other modules (pool, cache and breaker stats) at scrape time."""
+
+    def __init__(self) -> None:
+        self.sources: Dict[str, Callable[[], dict]] = {}
+
+    def collect(self) -> Iterable:
+        pool = GaugeMetricFamily("db_pool_connections", "Pooled DB connections", labels=["state"])
+        events = CounterMetricFamily("app_cache_events", "Cache hits, misses and stores", labels=["cache", "event"])
+        circuit = GaugeMetricFamily("openai_circuit_open", "1 while the breaker for an operation is not closed", labels=["operation"])
+        for name, source in self.sources.items():
+            try:
+                stats = source()
+            except Exception:
+                continue
+            if name == "db_pool":
+                for state in ("idle", "in_use", "max"):
+                    pool.add_metric([state], stats.get(state, 0))
+            elif name == "upstream":
+                for operation, breaker in stats.items():
+                    circuit.add_metric([operation], 0 if breaker["state"] == "closed" else 1)
+            else:
+                for event in ("hits", "misses", "stores", "evictions", "coalesced"):
+                    if event in stats:
+                        events.add_metric([name, event], stats[event])
+        yield pool
+        yield events
+        yield circuit
+
+
+_stats = _StatsCollector()
+REGISTRY.register(_stats)
+
+
+def register_stats(sources: Dict[str, Callable[[], dict]]) -> None:
+    """Export per-process stats dicts; ``db_pool`` and ``upstream`` get dedicated metrics, the rest are cache counters."""
+    _stats.sources.update(sources)
+
+
+def exposition() -> tuple[bytes, str]:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # the stats collector only sees the scraped process
+        registry.register(_stats)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency; routes are labelled by their path template."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        def route_label() -> str:
+            route = scope.get("route")
+            return getattr(route, "path", None) or "unmatched"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                HTTP_FIRST_BYTE.labels(method, route_label()).observe(time.perf_counter() - start)
+            await send(message)
+
+        HTTP_IN_PROGRESS.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.labels(method).dec()
+            route = route_label()
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, route, str(status["code"])).inc()
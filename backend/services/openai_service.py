@@ -1,14 +1,28 @@
-from typing import List
-from openai import OpenAI
+from typing import AsyncIterator, Iterator, List, Tuple
+from openai import OpenAI, AsyncOpenAI
 from config import settings
-from tempfile import NamedTemporaryFile
-import os
+from services import generation_cache, metrics, rate_limit, resilience
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+import asyncio
+import contextvars
 
 
-client = OpenAI(api_key=settings.openai_api_key, timeout=settings.openai_timeout)
+# Retries are handled by services.resilience, not by the SDK
+client = OpenAI(api_key=settings.openai_api_key, base_url=settings.openai_base_url, timeout=settings.openai_timeout, max_retries=0)
+async_client = AsyncOpenAI(api_key=settings.openai_api_key, base_url=settings.openai_base_url, timeout=settings.openai_timeout, max_retries=0)
 
+IMAGE_STYLE = "barnvänlig tecknad stil, mjuka former, klara färger"
 
-def generate_story(prompt: str, age: int, complexity: str) -> str:
+CHAT_MODEL = "gpt-4o-mini"
+STORY_TEMPERATURE = 0.8
+IMAGE_PROMPT_TEMPERATURE = 0.7
+
+
+class StoryStreamInterrupted(Exception):
+    """The story stream failed after text was already sent; the partial story must not be kept."""
+
+
+def _story_messages(prompt: str, age: int, complexity: str) -> list:
     if complexity == "simple":
         system_prompt = (
             f"Du är en barnboksförfattare som skriver enkla, roliga sagor för {age}-åringar. "
@@ -26,112 +40,452 @@ def generate_story(prompt: str, age: int, complexity: str) -> str:
         )
 
     user_prompt = f"Skriv en saga på svenska om: {prompt}. Gör den lämplig för ett {age}-årigt barn med komplexitet: {complexity}."
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def _fallback_story(prompt: str, age: int, complexity: str) -> str:
+    if complexity == "simple":
+        return f"Det var en gång ett {age}-årigt barn som upptäckte {prompt}. Ett kort och glatt äventyr följde."
+    elif complexity == "advanced":
+        return f"I ett fjärran land upptäckte ett {age}-årigt barn {prompt} och gav sig ut på ett rikt, långt äventyr."
+    else:
+        return f"Det var en gång ett {age}-årigt barn som upptäckte {prompt} och gav sig ut på ett lagom långt äventyr."
+
+
+def _image_prompt_messages(story_text: str, num_images: int) -> list:
+    system = "Du är en kreativ bildprompt-skrivare."
+    user = (
+        f"Sagan:\n{story_text}\n\nGe exakt {num_images} rader. Varje rad ska vara en kort svensk bildprompt som beskriver en tydlig scen. "
+        "Lägg alltid till stilen: 'barnvänlig tecknad stil, mjuka former, klara färger, mild belysning'."
+    )
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+
+def _parse_image_prompts(text: str, num_images: int) -> List[str]:
+    prompts: List[str] = []
+    for line in text.splitlines():
+        clean = line.strip().lstrip("-•0123456789. ").strip()
+        if clean:
+            prompts.append(clean)
+    if len(prompts) < num_images:
+        prompts += [
+            f"En glad scen i mitten, {IMAGE_STYLE}",
+        ] * (num_images - len(prompts))
+    return prompts[:num_images]
+
+
+def _fallback_image_prompts(num_images: int) -> List[str]:
+    return [
+        f"Huvudkaraktären presenteras, {IMAGE_STYLE}",
+        f"Hjälten övervinner ett hinder, {IMAGE_STYLE}",
+        f"Lyckligt slut, {IMAGE_STYLE}",
+    ][:num_images]
+
+
+def _image_data_url(img) -> str:
+    return f"data:image/png;base64,{img.data[0].b64_json}"
+
+
+def _story_cache_key(prompt: str, age: int, complexity: str) -> str:
+    return generation_cache.cache_key("story", CHAT_MODEL, STORY_TEMPERATURE, generation_cache.normalize(prompt), age, complexity)
+
+
+def _image_prompts_cache_key(story_text: str, num_images: int) -> str:
+    return generation_cache.cache_key(
+        "image_prompts", CHAT_MODEL, IMAGE_PROMPT_TEMPERATURE, generation_cache.normalize(story_text), num_images
+    )
+
+
+def _complete_story(prompt: str, age: int, complexity: str) -> str:
+    messages = _story_messages(prompt, age, complexity)
+    response = resilience.call(resilience.CHAT, lambda timeout: client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        max_tokens=1000,
+        temperature=STORY_TEMPERATURE,
+        timeout=timeout,
+    ), tokens=rate_limit.estimate_tokens(messages, 1000), function="story")
+    metrics.record_usage("story", response.usage)
+    return response.choices[0].message.content.strip()
+
+
+def generate_story(prompt: str, age: int, complexity: str, fallback: bool = True) -> str:
+    """Story text; on upstream failure the canned fallback story, or the error itself with ``fallback=False``."""
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            max_tokens=1000,
-            temperature=0.8,
-        )
-        return response.choices[0].message.content.strip()
+        if generation_cache.enabled():
+            return generation_cache.get_or_generate(
+                _story_cache_key(prompt, age, complexity),
+                lambda: _complete_story(prompt, age, complexity),
+                settings.generation_cache_variety,
+            )
+        return _complete_story(prompt, age, complexity)
+    except rate_limit.Throttled:
+        raise
     except Exception:
-        if complexity == "simple":
-            return f"Det var en gång ett {age}-årigt barn som upptäckte {prompt}. Ett kort och glatt äventyr följde."
-        elif complexity == "advanced":
-            return f"I ett fjärran land upptäckte ett {age}-årigt barn {prompt} och gav sig ut på ett rikt, långt äventyr."
-        else:
-            return f"Det var en gång ett {age}-årigt barn som upptäckte {prompt} och gav sig ut på ett lagom långt äventyr."
+        if not fallback:
+            raise
+        return _fallback_story(prompt, age, complexity)
+
+
+def generate_story_stream(prompt: str, age: int, complexity: str) -> Iterator[str]:
+    """Yield the story as text deltas while the model produces it.
+
+    Falls back to the canned story if the upstream call fails before the first
+    token; a failure mid-stream raises :class:`StoryStreamInterrupted`. A
+    cached story is yielded as a single delta.
+    """
+    key = None
+    if generation_cache.enabled():
+        key = _story_cache_key(prompt, age, complexity)
+        cached = generation_cache.pick(key, settings.generation_cache_variety)
+        if cached is not None:
+            yield cached
+            return
+    parts: List[str] = []
+    try:
+        messages = _story_messages(prompt, age, complexity)
+        stream = resilience.call(resilience.CHAT, lambda timeout: client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            max_tokens=1000,
+            temperature=STORY_TEMPERATURE,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout,
+        ), hedge=False, tokens=rate_limit.estimate_tokens(messages, 1000), function="story_stream")
+        for chunk in stream:
+            if not chunk.choices:
+                # the final chunk carries usage only
+                metrics.record_usage("story_stream", chunk.usage)
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+    except rate_limit.Throttled as exc:
+        if not parts:
+            raise
+        raise StoryStreamInterrupted() from exc
+    except Exception as exc:
+        if parts:
+            raise StoryStreamInterrupted() from exc
+        yield _fallback_story(prompt, age, complexity)
+        return
+    text = "".join(parts).strip()
+    if key and text:
+        generation_cache.add(key, text, settings.generation_cache_variety)
+
+
+def _complete_image_prompts(story_text: str, num_images: int) -> List[str]:
+    messages = _image_prompt_messages(story_text, num_images)
+    # part of image generation, so it queues behind interactive story text
+    with rate_limit.priority(rate_limit.current_priority.get() or rate_limit.BACKGROUND):
+        resp = resilience.call(resilience.CHAT, lambda timeout: client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=IMAGE_PROMPT_TEMPERATURE,
+            max_tokens=400,
+            timeout=timeout,
+        ), tokens=rate_limit.estimate_tokens(messages, 400), function="image_prompts")
+    metrics.record_usage("image_prompts", resp.usage)
+    return _parse_image_prompts(resp.choices[0].message.content.strip(), num_images)
 
 
 def image_prompts_from_story(story_text: str, num_images: int = 3) -> List[str]:
     num_images = max(1, min(6, num_images))
     try:
-        system = "Du är en kreativ bildprompt-skrivare."
-        user = (
-            f"Sagan:\n{story_text}\n\nGe exakt {num_images} rader. Varje rad ska vara en kort svensk bildprompt som beskriver en tydlig scen. "
-            "Lägg alltid till stilen: 'barnvänlig tecknad stil, mjuka former, klara färger, mild belysning'."
-        )
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
-            temperature=0.7,
-            max_tokens=400,
-        )
-        text = resp.choices[0].message.content.strip()
-        prompts: List[str] = []
-        for line in text.splitlines():
-            clean = line.strip().lstrip("-•0123456789. ").strip()
-            if clean:
-                prompts.append(clean)
-        if len(prompts) < num_images:
-            prompts += [
-                "En glad scen i mitten, barnvänlig tecknad stil, mjuka former, klara färger",
-            ] * (num_images - len(prompts))
-        return prompts[:num_images]
+        if generation_cache.enabled():
+            # one pool slot: the prompts follow the story text, variety comes from the images
+            return generation_cache.get_or_generate(
+                _image_prompts_cache_key(story_text, num_images),
+                lambda: _complete_image_prompts(story_text, num_images),
+                1,
+            )
+        return _complete_image_prompts(story_text, num_images)
+    except rate_limit.Throttled:
+        raise
     except Exception:
-        base = "barnvänlig tecknad stil, mjuka former, klara färger"
-        return [
-            f"Huvudkaraktären presenteras, {base}",
-            f"Hjälten övervinner ett hinder, {base}",
-            f"Lyckligt slut, {base}",
-        ][:num_images]
+        return _fallback_image_prompts(num_images)
 
 
-def images_from_prompts(prompts: List[str], size: str = "1024x1024") -> List[str]:
-    images_data_urls: List[str] = []
-    for prompt in prompts:
+def _generate_image(prompt: str, size: str) -> str | None:
+    for model in (settings.openai_image_model, settings.openai_image_fallback_model):
         try:
-            img = client.images.generate(
-                model=settings.openai_image_model,
+            img = resilience.call(resilience.IMAGE, lambda timeout: client.images.generate(
+                model=model,
                 prompt=prompt,
                 size=size,
                 response_format="b64_json",
-            )
-            b64 = img.data[0].b64_json
-            images_data_urls.append(f"data:image/png;base64,{b64}")
-            continue
+                timeout=timeout,
+            ), function="image")
+            return _image_data_url(img)
+        except (resilience.CircuitOpen, rate_limit.Throttled):
+            break
         except Exception:
+            continue
+    return None
+
+
+# Shared across requests: caps concurrent image generations for the whole process
+_image_executor = ThreadPoolExecutor(max_workers=settings.openai_image_concurrency, thread_name_prefix="openai-image")
+
+
+def images_as_completed(prompts: List[str], size: str = "1024x1024", deadline: float | None = None) -> Iterator[Tuple[int, str]]:
+    """Generate one image per prompt concurrently, yielding ``(prompt_index, data_url)`` as each finishes.
+
+    Failed images are skipped; images still running when ``deadline`` seconds
+    have passed are dropped.
+    """
+    if deadline is None:
+        deadline = settings.openai_image_deadline
+    # copy the caller's context so the rate limiter sees its user and priority
+    futures = {_image_executor.submit(contextvars.copy_context().run, _generate_image, prompt, size): i for i, prompt in enumerate(prompts)}
+    try:
+        for fut in as_completed(futures, timeout=deadline):
+            if fut.exception() is None and fut.result():
+                yield futures[fut], fut.result()
+    except FutureTimeoutError:
+        pass
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+
+def images_from_prompts(prompts: List[str], size: str = "1024x1024", deadline: float | None = None) -> List[str]:
+    """Generate one image per prompt concurrently, keeping prompt order.
+
+    Images still running when ``deadline`` seconds have passed are dropped and
+    whatever finished so far is returned.
+    """
+    finished = dict(images_as_completed(prompts, size, deadline))
+    return [finished[i] for i in sorted(finished)]
+
+
+def _open_tts_stream(text: str, voice: str, timeout: float):
+    manager = client.audio.speech.with_streaming_response.create(
+        model=settings.openai_tts_model,
+        voice=voice,
+        input=text,
+        timeout=timeout,
+    )
+    return manager, manager.__enter__()
+
+
+def synthesize_tts_stream(text: str, voice: str) -> Iterator[bytes]:
+    """Yield MP3 chunks as the speech endpoint produces them.
+
+    Only opening the stream is retried; a failure after the first byte ends it.
+    """
+    manager, response = resilience.call(
+        resilience.TTS, lambda timeout: _open_tts_stream(text, voice, timeout), hedge=False, function="tts"
+    )
+    metrics.TTS_CHARACTERS.inc(len(text))
+    try:
+        for chunk in response.iter_bytes(settings.tts_stream_chunk_bytes):
+            if chunk:
+                yield chunk
+    finally:
+        manager.__exit__(None, None, None)
+
+
+def synthesize_tts_bytes(text: str, voice: str) -> bytes:
+    """Generate TTS audio bytes using OpenAI and return MP3 bytes."""
+    return b"".join(synthesize_tts_stream(text, voice))
+
+
+# Async variants (ASYNC_MODE): same prompts and fallbacks, but awaiting the
+# async client so a single worker can keep many upstream calls in flight.
+
+async def _complete_story_async(prompt: str, age: int, complexity: str) -> str:
+    messages = _story_messages(prompt, age, complexity)
+    response = await resilience.call_async(resilience.CHAT, lambda timeout: async_client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        max_tokens=1000,
+        temperature=STORY_TEMPERATURE,
+        timeout=timeout,
+    ), tokens=rate_limit.estimate_tokens(messages, 1000), function="story")
+    metrics.record_usage("story", response.usage)
+    return response.choices[0].message.content.strip()
+
+
+async def generate_story_async(prompt: str, age: int, complexity: str, fallback: bool = True) -> str:
+    try:
+        if not generation_cache.enabled():
+            return await _complete_story_async(prompt, age, complexity)
+        # cache bookkeeping may touch the sync DB pool, so it runs off the event loop
+        key, variety = _story_cache_key(prompt, age, complexity), settings.generation_cache_variety
+        cached = await asyncio.to_thread(generation_cache.pick, key, variety)
+        if cached is not None:
+            return cached
+        text = await _complete_story_async(prompt, age, complexity)
+        await asyncio.to_thread(generation_cache.add, key, text, variety)
+        return text
+    except rate_limit.Throttled:
+        raise
+    except Exception:
+        if not fallback:
+            raise
+        return _fallback_story(prompt, age, complexity)
+
+
+async def generate_story_stream_async(prompt: str, age: int, complexity: str) -> AsyncIterator[str]:
+    key = None
+    if generation_cache.enabled():
+        key = _story_cache_key(prompt, age, complexity)
+        cached = await asyncio.to_thread(generation_cache.pick, key, settings.generation_cache_variety)
+        if cached is not None:
+            yield cached
+            return
+    parts: List[str] = []
+    try:
+        messages = _story_messages(prompt, age, complexity)
+        stream = await resilience.call_async(resilience.CHAT, lambda timeout: async_client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            max_tokens=1000,
+            temperature=STORY_TEMPERATURE,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout,
+        ), hedge=False, tokens=rate_limit.estimate_tokens(messages, 1000), function="story_stream")
+        async for chunk in stream:
+            if not chunk.choices:
+                # the final chunk carries usage only
+                metrics.record_usage("story_stream", chunk.usage)
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+    except rate_limit.Throttled as exc:
+        if not parts:
+            raise
+        raise StoryStreamInterrupted() from exc
+    except Exception as exc:
+        if parts:
+            raise StoryStreamInterrupted() from exc
+        yield _fallback_story(prompt, age, complexity)
+        return
+    text = "".join(parts).strip()
+    if key and text:
+        await asyncio.to_thread(generation_cache.add, key, text, settings.generation_cache_variety)
+
+
+async def _complete_image_prompts_async(story_text: str, num_images: int) -> List[str]:
+    messages = _image_prompt_messages(story_text, num_images)
+    with rate_limit.priority(rate_limit.current_priority.get() or rate_limit.BACKGROUND):
+        resp = await resilience.call_async(resilience.CHAT, lambda timeout: async_client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=IMAGE_PROMPT_TEMPERATURE,
+            max_tokens=400,
+            timeout=timeout,
+        ), tokens=rate_limit.estimate_tokens(messages, 400), function="image_prompts")
+    metrics.record_usage("image_prompts", resp.usage)
+    return _parse_image_prompts(resp.choices[0].message.content.strip(), num_images)
+
+
+async def image_prompts_from_story_async(story_text: str, num_images: int = 3) -> List[str]:
+    num_images = max(1, min(6, num_images))
+    try:
+        if not generation_cache.enabled():
+            return await _complete_image_prompts_async(story_text, num_images)
+        key = _image_prompts_cache_key(story_text, num_images)
+        cached = await asyncio.to_thread(generation_cache.pick, key, 1)
+        if cached is not None:
+            return cached
+        prompts = await _complete_image_prompts_async(story_text, num_images)
+        await asyncio.to_thread(generation_cache.add, key, prompts, 1)
+        return prompts
+    except rate_limit.Throttled:
+        raise
+    except Exception:
+        return _fallback_image_prompts(num_images)
+
+
+async def _generate_image_async(prompt: str, size: str) -> str | None:
+    async with _async_image_semaphore():
+        for model in (settings.openai_image_model, settings.openai_image_fallback_model):
             try:
-                img = client.images.generate(
-                    model=settings.openai_image_fallback_model,
+                img = await resilience.call_async(resilience.IMAGE, lambda timeout: async_client.images.generate(
+                    model=model,
                     prompt=prompt,
                     size=size,
                     response_format="b64_json",
-                )
-                b64 = img.data[0].b64_json
-                images_data_urls.append(f"data:image/png;base64,{b64}")
-                continue
+                    timeout=timeout,
+                ), function="image")
+                return _image_data_url(img)
+            except (resilience.CircuitOpen, rate_limit.Throttled):
+                break
             except Exception:
-                pass
-    return images_data_urls
+                continue
+    return None
 
 
+_image_semaphore: asyncio.Semaphore | None = None
 
-def synthesize_tts_bytes(text: str, voice: str) -> bytes:
-    """Generate TTS audio bytes using OpenAI and return MP3 bytes."""
-    with NamedTemporaryFile(suffix=".mp3", delete=False) as tmp:
-        tmp_path = tmp.name
+
+def _async_image_semaphore() -> asyncio.Semaphore:
+    global _image_semaphore
+    if _image_semaphore is None:
+        _image_semaphore = asyncio.Semaphore(settings.openai_image_concurrency)
+    return _image_semaphore
+
+
+async def images_as_completed_async(
+    prompts: List[str], size: str = "1024x1024", deadline: float | None = None
+) -> AsyncIterator[Tuple[int, str]]:
+    if deadline is None:
+        deadline = settings.openai_image_deadline
+    tasks = {asyncio.ensure_future(_generate_image_async(prompt, size)): i for i, prompt in enumerate(prompts)}
+    pending = set(tasks)
+    end = asyncio.get_running_loop().time() + deadline
     try:
-        with client.audio.speech.with_streaming_response.create(
-            model=settings.openai_tts_model,
-            voice=voice,
-            input=text,
-        ) as response:
-            response.stream_to_file(tmp_path)
-        with open(tmp_path, "rb") as f:
-            audio_bytes = f.read()
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
-        return audio_bytes
-    except Exception as exc:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
-        raise exc
+        while pending:
+            remaining = end - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=tasks.get):
+                if task.exception() is None and task.result():
+                    yield tasks[task], task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def images_from_prompts_async(prompts: List[str], size: str = "1024x1024", deadline: float | None = None) -> List[str]:
+    finished = {i: image async for i, image in images_as_completed_async(prompts, size, deadline)}
+    return [finished[i] for i in sorted(finished)]
+
+
+async def _open_tts_stream_async(text: str, voice: str, timeout: float):
+    manager = async_client.audio.speech.with_streaming_response.create(
+        model=settings.openai_tts_model,
+        voice=voice,
+        input=text,
+        timeout=timeout,
+    )
+    return manager, await manager.__aenter__()
+
+
+async def synthesize_tts_stream_async(text: str, voice: str) -> AsyncIterator[bytes]:
+    manager, response = await resilience.call_async(
+        resilience.TTS, lambda timeout: _open_tts_stream_async(text, voice, timeout), hedge=False, function="tts"
+    )
+    metrics.TTS_CHARACTERS.inc(len(text))
+    try:
+        async for chunk in response.iter_bytes(settings.tts_stream_chunk_bytes):
+            if chunk:
+                yield chunk
+    finally:
+        await manager.__aexit__(None, None, None)
+
 
+async def synthesize_tts_bytes_async(text: str, voice: str) -> bytes:
+    """Generate TTS audio bytes using the async OpenAI client and return MP3 bytes."""
+    return b"".join([chunk async for chunk in synthesize_tts_stream_async(text, voice)])
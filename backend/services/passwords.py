@@ -0,0 +1,89 @@
+"""Password hashing isolated from the request threadpool.
+
+bcrypt is deliberately CPU-expensive, so hashes and verifications run in a
+small dedicated process pool instead of on the threads that serve story
+requests. At most ``PASSWORD_HASH_QUEUE_LIMIT`` operations may be queued or
+running at once; beyond that :class:`PasswordPoolBusy` is raised so the
+caller can shed load (429) instead of piling up.
+"""
+from passlib.hash import bcrypt
+from config import settings
+from db import db_cursor
+from services.process_pool import BoundedProcessPool
+import hashlib
+import hmac
+import logging
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class PasswordPoolBusy(Exception):
+    """Too many password operations are already queued."""
+
+
+def _bcrypt_hash(password: str, rounds: int) -> str:
+    return bcrypt.using(rounds=rounds).hash(password)
+
+
+def _bcrypt_verify(password: str, stored_hash: str) -> bool:
+    return bcrypt.verify(password, stored_hash)
+
+
+_pool = BoundedProcessPool(settings.password_hash_workers, settings.password_hash_queue_limit)
+
+
+def _submit(fn, *args):
+    future = _pool.try_submit(fn, *args)
+    if future is None:
+        raise PasswordPoolBusy()
+    return future.result(timeout=settings.password_hash_timeout)
+
+
+def hash_password(password: str) -> str:
+    return _submit(_bcrypt_hash, password, settings.bcrypt_rounds)
+
+
+def is_bcrypt_hash(stored_hash: str) -> bool:
+    return stored_hash.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+def _sha256_hash(password: str) -> str:
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def verify_password(password: str, stored_hash: str) -> bool:
+    if is_bcrypt_hash(stored_hash):
+        try:
+            return _submit(_bcrypt_verify, password, stored_hash)
+        except ValueError:
+            # malformed hash
+            return False
+    # legacy sha256
+    return hmac.compare_digest(_sha256_hash(password), stored_hash)
+
+
+def needs_rehash(stored_hash: str) -> bool:
+    """True for legacy sha256 hashes and bcrypt hashes with a different cost than ``BCRYPT_ROUNDS``."""
+    if not is_bcrypt_hash(stored_hash):
+        return True
+    return bcrypt.using(rounds=settings.bcrypt_rounds).needs_update(stored_hash)
+
+
+def upgrade_hash(user_id: int, password: str, old_hash: str) -> None:
+    """Replace ``old_hash`` with a fresh bcrypt hash; meant to run as a background task after login.
+
+    The update only applies if the stored hash is still ``old_hash``, so a
+    concurrent password change is never overwritten. Failures are logged and
+    retried naturally on the next login.
+    """
+    try:
+        new_hash = hash_password(password)
+        with db_cursor() as (conn, cur):
+            cur.execute("UPDATE users SET password = %s WHERE id = %s AND password = %s", (new_hash, user_id, old_hash))
+    except Exception:
+        logger.warning("Deferred password rehash for user %s failed", user_id, exc_info=True)
+
+
+def shutdown() -> None:
+    _pool.shutdown()
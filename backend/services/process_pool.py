@@ -0,0 +1,48 @@
+"""Bounded process pools for CPU-heavy work kept off the request threads.
+
+:class:`BoundedProcessPool` starts a spawn-based ``ProcessPoolExecutor`` on
+first use and admits at most ``queue_limit`` queued or running calls;
+beyond that :meth:`~BoundedProcessPool.try_submit` returns None so the caller
+can shed load or degrade instead of piling up work.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Optional
+import multiprocessing
+import threading
+
+
+class BoundedProcessPool:
+    def __init__(self, workers: int, queue_limit: int) -> None:
+        self._workers = max(1, workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, queue_limit))
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn: forking a process that already runs threads (uvicorn, DB pool) is unsafe
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self._workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self._executor
+
+    def try_submit(self, fn: Callable, *args) -> Optional[Future]:
+        """Queue ``fn(*args)`` in a worker process, or return None when the pool is full."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,320 @@
+"""Token-bucket limits for upstream (OpenAI) traffic.
+
+Each operation class (chat, image, tts) has a requests-per-minute bucket,
+and chat also a tokens-per-minute bucket, so bursts are smoothed here
+instead of turning into upstream 429s. With ``RATE_LIMIT_BACKEND=postgres``
+the buckets are rows in ``rate_limit_buckets`` shared by every worker and
+process; ``local`` keeps them in memory (single process, tests).
+
+Interactive work (story text) may use a whole bucket; background work
+(images, TTS, queued jobs) must leave ``OPENAI_INTERACTIVE_RESERVE`` of it
+untouched. Priority and the calling user travel in context variables, set
+by the auth dependency and by the job worker. Each user additionally has a
+``USER_OPENAI_RPM`` bucket, charged once per user request however many
+upstream calls it fans out into (images, TTS segments, batches); exceeding
+it fails fast with :class:`QuotaExceeded`.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import settings
+from db import db_cursor
+import asyncio
+import logging
+import math
+import threading
+import time
+
+
+logger = logging.getLogger("uvicorn.error")
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+current_user: ContextVar[Optional[int]] = ContextVar("rate_limit_user", default=None)
+current_action: ContextVar[Optional["_Action"]] = ContextVar("rate_limit_action", default=None)
+current_priority: ContextVar[Optional[str]] = ContextVar("rate_limit_priority", default=None)
+
+_DEFAULT_PRIORITY = {"chat": INTERACTIVE, "image": BACKGROUND, "tts": BACKGROUND}
+
+
+class Throttled(Exception):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class QuotaExceeded(Throttled):
+    """The calling user used up their share of upstream requests."""
+
+
+class RateLimited(Throttled):
+    """The global budget for an operation stayed exhausted for longer than the max wait."""
+
+
+class _Action:
+    """One user request; shared by reference with every context copied from it (worker threads, tasks)."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.charged = False
+
+
+def begin_action(user_id: int) -> None:
+    """Attribute upstream calls made from here on to ``user_id``, as one request."""
+    current_user.set(user_id)
+    current_action.set(_Action())
+
+
+@contextmanager
+def priority(level: str) -> Iterator[None]:
+    token = current_priority.set(level)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class _LocalBucket:
+    def __init__(self, capacity: float) -> None:
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+
+_local_lock = threading.Lock()
+_local: Dict[str, _LocalBucket] = {}
+_counters = {"granted": 0, "waits": 0, "rate_limited": 0, "quota_exceeded": 0}
+
+
+def _count(name: str) -> None:
+    with _local_lock:
+        _counters[name] += 1
+
+
+def _take_local(name: str, per_minute: float, cost: float, floor: float) -> Tuple[bool, float]:
+    rate = per_minute / 60.0
+    with _local_lock:
+        bucket = _local.get(name)
+        if bucket is None:
+            bucket = _local[name] = _LocalBucket(per_minute)
+        now = time.monotonic()
+        level = min(per_minute, bucket.tokens + rate * (now - bucket.updated_at))
+        bucket.updated_at = now
+        if level - cost >= floor:
+            bucket.tokens = level - cost
+            return True, 0.0
+        bucket.tokens = level
+        return False, (cost + floor - level) / rate
+
+
+def _refund_local(name: str, per_minute: float, cost: float) -> None:
+    with _local_lock:
+        bucket = _local.get(name)
+        if bucket is not None:
+            bucket.tokens = min(per_minute, bucket.tokens + cost)
+
+
+# One round trip: refill, then take ``cost`` only if the level stays above ``floor``;
+# the row lock serializes concurrent takers and the result is the level seen.
+# A missing bucket is created full with ``cost`` already taken.
+TAKE_BUCKET = """
+    WITH o AS (
+        SELECT name, LEAST(%(cap)s, tokens + %(rate)s * EXTRACT(EPOCH FROM now() - updated_at))::float8 AS level
+        FROM rate_limit_buckets WHERE name = %(name)s FOR UPDATE
+    ), taken AS (
+        UPDATE rate_limit_buckets b
+        SET tokens = CASE WHEN o.level - %(cost)s >= %(floor)s THEN o.level - %(cost)s ELSE o.level END, updated_at = now()
+        FROM o WHERE b.name = o.name
+        RETURNING o.level
+    ), created AS (
+        INSERT INTO rate_limit_buckets (name, tokens, updated_at)
+        SELECT %(name)s, %(cap)s - %(cost)s, now() WHERE NOT EXISTS (SELECT 1 FROM o)
+        ON CONFLICT (name) DO NOTHING
+        RETURNING %(cap)s::float8 AS level
+    )
+    SELECT level FROM taken UNION ALL SELECT level FROM created
+"""
+REFUND_BUCKET = "UPDATE rate_limit_buckets SET tokens = LEAST(%s, tokens + %s) WHERE name = %s"
+
+
+def _take_postgres(name: str, per_minute: float, cost: float, floor: float) -> Tuple[bool, float]:
+    rate = per_minute / 60.0
+    params = {"name": name, "cap": per_minute, "rate": rate, "cost": cost, "floor": floor}
+    with db_cursor() as (conn, cur):
+        cur.execute(TAKE_BUCKET, params)
+        row = cur.fetchone()
+        if row is None:
+            # another process created the bucket between our read and insert; it is visible now
+            cur.execute(TAKE_BUCKET, params)
+            row = cur.fetchone()
+    level = row[0]
+    return (True, 0.0) if level - cost >= floor else (False, (cost + floor - level) / rate)
+
+
+def _take(name: str, per_minute: float, cost: float, floor: float = 0.0) -> Tuple[bool, float]:
+    # a cost above what the bucket can ever hold would wait forever
+    cost = min(cost, per_minute - floor)
+    if settings.rate_limit_backend == "postgres":
+        try:
+            return _take_postgres(name, per_minute, cost, floor)
+        except Exception:
+            logger.warning("Shared rate limit unavailable; using the local bucket for %s", name, exc_info=True)
+    return _take_local(name, per_minute, cost, floor)
+
+
+def _refund(name: str, per_minute: float, cost: float) -> None:
+    """Give back ``cost`` taken from a bucket for a call that never went upstream."""
+    cost = min(cost, per_minute)
+    if settings.rate_limit_backend == "postgres":
+        try:
+            with db_cursor() as (conn, cur):
+                cur.execute(REFUND_BUCKET, (per_minute, cost, name))
+            return
+        except Exception:
+            logger.warning("Shared rate limit unavailable; refunding the local bucket for %s", name, exc_info=True)
+    _refund_local(name, per_minute, cost)
+
+
+def _budgets(operation: str, tokens: int) -> List[Tuple[str, float, float]]:
+    limits = {
+        "chat": [("requests", settings.openai_chat_rpm, 1), ("tokens", settings.openai_chat_tpm, tokens)],
+        "image": [("requests", settings.openai_image_rpm, 1)],
+        "tts": [("requests", settings.openai_tts_rpm, 1)],
+    }[operation]
+    return [(f"{operation}:{unit}", per_minute, cost) for unit, per_minute, cost in limits if per_minute > 0 and cost > 0]
+
+
+def charge_request(cost: float = 1) -> float:
+    """Charge the current request against its user's quota, once; later calls in the request are free.
+
+    Routes that fan out into many upstream calls may charge a larger ``cost``
+    up front (capped at the whole bucket); raises :class:`QuotaExceeded`.
+    Returns what was charged now, for :func:`refund_request`.
+    """
+    user_id = current_user.get()
+    if user_id is None or settings.user_openai_rpm <= 0:
+        return 0
+    action = current_action.get()
+    if action is None:
+        _charge(user_id, cost)
+        return cost
+    with action.lock:
+        if action.charged:
+            return 0
+        _charge(user_id, cost)
+        action.charged = True
+    return cost
+
+
+def refund_request(cost: float) -> None:
+    """Undo a :func:`charge_request` whose upstream call never happened."""
+    user_id = current_user.get()
+    if not cost or user_id is None:
+        return
+    _refund(f"user:{user_id}", settings.user_openai_rpm, cost)
+    action = current_action.get()
+    if action is not None:
+        with action.lock:
+            action.charged = False
+
+
+def _charge(user_id: int, cost: float) -> None:
+    ok, wait = _take(f"user:{user_id}", settings.user_openai_rpm, cost)
+    if not ok:
+        _count("quota_exceeded")
+        raise QuotaExceeded(wait)
+
+
+def _floor(operation: str, per_minute: float) -> float:
+    level = current_priority.get() or _DEFAULT_PRIORITY[operation]
+    return per_minute * settings.openai_interactive_reserve if level == BACKGROUND else 0.0
+
+
+def acquire(operation: str, tokens: int = 0, charge_user: bool = True) -> None:
+    """Block until ``operation`` may call upstream, or raise :class:`Throttled`.
+
+    Retries of the same logical call pass ``charge_user=False`` so they only
+    count against the global budget. When the wait times out, whatever was
+    already taken for this call (user quota, earlier budgets) is refunded.
+    """
+    charged = charge_request() if charge_user else 0
+    deadline = time.monotonic() + settings.openai_rate_limit_max_wait
+    taken: List[Tuple[str, float, float]] = []
+    for name, per_minute, cost in _budgets(operation, tokens):
+        while True:
+            ok, wait = _take(name, per_minute, cost, _floor(operation, per_minute))
+            if ok:
+                taken.append((name, per_minute, cost))
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _count("rate_limited")
+                _refund_all(taken, charged)
+                raise RateLimited(wait)
+            _count("waits")
+            time.sleep(min(wait, remaining))
+    _count("granted")
+
+
+async def acquire_async(operation: str, tokens: int = 0, charge_user: bool = True) -> None:
+    """Async counterpart of :func:`acquire`; database buckets are taken off the event loop."""
+    take = asyncio.to_thread if settings.rate_limit_backend == "postgres" else _run_inline
+    charged = await take(charge_request) if charge_user else 0
+    deadline = time.monotonic() + settings.openai_rate_limit_max_wait
+    taken: List[Tuple[str, float, float]] = []
+    for name, per_minute, cost in _budgets(operation, tokens):
+        while True:
+            ok, wait = await take(_take, name, per_minute, cost, _floor(operation, per_minute))
+            if ok:
+                taken.append((name, per_minute, cost))
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _count("rate_limited")
+                await take(_refund_all, taken, charged)
+                raise RateLimited(wait)
+            _count("waits")
+            await asyncio.sleep(min(wait, remaining))
+    _count("granted")
+
+
+def try_acquire(operation: str, tokens: int = 0) -> bool:
+    """Take ``operation``'s budgets only if all are available now; never waits and never charges the user.
+
+    For optional extra attempts (hedges) that should simply be skipped when the budget is tight.
+    """
+    taken: List[Tuple[str, float, float]] = []
+    for name, per_minute, cost in _budgets(operation, tokens):
+        ok, _ = _take(name, per_minute, cost, _floor(operation, per_minute))
+        if not ok:
+            _refund_all(taken, 0)
+            return False
+        taken.append((name, per_minute, cost))
+    _count("granted")
+    return True
+
+
+async def try_acquire_async(operation: str, tokens: int = 0) -> bool:
+    take = asyncio.to_thread if settings.rate_limit_backend == "postgres" else _run_inline
+    return await take(try_acquire, operation, tokens)
+
+
+def _refund_all(taken: List[Tuple[str, float, float]], charged: float) -> None:
+    for name, per_minute, cost in taken:
+        _refund(name, per_minute, cost)
+    refund_request(charged)
+
+
+async def _run_inline(fn, *args):
+    return fn(*args)
+
+
+def estimate_tokens(messages: list, max_tokens: int) -> int:
+    """Rough chat token cost: ~4 characters per prompt token plus the completion budget."""
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return math.ceil(chars / 4) + max_tokens
+
+
+def stats() -> dict:
+    with _local_lock:
+        return {"backend": settings.rate_limit_backend, **_counters}
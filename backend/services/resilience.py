@@ -0,0 +1,275 @@
+"""Resilience policies for upstream (OpenAI) calls.
+
+Every call runs under a per-operation policy: a request timeout, a bounded
+number of retries with full-jitter exponential backoff for transient errors
+(timeouts, connection errors, 429, 5xx), and a circuit breaker per operation
+that fails fast with :class:`CircuitOpen` after repeated failures so callers
+drop to their fallbacks instead of waiting on an unhealthy upstream. Chat
+completions can optionally be hedged: if the first attempt is still running
+after ``OPENAI_HEDGE_AFTER`` seconds a second one is started and the first
+success wins.
+
+Each attempt first takes its share of the rate limits (services.rate_limit);
+a hedge is only started when the budget has room for it right away.
+Attempts are timed and counted per ``function`` label in services.metrics.
+
+Callables receive the timeout to pass to the client, e.g.
+``call("chat", lambda timeout: client.chat.completions.create(..., timeout=timeout))``.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from config import settings
+from services import metrics, rate_limit
+import asyncio
+import openai
+import random
+import threading
+import time
+
+
+T = TypeVar("T")
+
+CHAT = "chat"
+IMAGE = "image"
+TTS = "tts"
+
+
+class CircuitOpen(Exception):
+    """The upstream for this operation is considered unhealthy; fail fast."""
+
+
+@dataclass(frozen=True)
+class Policy:
+    timeout: float
+    retries: int
+    hedge_after: float = 0.0
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open (one probe) -> closed."""
+
+    def __init__(self, name: str, threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if self._probing or time.monotonic() - self._opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._probing and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def abandon(self) -> None:
+        """The call let through by :meth:`allow` ended without an outcome (cancelled); free the probe slot."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.threshold):
+                self.opened += 1
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+_policies: Dict[str, Policy] = {
+    CHAT: Policy(settings.openai_chat_timeout, settings.openai_max_retries, settings.openai_hedge_after),
+    IMAGE: Policy(settings.openai_image_timeout, settings.openai_max_retries),
+    TTS: Policy(settings.openai_tts_timeout, settings.openai_max_retries),
+}
+_breakers: Dict[str, CircuitBreaker] = {
+    name: CircuitBreaker(name, settings.openai_breaker_threshold, settings.openai_breaker_reset) for name in _policies
+}
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="openai-hedge")
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and (exc.status_code == 429 or exc.status_code >= 500)
+
+
+def _backoff(attempt: int, exc: BaseException) -> float:
+    delay = random.uniform(0, min(settings.openai_retry_max, settings.openai_retry_base * (2 ** attempt)))
+    response = getattr(exc, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), settings.openai_retry_max))
+        except ValueError:
+            pass
+    return delay
+
+
+def _settle(breaker: CircuitBreaker, exc: BaseException) -> bool:
+    """Record the outcome of a failed attempt; True if it should be retried."""
+    if is_transient(exc):
+        breaker.record_failure()
+        return True
+    # a 4xx means upstream answered; the request itself was bad
+    breaker.record_success()
+    return False
+
+
+def _outcome(exc: Optional[BaseException]) -> str:
+    if exc is None:
+        return "ok"
+    if isinstance(exc, rate_limit.Throttled):
+        return "throttled"
+    return "transient_error" if is_transient(exc) else "error"
+
+
+def _observe(operation: str, function: str, start: float, exc: Optional[BaseException] = None) -> None:
+    metrics.UPSTREAM_LATENCY.labels(operation, function).observe(time.perf_counter() - start)
+    metrics.UPSTREAM_REQUESTS.labels(operation, function, _outcome(exc)).inc()
+
+
+def _hedged(fn: Callable[[float], T], policy: Policy, operation: str, tokens: int) -> T:
+    first = _hedge_executor.submit(fn, policy.timeout)
+    try:
+        return first.result(timeout=policy.hedge_after)
+    except FutureTimeoutError:
+        pass
+    if not rate_limit.try_acquire(operation, tokens):
+        return first.result()
+    pending = {first, _hedge_executor.submit(fn, policy.timeout)}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                return fut.result()
+            error = fut.exception()
+    raise error
+
+
+def call(operation: str, fn: Callable[[float], T], hedge: bool = True, tokens: int = 0, function: str = "") -> T:
+    """Run ``fn(timeout)`` under the policy for ``operation``.
+
+    Pass ``hedge=False`` for calls that must not be duplicated, such as
+    streams whose response would be left dangling. ``tokens`` is the
+    estimated token cost charged to the rate limiter; ``function`` names the
+    caller in metrics.
+    """
+    policy, breaker = _policies[operation], _breakers[operation]
+    function = function or operation
+    for attempt in range(policy.retries + 1):
+        start = time.perf_counter()
+        try:
+            rate_limit.acquire(operation, tokens, charge_user=attempt == 0)
+        except rate_limit.Throttled as exc:
+            _observe(operation, function, start, exc)
+            raise
+        metrics.RATE_LIMIT_WAIT.labels(operation).observe(time.perf_counter() - start)
+        if not breaker.allow():
+            metrics.UPSTREAM_REQUESTS.labels(operation, function, "circuit_open").inc()
+            raise CircuitOpen(operation)
+        start = time.perf_counter()
+        try:
+            result = _hedged(fn, policy, operation, tokens) if hedge and policy.hedge_after > 0 else fn(policy.timeout)
+        except Exception as exc:
+            _observe(operation, function, start, exc)
+            if not _settle(breaker, exc) or attempt == policy.retries:
+                raise
+            time.sleep(_backoff(attempt, exc))
+            continue
+        except BaseException:
+            breaker.abandon()
+            raise
+        _observe(operation, function, start)
+        breaker.record_success()
+        return result
+    raise AssertionError("unreachable")
+
+
+async def _hedged_async(fn: Callable[[float], Awaitable[T]], policy: Policy, operation: str, tokens: int) -> T:
+    first = asyncio.ensure_future(fn(policy.timeout))
+    try:
+        done, _ = await asyncio.wait({first}, timeout=policy.hedge_after)
+        if done:
+            return first.result()
+        if not await rate_limit.try_acquire_async(operation, tokens):
+            return await first
+    except BaseException:
+        first.cancel()
+        raise
+    pending = {first, asyncio.ensure_future(fn(policy.timeout))}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def call_async(
+    operation: str, fn: Callable[[float], Awaitable[T]], hedge: bool = True, tokens: int = 0, function: str = ""
+) -> T:
+    """Async counterpart of :func:`call`."""
+    policy, breaker = _policies[operation], _breakers[operation]
+    function = function or operation
+    for attempt in range(policy.retries + 1):
+        start = time.perf_counter()
+        try:
+            await rate_limit.acquire_async(operation, tokens, charge_user=attempt == 0)
+        except rate_limit.Throttled as exc:
+            _observe(operation, function, start, exc)
+            raise
+        metrics.RATE_LIMIT_WAIT.labels(operation).observe(time.perf_counter() - start)
+        if not breaker.allow():
+            metrics.UPSTREAM_REQUESTS.labels(operation, function, "circuit_open").inc()
+            raise CircuitOpen(operation)
+        start = time.perf_counter()
+        try:
+            if hedge and policy.hedge_after > 0:
+                result = await _hedged_async(fn, policy, operation, tokens)
+            else:
+                result = await fn(policy.timeout)
+        except Exception as exc:
+            _observe(operation, function, start, exc)
+            if not _settle(breaker, exc) or attempt == policy.retries:
+                raise
+            await asyncio.sleep(_backoff(attempt, exc))
+            continue
+        except BaseException:
+            breaker.abandon()
+            raise
+        _observe(operation, function, start)
+        breaker.record_success()
+        return result
+    raise AssertionError("unreachable")
+
+
+def stats() -> dict:
+    return {name: {"state": b.state, "opened": b.opened, "rejected": b.rejected} for name, b in _breakers.items()}
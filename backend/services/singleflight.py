@@ -0,0 +1,67 @@
+"""In-process single-flight: concurrent callers for the same key share one execution."""
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, Optional, Tuple, TypeVar
+import threading
+import time
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """``max_age`` bounds how long a leader may hold a key; an abandoned call
+    (e.g. a streaming response that was never consumed) is then replaced."""
+
+    def __init__(self, max_age: Optional[float] = None) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Tuple[Future, float]] = {}
+        self.max_age = max_age
+        self.coalesced = 0
+
+    def acquire(self, key: Hashable) -> Tuple[Future, bool]:
+        """Return the in-flight future for ``key`` and whether the caller is its leader.
+
+        The leader must finish the call with :meth:`resolve` or :meth:`fail`;
+        followers wait on the future (``result()`` or ``asyncio.wrap_future``).
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._calls.get(key)
+            if entry is not None and (self.max_age is None or now - entry[1] < self.max_age):
+                self.coalesced += 1
+                return entry[0], False
+            fut = Future()
+            self._calls[key] = (fut, now)
+            return fut, True
+
+    def _forget(self, key: Hashable, fut: Future) -> None:
+        with self._lock:
+            entry = self._calls.get(key)
+            if entry is not None and entry[0] is fut:
+                del self._calls[key]
+
+    def resolve(self, key: Hashable, fut: Future, result) -> None:
+        self._forget(key, fut)
+        if not fut.done():
+            fut.set_result(result)
+
+    def fail(self, key: Hashable, fut: Future, exc: BaseException) -> None:
+        self._forget(key, fut)
+        if not fut.done():
+            fut.set_exception(exc)
+
+    def do(self, key: Hashable, fn: Callable[[], T], timeout: float | None = None) -> T:
+        fut, leader = self.acquire(key)
+        if not leader:
+            return fut.result(timeout=timeout)
+        try:
+            result = fn()
+        except BaseException as exc:
+            self.fail(key, fut, exc)
+            raise
+        self.resolve(key, fut, result)
+        return result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
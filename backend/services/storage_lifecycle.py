@@ -0,0 +1,210 @@
+"""Storage lifecycle: retention, compaction and blob garbage collection.
+
+Run periodically by the job worker (``MAINTENANCE_INTERVAL``) and on demand
+with ``python maintenance.py``. Each pass
+
+- **retention**: drops ``story_audio`` rows, TTS cache entries, finished jobs
+  and idle per-user rate-limit buckets older than their configured age;
+- **compaction**: moves media still kept inside rows (``story_audio.audio_bytes``,
+  ``story_images.data_url``) into the content-addressed blob store, where
+  identical payloads collapse into one blob;
+- **blob GC**: deletes blobs no row references any more (superseded audio,
+  replaced images, evicted cache entries) and abandoned partial writes.
+
+Every step reports the rows and bytes it reclaimed; ``dry_run`` only counts.
+Only one process runs a pass at a time (a :class:`~services.coalesce.Lease`).
+"""
+from typing import Dict, Iterator, List, Optional, Set
+from config import settings
+from db import db_cursor
+from services import story_media
+from services.blob_store import get_blob_store
+from services.coalesce import Lease
+import json
+import logging
+import time
+
+
+logger = logging.getLogger("uvicorn.error")
+
+LOCK_KEY = "storage_lifecycle"
+
+# step -> (table, condition on rows past retention, retention setting in days)
+RETENTION = {
+    "story_audio": ("story_audio", "created_at < now() - make_interval(secs => %s)", "story_audio_retention_days"),
+    "tts_cache": ("tts_cache", "last_used_at < now() - make_interval(secs => %s)", "tts_cache_retention_days"),
+    "jobs": ("jobs", "status IN ('succeeded', 'failed') AND finished_at < now() - make_interval(secs => %s)", "job_retention_days"),
+    # an idle bucket has long refilled, so dropping it loses nothing
+    "rate_limit_buckets": (
+        "rate_limit_buckets", "name LIKE 'user:%%' AND updated_at < now() - make_interval(secs => %s)", "rate_limit_bucket_idle_days",
+    ),
+}
+
+# Every column holding a blob key; variants maps hold several
+REFERENCED_BLOBS = """
+    SELECT blob_key FROM story_images WHERE blob_key IS NOT NULL
+    UNION SELECT v.value FROM story_images, jsonb_each_text(variants) v
+    UNION SELECT blob_key FROM universal_story_images
+    UNION SELECT v.value FROM universal_story_images, jsonb_each_text(variants) v
+    UNION SELECT blob_key FROM story_audio WHERE blob_key IS NOT NULL
+    UNION SELECT blob_key FROM tts_cache
+"""
+STILL_REFERENCED = f"SELECT k FROM unnest(%s::text[]) AS k WHERE k IN ({REFERENCED_BLOBS})"
+
+
+def _stat(rows: int = 0, size: int = 0) -> Dict[str, int]:
+    return {"rows": rows, "bytes": size}
+
+
+def apply_retention(dry_run: bool = False) -> Dict[str, Dict[str, int]]:
+    """Delete rows past their retention; bytes are the row storage freed (blobs go in :func:`collect_blobs`)."""
+    report = {}
+    for step, (table, condition, setting) in RETENTION.items():
+        days = getattr(settings, setting)
+        if days <= 0:
+            continue
+        if dry_run:
+            sql = f"SELECT COUNT(*), COALESCE(SUM(pg_column_size(t.*)), 0) FROM {table} t WHERE {condition}"
+        else:
+            sql = f"""
+                WITH gone AS (DELETE FROM {table} t WHERE {condition} RETURNING pg_column_size(t.*) AS size)
+                SELECT COUNT(*), COALESCE(SUM(size), 0) FROM gone
+            """
+        with db_cursor() as (conn, cur):
+            cur.execute(sql, (days * 86400,))
+            rows, size = cur.fetchone()
+        report[f"retention.{step}"] = _stat(rows, int(size))
+    return report
+
+
+def _legacy_batches(sql: str) -> Iterator[List[tuple]]:
+    """``(id, payload)`` rows in id order, one batch per transaction."""
+    last_id = 0
+    while True:
+        with db_cursor() as (conn, cur):
+            cur.execute(sql, (last_id, settings.maintenance_batch_size))
+            rows = cur.fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def compact_story_audio(dry_run: bool = False) -> Dict[str, int]:
+    """Move audio still stored inline into the blob store."""
+    if dry_run:
+        with db_cursor() as (conn, cur):
+            cur.execute("SELECT COUNT(*), COALESCE(SUM(octet_length(audio_bytes)), 0) FROM story_audio WHERE audio_bytes IS NOT NULL")
+            rows, size = cur.fetchone()
+        return _stat(rows, int(size))
+    stat = _stat()
+    store = get_blob_store()
+    batches = _legacy_batches(
+        "SELECT id, audio_bytes, blob_key FROM story_audio WHERE id > %s AND audio_bytes IS NOT NULL ORDER BY id LIMIT %s"
+    )
+    for rows in batches:
+        for row_id, audio, key in rows:
+            audio = bytes(audio)
+            # a downgrade copies blobs back into the rows but keeps the blob
+            key = key or store.put(audio, "audio/mpeg")
+            with db_cursor() as (conn, cur):
+                cur.execute(
+                    "UPDATE story_audio SET blob_key = %s, size_bytes = %s, audio_bytes = NULL WHERE id = %s",
+                    (key, len(audio), row_id),
+                )
+            stat["rows"] += 1
+            stat["bytes"] += len(audio)
+    return stat
+
+
+def compact_story_images(dry_run: bool = False) -> Dict[str, int]:
+    """Move images still stored as data URLs into the blob store, rendering their variants."""
+    if dry_run:
+        with db_cursor() as (conn, cur):
+            cur.execute("SELECT COUNT(*), COALESCE(SUM(octet_length(data_url)), 0) FROM story_images WHERE data_url LIKE 'data:%%'")
+            rows, size = cur.fetchone()
+        return _stat(rows, int(size))
+    stat = _stat()
+    for rows in _legacy_batches("SELECT id, data_url FROM story_images WHERE id > %s AND data_url LIKE 'data:%%' ORDER BY id LIMIT %s"):
+        for row_id, data_url in rows:
+            key, variants = story_media.put_image(data_url)
+            with db_cursor() as (conn, cur):
+                cur.execute(
+                    "UPDATE story_images SET blob_key = %s, variants = %s::jsonb, data_url = NULL WHERE id = %s",
+                    (key, json.dumps(variants), row_id),
+                )
+            stat["rows"] += 1
+            stat["bytes"] += len(data_url)
+    return stat
+
+
+def _referenced_blobs() -> Set[str]:
+    with db_cursor() as (conn, cur):
+        # server-side cursor: the key list is streamed, not materialized twice
+        with conn.cursor(name="referenced_blobs") as named:
+            named.itersize = 10000
+            named.execute(REFERENCED_BLOBS)
+            return {row[0] for row in named}
+
+
+def collect_blobs(dry_run: bool = False, grace: Optional[float] = None) -> Dict[str, int]:
+    """Delete blobs older than ``grace`` seconds that no row references.
+
+    Blobs are listed before references are loaded and candidates are checked
+    against the rows again afterwards. Writers reusing existing content bump
+    its modification time before they insert their row (both backends), and
+    each blob's age is read once more right before it is deleted, so content
+    reused at any point up to that read survives the pass.
+    """
+    if grace is None:
+        grace = settings.blob_gc_grace_seconds
+    store = get_blob_store()
+    cutoff = time.time() - grace
+    candidates = [(key, size) for key, size, modified in store.iter_blobs() if modified < cutoff]
+    referenced = _referenced_blobs()
+    orphans = {key: size for key, size in candidates if key not in referenced}
+    if orphans:
+        with db_cursor() as (conn, cur):
+            cur.execute(STILL_REFERENCED, (list(orphans),))
+            for row in cur.fetchall():
+                orphans.pop(row[0], None)
+    stat = _stat()
+    for key, size in orphans.items():
+        if not dry_run:
+            try:
+                if store.modified(key) >= cutoff:
+                    continue
+                store.delete(key)
+            except Exception:
+                logger.warning("Deleting orphaned blob %s failed", key, exc_info=True)
+                continue
+        stat["rows"] += 1
+        stat["bytes"] += size
+    if not dry_run:
+        files, size = store.purge_temp(grace)
+        stat["rows"] += files
+        stat["bytes"] += size
+    return stat
+
+
+def run(dry_run: bool = False, retention: bool = True, compaction: bool = True, gc: bool = True,
+        grace: Optional[float] = None) -> Optional[Dict[str, Dict[str, int]]]:
+    """One maintenance pass; returns the per-step report, or None when another process is running one."""
+    lock = Lease(LOCK_KEY, ttl=settings.maintenance_interval or 6 * 3600)
+    if not lock.try_acquire():
+        return None
+    try:
+        report: Dict[str, Dict[str, int]] = {}
+        if retention:
+            report.update(apply_retention(dry_run))
+        if compaction:
+            report["compaction.story_audio"] = compact_story_audio(dry_run)
+            report["compaction.story_images"] = compact_story_images(dry_run)
+        # after retention and compaction, so blobs they released are collected in the same pass
+        if gc:
+            report["gc.blobs"] = collect_blobs(dry_run, grace)
+    finally:
+        lock.release()
+    total = sum(step["bytes"] for step in report.values())
+    logger.info("Storage maintenance%s reclaimed %d bytes: %s", " (dry run)" if dry_run else "", total, report)
+    return report
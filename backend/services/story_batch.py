@@ -0,0 +1,157 @@
+"""Batch story generation for classrooms and catalog pre-seeding.
+
+A batch is generated concurrently, at most ``STORY_BATCH_CONCURRENCY``
+stories at a time per batch on a process-wide pool of
+``STORY_BATCH_WORKERS`` threads, and every story that came back is saved
+with one multi-row ``INSERT``: a batch of fifty costs one pooled connection
+checkout instead of fifty. Each item gets its own status, so a throttled or
+failed story does not sink the rest of the batch; a story the model could
+not write is reported as failed, never replaced by the canned fallback.
+"""
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Tuple
+from psycopg2.extras import execute_values
+from config import settings
+from db import async_db_cursor, db_cursor
+from services import rate_limit
+from services.openai_service import generate_story, generate_story_async
+from datetime import datetime
+import asyncio
+import contextvars
+import logging
+
+
+logger = logging.getLogger("uvicorn.error")
+
+# (prompt, title, story_type) per story, as built by routers.stories.story_prompt_and_title
+BatchItem = Tuple[str, str, str]
+
+# RETURNING order is unspecified, so ids are drawn per item index up front and reported with it
+INSERT_STORIES = """
+    WITH v (ord, user_id, title, content, story_type, created_at) AS (VALUES %s),
+    numbered AS (SELECT nextval(pg_get_serial_sequence('stories', 'id')) AS id, v.* FROM v),
+    inserted AS (
+        INSERT INTO stories (id, user_id, title, content, story_type, created_at)
+        SELECT id, user_id, title, content, story_type, created_at FROM numbered
+        RETURNING id
+    )
+    SELECT numbered.ord, numbered.id FROM numbered JOIN inserted USING (id)
+"""
+_ROW_PLACEHOLDER = "(%s::int, %s::int, %s::varchar, %s::text, %s::varchar, %s::timestamp)"
+
+_executor = ThreadPoolExecutor(max_workers=max(1, settings.story_batch_workers), thread_name_prefix="story-batch")
+
+
+def _generate_all(prompts: List[str], age: int, complexity: str) -> List[object]:
+    """Story text (or the exception raised) per prompt, keeping order."""
+    window = max(1, settings.story_batch_concurrency)
+    results: List[object] = [None] * len(prompts)
+    pending: Dict[Future, int] = {}
+    upcoming = iter(enumerate(prompts))
+
+    def submit_next() -> None:
+        item = next(upcoming, None)
+        if item is not None:
+            index, prompt = item
+            # copy the caller's context so the rate limiter sees its user and priority
+            pending[_executor.submit(contextvars.copy_context().run, generate_story, prompt, age, complexity, False)] = index
+
+    for _ in range(window):
+        submit_next()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            try:
+                results[index] = future.result()
+            except Exception as exc:
+                results[index] = exc
+            submit_next()
+    return results
+
+
+async def _generate_all_async(prompts: List[str], age: int, complexity: str) -> List[object]:
+    gate = asyncio.Semaphore(max(1, settings.story_batch_concurrency))
+
+    async def one(prompt: str) -> str:
+        async with gate:
+            return await generate_story_async(prompt, age, complexity, fallback=False)
+
+    return await asyncio.gather(*(one(p) for p in prompts), return_exceptions=True)
+
+
+def _rows(user_id: int, items: List[BatchItem], contents: List[object], created_at: datetime) -> List[tuple]:
+    return [
+        (index, user_id, title, content, story_type, created_at)
+        for index, ((_, title, story_type), content) in enumerate(zip(items, contents))
+        if isinstance(content, str)
+    ]
+
+
+def _results(items: List[BatchItem], contents: List[object], ids: Dict[int, int], created_at: datetime) -> List[dict]:
+    """Per-item status; ``ids`` maps item index to inserted id, and is empty when saving failed."""
+    results = []
+    for index, ((_, title, story_type), content) in enumerate(zip(items, contents)):
+        if isinstance(content, rate_limit.Throttled):
+            results.append({
+                "index": index, "status": "throttled",
+                "detail": "Too many story requests, try again shortly", "retryAfter": round(content.retry_after, 1),
+            })
+        elif not isinstance(content, str):
+            results.append({"index": index, "status": "failed", "detail": "Story generation failed"})
+        elif not ids:
+            results.append({"index": index, "status": "failed", "detail": "Could not save story"})
+        else:
+            results.append({
+                "index": index, "status": "created", "id": ids[index], "title": title, "content": content,
+                "storyType": story_type, "createdAt": created_at.isoformat(),
+            })
+    return results
+
+
+def _log_failures(contents: List[object]) -> None:
+    for content in contents:
+        if isinstance(content, Exception) and not isinstance(content, rate_limit.Throttled):
+            logger.warning("Batch story generation failed", exc_info=content)
+
+
+def insert_stories(rows: List[tuple]) -> Dict[int, int]:
+    """Insert ``(index, user_id, title, content, story_type, created_at)`` rows in one statement; ``{index: id}``."""
+    if not rows:
+        return {}
+    with db_cursor() as (conn, cur):
+        # one page, so the whole batch is a single statement
+        fetched = execute_values(cur, INSERT_STORIES, rows, template=_ROW_PLACEHOLDER, page_size=len(rows), fetch=True)
+    return {ord_: id_ for ord_, id_ in fetched}
+
+
+def run_batch(user_id: int, items: List[BatchItem], age: int, complexity: str) -> List[dict]:
+    contents = _generate_all([prompt for prompt, _, _ in items], age, complexity)
+    _log_failures(contents)
+    created_at = datetime.now()
+    rows = _rows(user_id, items, contents, created_at)
+    try:
+        ids = insert_stories(rows)
+    except Exception:
+        logger.warning("Saving a batch of %s stories failed", len(rows), exc_info=True)
+        ids = {}
+    return _results(items, contents, ids, created_at)
+
+
+async def run_batch_async(user_id: int, items: List[BatchItem], age: int, complexity: str) -> List[dict]:
+    """:func:`run_batch` on the async OpenAI client and asyncpg."""
+    contents = await _generate_all_async([prompt for prompt, _, _ in items], age, complexity)
+    _log_failures(contents)
+    created_at = datetime.now()
+    rows = _rows(user_id, items, contents, created_at)
+    ids: Dict[int, int] = {}
+    if rows:
+        # asyncpg has no execute_values: spell out the VALUES list with one placeholder group per row
+        sql = INSERT_STORIES.replace("VALUES %s", "VALUES " + ", ".join([_ROW_PLACEHOLDER] * len(rows)))
+        try:
+            async with async_db_cursor() as (conn, cur):
+                await cur.execute(sql, [value for row in rows for value in row])
+                ids = {r[0]: r[1] for r in await cur.fetchall()}
+        except Exception:
+            logger.warning("Saving a batch of %s stories failed", len(rows), exc_info=True)
+    return _results(items, contents, ids, created_at)
@@ -0,0 +1,152 @@
+"""Generation + persistence of story media, shared by the HTTP routes and the job worker."""
+from typing import Dict, Iterator, List, Optional, Tuple
+from datetime import datetime
+from config import settings
+from db import db_cursor
+from services import coalesce, image_variants
+from services.blob_store import decode_data_url, get_blob_store
+import json
+from services.openai_service import image_prompts_from_story, images_as_completed, images_from_prompts
+
+
+# One row per (story_id, image_index): a regenerated image replaces the old one in place
+UPSERT_STORY_IMAGE = """
+    INSERT INTO story_images (story_id, image_index, blob_key, data_url, prompt, variants, created_at)
+    VALUES (%s, %s, %s, NULL, %s, %s::jsonb, %s)
+    ON CONFLICT (story_id, image_index)
+    DO UPDATE SET blob_key = EXCLUDED.blob_key, data_url = NULL, prompt = EXCLUDED.prompt,
+                  variants = EXCLUDED.variants, created_at = EXCLUDED.created_at
+"""
+# One row per (story_id, voice, model): re-synthesized audio replaces the old row, whose blob the
+# storage lifecycle collects once nothing else references it
+UPSERT_STORY_AUDIO = """
+    INSERT INTO story_audio (story_id, voice, model, blob_key, size_bytes, created_at)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (story_id, voice, model)
+    DO UPDATE SET blob_key = EXCLUDED.blob_key, size_bytes = EXCLUDED.size_bytes,
+                  audio_bytes = NULL, created_at = EXCLUDED.created_at
+"""
+PRUNE_STORY_IMAGES = "DELETE FROM story_images WHERE story_id = %s AND NOT (image_index = ANY(%s))"
+
+
+def put_image(data_url: str) -> Tuple[str, Dict[str, str]]:
+    """Store a generated image and its downscaled variants; returns ``(blob_key, variants)``."""
+    data, content_type = decode_data_url(data_url)
+    return get_blob_store().put(data, content_type), image_variants.store_variants(data)
+
+
+def put_images(images: List[str]) -> List[Tuple[str, Dict[str, str]]]:
+    """:func:`put_image` for a whole set, rendering the variants in parallel."""
+    decoded = [decode_data_url(img) for img in images]
+    keys = [get_blob_store().put(data, content_type) for data, content_type in decoded]
+    return list(zip(keys, image_variants.store_variants_many([data for data, _ in decoded])))
+
+
+def save_story_image(story_id: int, index: int, key: str, prompt: str, variants: Dict[str, str]) -> None:
+    with db_cursor() as (conn, cur):
+        cur.execute(UPSERT_STORY_IMAGE, (story_id, index, key, prompt, json.dumps(variants), datetime.now()))
+
+
+def prune_story_images(story_id: int, keep: List[int]) -> None:
+    """Drop images left over from an earlier, larger set."""
+    with db_cursor() as (conn, cur):
+        cur.execute(PRUNE_STORY_IMAGES, (story_id, keep))
+
+
+def generate_story_images(content: str, num_images: int, size: str) -> Tuple[List[str], List[str]]:
+    """Return ``(data_urls, prompts)`` for a story; empty images means generation failed."""
+    prompts = image_prompts_from_story(content, num_images=num_images)
+    images = images_from_prompts(prompts, size=size)
+    return images, prompts
+
+
+def store_story_images(story_id: int, images: List[str], prompts: List[str]) -> List[str]:
+    """Move generated data URLs into the blob store and make them the story's image set.
+
+    The rows are written in one transaction, so a coalesced waiter reading the
+    story's images never sees half of a new set.
+    """
+    stored = list(zip(put_images(images), prompts))
+    now = datetime.now()
+    with db_cursor() as (conn, cur):
+        for idx, ((key, variants), pr) in enumerate(stored):
+            cur.execute(UPSERT_STORY_IMAGE, (story_id, idx, key, pr, json.dumps(variants), now))
+        cur.execute(PRUNE_STORY_IMAGES, (story_id, list(range(len(stored)))))
+    return [key for (key, _), _ in stored]
+
+
+def stream_story_images(story_id: int, content: str, num_images: int, size: str) -> Iterator[Tuple[str, object]]:
+    """Generate a story's images, storing and yielding each one as soon as it is ready.
+
+    Yields ``("prompts", prompts)`` first, then ``("image", (index, blob_key, variants, prompt))``
+    per finished image in completion order. Indexes follow the prompts, so a
+    failed image leaves a gap instead of shifting the rest.
+    """
+    prompts = image_prompts_from_story(content, num_images=num_images)
+    yield "prompts", prompts
+    stored: List[int] = []
+    for idx, data_url in images_as_completed(prompts, size):
+        key, variants = put_image(data_url)
+        save_story_image(story_id, idx, key, prompts[idx], variants)
+        stored.append(idx)
+        yield "image", (idx, key, variants, prompts[idx])
+    if stored:
+        prune_story_images(story_id, stored)
+
+
+def save_story_audio(story_id: int, voice: str, key: str, size: int) -> None:
+    with db_cursor() as (conn, cur):
+        cur.execute(UPSERT_STORY_AUDIO, (story_id, voice, settings.openai_tts_model, key, size, datetime.now()))
+
+
+def stored_universal_images(story_id: str, size: str, variant: str = image_variants.ORIGINAL, fmt: str = "webp") -> Tuple[List[str], List[str]]:
+    """Blob keys (of ``variant`` in ``fmt`` where rendered) and prompts of a universal story's stored images."""
+    with db_cursor() as (conn, cur):
+        cur.execute(
+            "SELECT blob_key, prompt, variants FROM universal_story_images WHERE story_id = %s AND size = %s ORDER BY image_index ASC",
+            (story_id, size),
+        )
+        rows = cur.fetchall()
+    return [image_variants.select(r[0], r[2], variant, fmt) for r in rows], [r[1] for r in rows]
+
+
+def store_universal_images(story_id: str, size: str, images: List[str], prompts: List[str]) -> List[str]:
+    stored = put_images(images)
+    with db_cursor() as (conn, cur):
+        cur.execute("DELETE FROM universal_story_images WHERE story_id = %s AND size = %s", (story_id, size))
+        for idx, ((key, variants), pr) in enumerate(zip(stored, prompts)):
+            cur.execute(
+                """
+                INSERT INTO universal_story_images (story_id, size, image_index, blob_key, prompt, variants, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s::jsonb, %s)
+                """,
+                (story_id, size, idx, key, pr, json.dumps(variants), datetime.now()),
+            )
+    return [key for key, _ in stored]
+
+
+def universal_images(
+    story_id: str, content: str, num_images: int, size: str, variant: str = image_variants.ORIGINAL, fmt: str = "webp"
+) -> Tuple[List[str], List[str]]:
+    """Blob keys (of ``variant``) and prompts of a universal story's images, generated and stored on first use.
+
+    Universal stories are shared by every user, so one stored set per size
+    serves all requests asking for at most that many images.
+    """
+    def lookup() -> Optional[Tuple[List[str], List[str]]]:
+        keys, prompts = stored_universal_images(story_id, size, variant, fmt)
+        return (keys[:num_images], prompts[:num_images]) if len(keys) >= num_images else None
+
+    found = lookup()
+    if found:
+        return found
+
+    def compute() -> Tuple[List[str], List[str]]:
+        images, prompts = generate_story_images(content, num_images, size)
+        if not images:
+            raise RuntimeError("Image generation failed")
+        return store_universal_images(story_id, size, images, prompts), prompts[: len(images)]
+
+    found = coalesce.run("universal_images", (story_id, num_images, size), compute, lookup)
+    # generation stores every variant, but shared results carry the originals
+    return (lookup() or found) if variant != image_variants.ORIGINAL else found
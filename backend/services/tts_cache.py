@@ -0,0 +1,179 @@
+"""Content-addressed TTS cache shared by personal and universal stories.
+
+Entries are keyed by ``sha256(model, voice, text)`` and point at an MP3 in
+the blob store, so two stories with identical text (or every listener of a
+universal story) share one synthesis. Whole-story audio is kept under
+``TTS_CACHE_MAX_BYTES`` by evicting least-recently-used entries; the
+segments long stories are built from (:mod:`services.tts_segments`) are a
+separate ``kind`` with their own keys, counters and
+``TTS_SEGMENT_CACHE_MAX_BYTES`` budget, so they never evict whole stories.
+"""
+from typing import Callable, Optional
+from config import settings
+from db import db_cursor
+from services.blob_store import get_blob_store
+from services.coalesce import Lease, coalesce_key
+from services.openai_service import synthesize_tts_bytes
+from services.singleflight import SingleFlight
+import hashlib
+import json
+import threading
+
+
+flight = SingleFlight(max_age=settings.tts_cache_wait_timeout)
+
+STORY = "story"
+SEGMENT = "segment"
+
+_counter_lock = threading.Lock()
+_counters = {
+    f"{prefix}{name}": 0 for prefix in ("", "segment_") for name in ("hits", "misses", "stores", "evictions")
+}
+
+
+def _count(name: str, kind: str = STORY, n: int = 1) -> None:
+    with _counter_lock:
+        _counters[name if kind == STORY else f"{kind}_{name}"] += n
+
+
+def _budget(kind: str) -> int:
+    return settings.tts_cache_max_bytes if kind == STORY else settings.tts_segment_cache_max_bytes
+
+
+def cache_key(text: str, voice: str, model: Optional[str] = None, kind: str = STORY) -> str:
+    fields = [model or settings.openai_tts_model, voice, text]
+    payload = json.dumps(fields if kind == STORY else fields + [kind], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def lookup(key: str, count: bool = True, kind: str = STORY) -> Optional[str]:
+    """Return the blob key for ``key`` and bump its recency, or None on a miss."""
+    with db_cursor() as (conn, cur):
+        cur.execute(
+            "UPDATE tts_cache SET last_used_at = now(), hits = hits + 1 WHERE cache_key = %s RETURNING blob_key",
+            (key,),
+        )
+        row = cur.fetchone()
+    hit = bool(row) and get_blob_store().exists(row[0])
+    if count:
+        _count("hits" if hit else "misses", kind)
+    return row[0] if hit else None
+
+
+def store(key: str, blob_key: str, size: int, voice: str, model: Optional[str] = None, kind: str = STORY) -> None:
+    with db_cursor() as (conn, cur):
+        cur.execute(
+            """
+            INSERT INTO tts_cache (cache_key, blob_key, size_bytes, voice, model, kind, created_at, last_used_at)
+            VALUES (%s, %s, %s, %s, %s, %s, now(), now())
+            ON CONFLICT (cache_key) DO UPDATE SET
+              blob_key = EXCLUDED.blob_key,
+              size_bytes = EXCLUDED.size_bytes,
+              last_used_at = now()
+            """,
+            (key, blob_key, size, voice, model or settings.openai_tts_model, kind),
+        )
+    _count("stores", kind)
+    evict(kind=kind)
+
+
+def store_audio(key: str, audio: bytes, voice: str, kind: str = STORY) -> str:
+    blob_key = get_blob_store().put(audio, "audio/mpeg")
+    store(key, blob_key, len(audio), voice, kind=kind)
+    return blob_key
+
+
+def evict(max_bytes: Optional[int] = None, kind: str = STORY) -> int:
+    """Drop least-recently-used entries of ``kind`` beyond its size budget; returns the number evicted."""
+    if max_bytes is None:
+        max_bytes = _budget(kind)
+    with db_cursor() as (conn, cur):
+        cur.execute(
+            """
+            DELETE FROM tts_cache WHERE cache_key IN (
+              SELECT cache_key FROM (
+                SELECT cache_key, SUM(size_bytes) OVER (ORDER BY last_used_at DESC, cache_key) AS running
+                FROM tts_cache WHERE kind = %s
+              ) ranked WHERE running > %s
+            )
+            """,
+            (kind, max_bytes),
+        )
+        evicted = cur.rowcount
+    # blobs left unreferenced are collected by services.storage_lifecycle after its grace period;
+    # deleting them here would race a concurrent store_audio of the same content
+    if evicted:
+        _count("evictions", kind, evicted)
+    return evicted
+
+
+def get_or_synthesize(text: str, voice: str, synthesize: Callable[[str, str], bytes] = synthesize_tts_bytes) -> str:
+    """Return the blob key for this text/voice, synthesizing once per key across concurrent callers and workers."""
+    key = cache_key(text, voice)
+    blob = lookup(key)
+    if blob:
+        return blob
+
+    def fill() -> str:
+        # Serialize with other workers synthesizing the same key: wait for theirs or take the lease
+        lease = Lease(coalesce_key("tts", key))
+        try:
+            _, existing = lease.acquire(lambda: lookup(key, count=False))
+        except Exception:
+            existing = None
+        try:
+            existing = existing or lookup(key, count=False)
+            if existing:
+                return existing
+            return store_audio(key, synthesize(text, voice), voice)
+        finally:
+            try:
+                lease.release()
+            except Exception:
+                pass
+
+    return flight.do(key, fill, timeout=settings.tts_cache_wait_timeout)
+
+
+def claim(key: str) -> tuple[Optional[Lease], Optional[str]]:
+    """Take the cross-worker lease for synthesizing ``key``.
+
+    Returns ``(lease, None)`` when the caller should synthesize (``lease`` is
+    None if the database is unavailable or the wait timed out), or
+    ``(None, blob_key)`` when another worker finished the same audio while we
+    waited.
+    """
+    lease = Lease(coalesce_key("tts", key))
+    try:
+        locked, blob = lease.acquire(lambda: lookup(key, count=False))
+    except Exception:
+        return None, None
+    if blob:
+        return None, blob
+    if not locked:
+        return None, None
+    try:
+        blob = lookup(key, count=False)
+    except Exception:
+        blob = None
+    if blob:
+        release(lease)
+        return None, blob
+    return lease, None
+
+
+def release(lease: Optional[Lease]) -> None:
+    if lease is None:
+        return
+    try:
+        lease.release()
+    except Exception:
+        pass
+
+
+def stats() -> dict:
+    with _counter_lock:
+        data = dict(_counters)
+    data["coalesced"] = flight.coalesced
+    data["in_flight"] = flight.in_flight()
+    return data
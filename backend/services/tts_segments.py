@@ -0,0 +1,246 @@
+"""Segmented TTS for long stories.
+
+Story text is split on paragraph boundaries (long paragraphs further on
+sentence boundaries) and every segment is synthesized and cached on its own
+in :mod:`services.tts_cache` (as ``kind="segment"``, apart from whole
+stories and with its own budget), so editing one paragraph only
+re-synthesizes that paragraph. Segments run concurrently, at most
+``TTS_SEGMENT_PARALLELISM`` ahead per story and ``TTS_SEGMENT_WORKERS`` per
+process, and are stitched into one MP3 in text order: a stream starts as
+soon as the first segment is ready. Text that fits in one segment takes the
+plain single-call path.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from typing import AsyncIterator, Deque, Iterator, List
+from config import settings
+from services import tts_cache
+from services.blob_store import get_blob_store
+from services.singleflight import SingleFlight
+from services.openai_service import synthesize_tts_bytes, synthesize_tts_bytes_async, synthesize_tts_stream, synthesize_tts_stream_async
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+import contextvars
+import re
+
+
+_PARAGRAPH_RE = re.compile(r"\n\s*")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def split_text(text: str, max_chars: int | None = None, min_chars: int | None = None) -> List[str]:
+    """Paragraphs of ``text``; longer ones split between sentences, headings joined to what follows."""
+    if max_chars is None:
+        max_chars = settings.tts_segment_max_chars
+    if min_chars is None:
+        min_chars = settings.tts_segment_min_chars
+    segments: List[str] = []
+    carry = ""
+    for paragraph in _PARAGRAPH_RE.split(text.strip()):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if carry:
+            paragraph, carry = f"{carry}\n{paragraph}", ""
+        if len(paragraph) < min_chars:
+            carry = paragraph
+            continue
+        current = ""
+        for sentence in _SENTENCE_RE.split(paragraph):
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                segments.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        segments.append(current)
+    if carry:
+        if segments:
+            segments[-1] = f"{segments[-1]}\n{carry}"
+        else:
+            segments.append(carry)
+    return segments
+
+
+def _id3_length(data: bytes) -> int:
+    """Size of a leading ID3v2 tag, 0 if there is none."""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+
+# Layer III bitrates (kbit/s) by MPEG-1 / MPEG-2(.5), and sample rates by version bits
+_BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def _info_frame_length(data: bytes, offset: int) -> int:
+    """Length of a Xing/Info frame at ``offset`` (0 if it is an ordinary audio frame).
+
+    That frame carries the frame count and seek table of one segment, which
+    would be wrong for the stitched file, so it is dropped.
+    """
+    header = data[offset : offset + 4]
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return 0
+    version, layer = (header[1] >> 3) & 3, (header[1] >> 1) & 3
+    bitrate_index, rate_index, padding = header[2] >> 4, (header[2] >> 2) & 3, (header[2] >> 1) & 1
+    if layer != 1 or version == 1 or rate_index == 3 or bitrate_index in (0, 15):
+        return 0
+    mono = header[3] >> 6 == 3
+    side_info = (17 if mono else 32) if version == 3 else (9 if mono else 17)
+    tag = data[offset + 4 + side_info : offset + 8 + side_info]
+    if tag not in (b"Xing", b"Info"):
+        return 0
+    bitrate = _BITRATES[3 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    return (144 if version == 3 else 72) * bitrate // sample_rate + padding
+
+
+def stitch(segment: bytes, first: bool) -> bytes:
+    """Prepare one segment's MP3 for concatenation: only the first keeps its ID3 tag."""
+    start = _id3_length(segment)
+    head = segment[:start] if first else b""
+    start += _info_frame_length(segment, start)
+    return head + segment[start:]
+
+
+_executor = ThreadPoolExecutor(max_workers=max(1, settings.tts_segment_workers), thread_name_prefix="tts-segment")
+
+
+# Segments coalesce within the process only: the caller already holds the story's lease,
+# so a per-segment lease would just add round trips while other workers wait on the story
+flight = SingleFlight(max_age=settings.tts_cache_wait_timeout)
+
+
+def _synthesize_segment(key: str, segment: str, voice: str) -> bytes:
+    audio = synthesize_tts_bytes(segment, voice)
+    try:
+        tts_cache.store_audio(key, audio, voice, kind=tts_cache.SEGMENT)
+    except Exception:
+        pass
+    return audio
+
+
+def _segment_audio(segment: str, voice: str) -> bytes:
+    key = tts_cache.cache_key(segment, voice, kind=tts_cache.SEGMENT)
+    try:
+        blob = tts_cache.lookup(key, kind=tts_cache.SEGMENT)
+    except Exception:
+        blob = None
+    if blob:
+        return get_blob_store().get(blob)
+    return flight.do(key, lambda: _synthesize_segment(key, segment, voice), timeout=settings.tts_cache_wait_timeout)
+
+
+def _iter_segments(segments: List[str], voice: str) -> Iterator[bytes]:
+    window = max(1, settings.tts_segment_parallelism)
+    pending: Deque[Future] = deque()
+    upcoming = iter(segments)
+
+    def submit_next() -> None:
+        segment = next(upcoming, None)
+        if segment is not None:
+            # copy the caller's context so the rate limiter sees its user and priority
+            pending.append(_executor.submit(contextvars.copy_context().run, _segment_audio, segment, voice))
+
+    for _ in range(window):
+        submit_next()
+    try:
+        index = 0
+        while pending:
+            audio = pending.popleft().result()
+            submit_next()
+            yield stitch(audio, first=index == 0)
+            index += 1
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def synthesize_stream(text: str, voice: str) -> Iterator[bytes]:
+    """MP3 for ``text``: one streamed call for short text, stitched cached segments otherwise."""
+    segments = split_text(text) if settings.tts_segmented else [text]
+    if len(segments) <= 1:
+        return synthesize_tts_stream(text, voice)
+    return _iter_segments(segments, voice)
+
+
+def synthesize_bytes(text: str, voice: str) -> bytes:
+    segments = split_text(text) if settings.tts_segmented else [text]
+    if len(segments) <= 1:
+        return synthesize_tts_bytes(text, voice)
+    return b"".join(_iter_segments(segments, voice))
+
+
+def get_or_synthesize(text: str, voice: str) -> str:
+    """:func:`services.tts_cache.get_or_synthesize` for whole stories, built from cached segments."""
+    return tts_cache.get_or_synthesize(text, voice, synthesize=synthesize_bytes)
+
+
+async def _segment_audio_async(segment: str, voice: str) -> bytes:
+    key = tts_cache.cache_key(segment, voice, kind=tts_cache.SEGMENT)
+    try:
+        blob = await run_in_threadpool(tts_cache.lookup, key, True, tts_cache.SEGMENT)
+    except Exception:
+        blob = None
+    if blob:
+        return await run_in_threadpool(get_blob_store().get, blob)
+    # the same flight as the sync path, so sync and async requests share one synthesis too
+    call, leader = flight.acquire(key)
+    if not leader:
+        # shield: a timeout here must not cancel the leader others are waiting on
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(call)), timeout=settings.tts_cache_wait_timeout)
+    try:
+        audio = await synthesize_tts_bytes_async(segment, voice)
+    except BaseException as exc:
+        # followers must not see the leader's cancellation as their own
+        flight.fail(key, call, exc if isinstance(exc, Exception) else RuntimeError("Segment synthesis was cancelled"))
+        raise
+    try:
+        await run_in_threadpool(tts_cache.store_audio, key, audio, voice, tts_cache.SEGMENT)
+    except Exception:
+        pass
+    flight.resolve(key, call, audio)
+    return audio
+
+
+async def _iter_segments_async(segments: List[str], voice: str) -> AsyncIterator[bytes]:
+    window = max(1, settings.tts_segment_parallelism)
+    pending: Deque[asyncio.Task] = deque()
+    upcoming = iter(segments)
+
+    def submit_next() -> None:
+        segment = next(upcoming, None)
+        if segment is not None:
+            pending.append(asyncio.ensure_future(_segment_audio_async(segment, voice)))
+
+    for _ in range(window):
+        submit_next()
+    try:
+        index = 0
+        while pending:
+            audio = await pending.popleft()
+            submit_next()
+            yield stitch(audio, first=index == 0)
+            index += 1
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def synthesize_stream_async(text: str, voice: str) -> AsyncIterator[bytes]:
+    segments = split_text(text) if settings.tts_segmented else [text]
+    if len(segments) <= 1:
+        return synthesize_tts_stream_async(text, voice)
+    return _iter_segments_async(segments, voice)
+
+
+async def synthesize_bytes_async(text: str, voice: str) -> bytes:
+    segments = split_text(text) if settings.tts_segmented else [text]
+    if len(segments) <= 1:
+        return await synthesize_tts_bytes_async(text, voice)
+    return b"".join([chunk async for chunk in _iter_segments_async(segments, voice)])
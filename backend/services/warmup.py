@@ -0,0 +1,91 @@
+"""Pre-generation of universal story media.
+
+The universal catalog is fixed and shared by every user, so its images and
+TTS audio are generated once ahead of time and stored: the routes then only
+read from storage. Work runs with bounded parallelism and background
+priority so it never crowds out interactive requests.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional
+from config import settings
+from services import catalog_cache, rate_limit, story_media, tts_cache, tts_segments
+from services.coalesce import Lease
+import logging
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def configured_voices() -> List[str]:
+    return [v.strip() for v in settings.universal_warmup_voices.split(",") if v.strip()]
+
+
+def _warm_images(story_id: str, content: str, num_images: int, size: str) -> str:
+    keys, _ = story_media.stored_universal_images(story_id, size)
+    if len(keys) >= num_images:
+        return "cached"
+    story_media.universal_images(story_id, content, num_images, size)
+    return "generated"
+
+
+def _warm_audio(content: str, voice: str) -> str:
+    if tts_cache.lookup(tts_cache.cache_key(content, voice), count=False):
+        return "cached"
+    tts_segments.get_or_synthesize(content, voice)
+    return "generated"
+
+
+def _in_background(fn: Callable[..., str], *args) -> str:
+    with rate_limit.priority(rate_limit.BACKGROUND):
+        return fn(*args)
+
+
+def warm_universal_media(
+    voices: Optional[List[str]] = None,
+    num_images: Optional[int] = None,
+    size: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    images: bool = True,
+    audio: bool = True,
+) -> dict:
+    """Make sure every universal story has stored images and audio; returns per-outcome counts."""
+    voices = configured_voices() if voices is None else voices
+    num_images = num_images or settings.universal_warmup_images
+    size = size or settings.universal_warmup_size
+    stories = catalog_cache.snapshot().contents
+    counts = {"cached": 0, "generated": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency or settings.universal_warmup_concurrency), thread_name_prefix="warmup") as pool:
+        tasks = {}
+        for story_id, (_, content) in stories.items():
+            if images:
+                tasks[pool.submit(_in_background, _warm_images, story_id, content, num_images, size)] = f"{story_id} images"
+            if audio:
+                for voice in voices:
+                    tasks[pool.submit(_in_background, _warm_audio, content, voice)] = f"{story_id} tts/{voice}"
+        for fut in as_completed(tasks):
+            try:
+                outcome = fut.result()
+            except Exception:
+                logger.warning("Warm-up of %s failed", tasks[fut], exc_info=True)
+                outcome = "failed"
+            counts[outcome] += 1
+    return counts
+
+
+def warm_on_startup() -> None:
+    """Startup hook: one process (per database) runs the warm-up, the others skip it."""
+    # held for the whole warm-up; the TTL only matters if this process dies mid-way
+    lock = Lease("universal_warmup", ttl=6 * 3600)
+    try:
+        if not lock.try_acquire():
+            return
+    except Exception:
+        logger.warning("Universal media warm-up skipped: database unavailable", exc_info=True)
+        return
+    try:
+        counts = warm_universal_media()
+        logger.info("Universal media warm-up done: %s", counts)
+    except Exception:
+        logger.exception("Universal media warm-up failed")
+    finally:
+        lock.release()
@@ -0,0 +1,40 @@
+"""Pre-generate images and TTS audio for the universal stories catalog.
+
+Usage: python warmup.py [--voices alloy,nova] [--images 3] [--size 1024x1024]
+                        [--concurrency 2] [--skip-images] [--skip-audio]
+
+Already stored media is skipped, so the command is safe to re-run (e.g.
+after adding stories or voices).
+"""
+import argparse
+import logging
+from config import settings
+from db import close_pool
+from services import warmup
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pre-generate universal story media")
+    parser.add_argument("--voices", default=settings.universal_warmup_voices, help="Comma-separated TTS voices")
+    parser.add_argument("--images", type=int, default=settings.universal_warmup_images)
+    parser.add_argument("--size", default=settings.universal_warmup_size)
+    parser.add_argument("--concurrency", type=int, default=settings.universal_warmup_concurrency)
+    parser.add_argument("--skip-images", action="store_true")
+    parser.add_argument("--skip-audio", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    counts = warmup.warm_universal_media(
+        voices=[v.strip() for v in args.voices.split(",") if v.strip()],
+        num_images=args.images,
+        size=args.size,
+        concurrency=args.concurrency,
+        images=not args.skip_images,
+        audio=not args.skip_audio,
+    )
+    print(f"cached={counts['cached']} generated={counts['generated']} failed={counts['failed']}")
+    close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Background job worker.
+
+Usage: python worker.py [--concurrency N]
+
+Runs image and TTS jobs from the ``jobs`` table out of band from the API.
+Idle threads wait for a ``NOTIFY jobs`` (sent on enqueue) or the poll
+interval, whichever comes first. Every ``MAINTENANCE_INTERVAL`` seconds one
+worker also runs a storage maintenance pass (see ``maintenance.py``).
+"""
+import argparse
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+from config import settings
+from db import get_connection, close_pool
+from services import jobs, storage_lifecycle
+
+
+logger = logging.getLogger("worker")
+
+
+def _listen(wakeup: threading.Event, stop: threading.Event) -> None:
+    while not stop.is_set():
+        conn = None
+        try:
+            conn = get_connection()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("LISTEN jobs")
+            while not stop.is_set():
+                if select.select([conn], [], [], settings.job_poll_interval) != ([], [], []):
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        wakeup.set()
+        except Exception:
+            logger.warning("LISTEN connection lost; falling back to polling", exc_info=True)
+            stop.wait(settings.job_poll_interval)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+def _work(worker_id: str, wakeup: threading.Event, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            if jobs.run_one(worker_id):
+                continue
+        except Exception:
+            logger.exception("Worker %s failed to process a job", worker_id)
+        wakeup.wait(settings.job_poll_interval)
+        wakeup.clear()
+
+
+def _maintain(stop: threading.Event) -> None:
+    # wait a full interval first so restarting a fleet of workers does not start a pass each
+    while not stop.wait(settings.maintenance_interval):
+        try:
+            storage_lifecycle.run()
+        except Exception:
+            logger.exception("Storage maintenance failed")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run background generation jobs")
+    parser.add_argument("--concurrency", type=int, default=settings.job_worker_concurrency)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    stop = threading.Event()
+    wakeup = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [threading.Thread(target=_listen, args=(wakeup, stop), daemon=True)]
+    threads += [
+        threading.Thread(target=_work, args=(f"{prefix}:{i}", wakeup, stop), daemon=True)
+        for i in range(max(1, args.concurrency))
+    ]
+    if settings.maintenance_interval > 0:
+        threads.append(threading.Thread(target=_maintain, args=(stop,), daemon=True))
+    for t in threads:
+        t.start()
+    logger.info("Worker %s started with %d threads", prefix, args.concurrency)
+    stop.wait()
+    logger.info("Shutting down worker %s", prefix)
+    wakeup.set()
+    for t in threads[1:]:
+        t.join(timeout=settings.job_visibility_timeout)
+    close_pool()
+
+
+if __name__ == "__main__":
+    main()
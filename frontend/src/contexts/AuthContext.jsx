@@ -95,8 +95,11 @@ export const AuthProvider = ({ children }) => {
         })
         
         if (response.ok) {
+          const result = await response.json()
+          // The token embeds the story settings, so keep the reissued one
           const updatedUser = {
             ...user,
+            ...(result.token ? { token: result.token } : {}),
             settings: { ...user.settings, ...newSettings }
           }
           setUser(updatedUser)
@@ -101,6 +101,7 @@ const CreateStoryPage = ({ selectedTheme = 'candy' }) => {
   const [isLoadingSaved, setIsLoadingSaved] = useState(false)
   const [loadSavedError, setLoadSavedError] = useState(null)
   const [deletingId, setDeletingId] = useState(null)
+  const [savedCursor, setSavedCursor] = useState(null)
   const [universalStories, setUniversalStories] = useState([])
   const [isLoadingUniversal, setIsLoadingUniversal] = useState(false)
   const [loadUniversalError, setLoadUniversalError] = useState(null)
@@ -119,31 +120,48 @@ const CreateStoryPage = ({ selectedTheme = 'candy' }) => {
     boxSizing: 'border-box'
   }
 
-  // Load saved stories when switching to "sparade-sagor"
-  useEffect(() => {
-    const fetchSavedStories = async () => {
-      if (!user?.id) return
-      setIsLoadingSaved(true)
-      setLoadSavedError(null)
-      try {
-        const response = await fetch(`http://localhost:8000/stories`, {
-          headers: {
-            ...(user?.token ? { 'Authorization': `Bearer ${user.token}` } : {})
-          }
-        })
-        if (!response.ok) {
-          throw new Error('Kunde inte hämta sparade sagor')
-        }
-        const data = await response.json()
-        setSavedStories(Array.isArray(data.stories) ? data.stories : [])
-      } catch (err) {
-        setLoadSavedError(err.message || 'Fel vid hämtning av sparade sagor')
-        setSavedStories([])
-      } finally {
-        setIsLoadingSaved(false)
+  const authHeaders = () => (user?.token ? { 'Authorization': `Bearer ${user.token}` } : {})
+
+  // Fetch one page of saved stories (summaries only); cursor continues after the previous page
+  const fetchSavedStories = async (cursor = null) => {
+    if (!user?.id) return
+    setIsLoadingSaved(true)
+    setLoadSavedError(null)
+    try {
+      const params = new URLSearchParams({ limit: '20' })
+      if (cursor) params.set('cursor', cursor)
+      const response = await fetch(`http://localhost:8000/stories?${params}`, {
+        headers: authHeaders()
+      })
+      if (!response.ok) {
+        throw new Error('Kunde inte hämta sparade sagor')
       }
+      const data = await response.json()
+      const page = Array.isArray(data.stories) ? data.stories : []
+      setSavedStories(prev => (cursor ? [...prev, ...page] : page))
+      setSavedCursor(data.nextCursor || null)
+    } catch (err) {
+      setLoadSavedError(err.message || 'Fel vid hämtning av sparade sagor')
+      if (!cursor) setSavedStories([])
+    } finally {
+      setIsLoadingSaved(false)
     }
+  }
+
+  // The list only carries excerpts, so load the full story before opening the reader
+  const openSavedStory = async (s) => {
+    try {
+      const res = await fetch(`http://localhost:8000/stories/${s.id}`, { headers: authHeaders() })
+      if (!res.ok) throw new Error('Kunde inte hämta sagan')
+      const story = await res.json()
+      navigate('/story-reader', { state: { story } })
+    } catch (err) {
+      alert('Kunde inte öppna sagan. Försök igen.')
+    }
+  }
 
+  // Load saved stories when switching to "sparade-sagor"
+  useEffect(() => {
     if (currentView === 'sparade-sagor') {
       fetchSavedStories()
     }
@@ -729,7 +747,7 @@ const CreateStoryPage = ({ selectedTheme = 'candy' }) => {
           >Till meny</button>
         </div>
 
-        {isLoadingSaved && (
+        {isLoadingSaved && savedStories.length === 0 && (
           <div style={{ color: currentTheme.textColor, opacity: 0.8 }}>Laddar sparade sagor...</div>
         )}
 
@@ -749,7 +767,7 @@ const CreateStoryPage = ({ selectedTheme = 'candy' }) => {
           </div>
         )}
 
-        {!isLoadingSaved && savedStories.length > 0 && (
+        {savedStories.length > 0 && (
           <div style={{ 
             display: 'grid',
             gridTemplateColumns: 'repeat(auto-fit, minmax(260px, 1fr))',
@@ -767,7 +785,7 @@ const CreateStoryPage = ({ selectedTheme = 'candy' }) => {
                   transition: 'all 0.2s ease',
                   position: 'relative'
                 }}
-                onClick={() => navigate('/story-reader', { state: { story: s } })}
+                onClick={() => openSavedStory(s)}
                 onMouseEnter={(e) => { e.currentTarget.style.transform = 'translateY(-3px)' }}
                 onMouseLeave={(e) => { e.currentTarget.style.transform = 'translateY(0)' }}
               >
@@ -809,7 +827,7 @@ const CreateStoryPage = ({ selectedTheme = 'candy' }) => {
                     }}
                   >{deletingId === s.id ? 'Raderar…' : 'Radera'}</button>
                 </div>
-                <div style={{ fontSize: '13px', color: '#6b7280', marginTop: '6px' }}>{(s.content || '').slice(0, 120)}{(s.content || '').length > 120 ? '…' : ''}</div>
+                <div style={{ fontSize: '13px', color: '#6b7280', marginTop: '6px' }}>{s.excerpt}</div>
                 <div style={{ marginTop: '10px', fontSize: '12px', color: '#374151', opacity: 0.8 }}>
                   {s.storyType} • {s.createdAt ? new Date(s.createdAt).toLocaleString() : ''}
                 </div>
@@ -817,6 +835,26 @@ const CreateStoryPage = ({ selectedTheme = 'candy' }) => {
             ))}
           </div>
         )}
+
+        {savedCursor && (
+          <div style={{ display: 'flex', justifyContent: 'center', marginTop: '20px' }}>
+            <button
+              onClick={() => fetchSavedStories(savedCursor)}
+              disabled={isLoadingSaved}
+              style={{
+                backgroundColor: 'rgba(255, 255, 255, 0.9)',
+                border: 'none',
+                borderRadius: '8px',
+                padding: '8px 16px',
+                fontSize: '14px',
+                fontWeight: '600',
+                color: '#1f2937',
+                cursor: isLoadingSaved ? 'not-allowed' : 'pointer',
+                boxShadow: '0 2px 8px rgba(0,0,0,0.1)'
+              }}
+            >{isLoadingSaved ? 'Laddar…' : 'Visa fler'}</button>
+          </div>
+        )}
       </div>
     </>
   )
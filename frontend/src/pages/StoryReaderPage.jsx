@@ -62,6 +62,50 @@ const StoryReaderPage = ({ selectedTheme = 'candy' }) => {
     return () => { document.body.style.overflow = original }
   }, [zoomOverlay.active])
 
+  // Skapa bilder via SSE: varje bild visas så fort den är klar
+  const streamStoryImages = async (storyId, headers) => {
+    const res = await fetch(`http://localhost:8000/stories/${storyId}/images/stream?num_images=3&size=1024x1024&variant=medium`, { method: 'POST', headers })
+    if (!res.ok || !res.body) throw new Error('Kunde inte skapa bilder')
+    const reader = res.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    let received = 0
+    let slots = []
+    while (true) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      const events = buffer.split('\n\n')
+      buffer = events.pop()
+      for (const raw of events) {
+        const type = (raw.match(/^event: (.*)$/m) || [])[1]
+        const line = (raw.match(/^data: (.*)$/m) || [])[1]
+        const data = line ? JSON.parse(line) : {}
+        if (type === 'prompts') {
+          slots = new Array(data.prompts.length).fill(null)
+          setImages(slots)
+          setImagePrompts(data.prompts.map(sanitizeCaption))
+          setImageLoaded(new Array(data.prompts.length).fill(false))
+        } else if (type === 'image') {
+          received += 1
+          slots = [...slots]
+          slots[data.index] = data.url
+          setImages(slots)
+        } else if (type === 'error' && received === 0) {
+          setImages([])
+          throw new Error(data.detail || 'Kunde inte skapa bilder')
+        }
+      }
+    }
+    // Ta bort platser för bilder som aldrig blev klara
+    const keep = slots.map((src, i) => (src ? i : -1)).filter(i => i >= 0)
+    if (keep.length !== slots.length) {
+      setImages(keep.map(i => slots[i]))
+      setImagePrompts(prev => keep.map(i => prev[i]))
+      setImageLoaded(prev => keep.map(i => prev[i]))
+    }
+  }
+
   // Ladda ev. sparade bilder för denna saga vid öppning
   useEffect(() => {
     let cancelled = false
@@ -69,7 +113,7 @@ const StoryReaderPage = ({ selectedTheme = 'candy' }) => {
       if (!story || !story.id) return
       if ((images && images.length) > 0) return
       try {
-        const res = await fetch(`http://localhost:8000/stories/${story.id}/images`, {
+        const res = await fetch(`http://localhost:8000/stories/${story.id}/images?variant=medium`, {
           headers: { ...(user?.token ? { 'Authorization': `Bearer ${user.token}` } : {}) }
         })
         if (!res.ok) return
@@ -468,10 +512,13 @@ const StoryReaderPage = ({ selectedTheme = 'candy' }) => {
                 try {
                   setIsGeneratingImages(true)
                   const isUniversal = story.storyType === 'universal'
-                  const url = isUniversal
-                    ? `http://localhost:8000/universal-stories/${story.id}/images?num_images=3&size=1024x1024`
-                    : `http://localhost:8000/stories/${story.id}/images?num_images=3&size=1024x1024`
-                  const res = await fetch(url, { method: 'POST', headers: { ...(user?.token ? { 'Authorization': `Bearer ${user.token}` } : {}) } })
+                  const authHeaders = { ...(user?.token ? { 'Authorization': `Bearer ${user.token}` } : {}) }
+                  if (!isUniversal) {
+                    await streamStoryImages(story.id, authHeaders)
+                    return
+                  }
+                  const url = `http://localhost:8000/universal-stories/${story.id}/images?num_images=3&size=1024x1024&variant=medium`
+                  const res = await fetch(url, { method: 'POST', headers: authHeaders })
                   if (!res.ok) throw new Error('Kunde inte skapa bilder')
                   const data = await res.json()
                   const imgs = Array.isArray(data.images) ? data.images : []
@@ -503,7 +550,7 @@ const StoryReaderPage = ({ selectedTheme = 'candy' }) => {
             {(() => {
               (async () => {
                 try {
-                  const res = await fetch(`http://localhost:8000/stories/${story.id}/images`, { headers: { ...(user?.token ? { 'Authorization': `Bearer ${user.token}` } : {}) } })
+                  const res = await fetch(`http://localhost:8000/stories/${story.id}/images?variant=medium`, { headers: { ...(user?.token ? { 'Authorization': `Bearer ${user.token}` } : {}) } })
                   if (res.ok) {
                     const data = await res.json()
                     if (Array.isArray(data.images) && data.images.length > 0) {
@@ -548,7 +595,7 @@ const StoryReaderPage = ({ selectedTheme = 'candy' }) => {
                 ref={el => (thumbRefs.current[i] = el)}
               >
                 {!imageLoaded[i] && <div style={{...placeholderStyle, animation: 'shimmer 1.2s linear infinite'}} />}
-                <img
+                {src && <img
                   src={src}
                   alt="Illustration"
                   style={{
@@ -566,7 +613,7 @@ const StoryReaderPage = ({ selectedTheme = 'candy' }) => {
                     copy[i] = true
                     return copy
                   })}
-                />
+                />}
                 {imagePrompts[i] && (
                   <div style={imageCaptionStyle}>{imagePrompts[i]}</div>
                 )}